@@ -1,39 +1,100 @@
-from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, Blueprint, current_app, render_template_string, request, jsonify, redirect, url_for, flash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import os
 import uuid
 from datetime import datetime
 from functools import wraps
 
+from sqlalchemy.exc import IntegrityError
+
 # Import configurations and models
 from config import config
-from models import db, bcrypt, User, Product, Order, OrderItem, Review, Wishlist
-from email_utils import mail, send_order_confirmation_email, send_welcome_email, send_password_reset_email
-from payment_utils import create_payment_intent, confirm_payment
+from models import db, User, Product, Order, OrderItem, Review, Wishlist
+from email_utils import mail, mail_pool, email_templates, send_welcome_email, send_password_reset_email
+import payment_utils
+from payment_utils import confirm_payment, retrieve_payment_intent
+from query_utils import (paginate_products, InvalidCursor, PRODUCT_SORTS, DEFAULT_PAGE_SIZE,
+                         orders_for_user, get_order_or_404, recent_orders, user_summaries, USER_SORTS,
+                         registration_conflicts)
+from search_utils import product_search
+from cache_utils import cache
+from job_queue import job_queue
+from password_hashing import password_hasher, HashingBusy
+from session_principal import principals
+from rate_limit import rate_limiter
+from metrics import metrics
+from health import health
+import db_utils
+from db_utils import pool_stats
+from inventory import reserve_stock
+from order_settlement import schedule_settlement, cancel_order
+from stripe_webhooks import verify_event, record_event, WebhookError
+from cart_store import cart_store, CartConflict
+from etag_utils import etag, catalog_version, cart_version, wishlist_version, orders_version
+from commands import register_commands, init_db
 from forms import LoginForm, RegisterForm, ProductForm, CheckoutForm, ReviewForm
 from templates import MAIN_TEMPLATE, ADMIN_DASHBOARD_TEMPLATE
 from templates_orders import ORDERS_PAGE_TEMPLATE
 
-app = Flask(__name__)
-
-# Load configuration
-env = os.environ.get('FLASK_ENV', 'development')
-app.config.from_object(config[env])
-
-# Initialize extensions
-db.init_app(app)
-bcrypt.init_app(app)
-mail.init_app(app)
+main = Blueprint('main', __name__)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 
+def create_app(config_name=None):
+    """Application factory used by the WSGI entry point, the CLI and the dev server"""
+    app = Flask(__name__)
+    
+    # Load configuration
+    config_name = config_name or os.environ.get('FLASK_ENV', 'development')
+    app.config.from_object(config[config_name])
+    
+    if config_name == 'production' and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        print("WARNING: production is running on SQLite; set DATABASE_URL to a PostgreSQL database")
+    
+    # Initialize extensions
+    db.init_app(app)
+    db_utils.init_app(app)
+    password_hasher.init_app(app)
+    payment_utils.init_app(app)
+    mail.init_app(app)
+    mail_pool.init_app(app)
+    email_templates.init_app(app)
+    product_search.init_app(app)
+    cache.init_app(app)
+    job_queue.init_app(app)
+    cart_store.init_app(app)
+    login_manager.init_app(app)
+    principals.init_app(app)
+    metrics.init_app(app)
+    health.init_app(app)
+    rate_limiter.init_app(app)
+    
+    app.register_blueprint(main)
+    app.register_error_handler(HashingBusy, hashing_busy)
+    app.register_error_handler(CartConflict, cart_conflict)
+    register_commands(app)
+    
+    return app
+
+def hashing_busy(error):
+    """Login/registration burst beyond the hashing queue: shed it instead of slowing the site"""
+    response = jsonify({'success': False, 'message': 'Too many sign-in attempts right now, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def cart_conflict(error):
+    """Concurrent edits to the same cart kept colliding: the client retries and sees the merged cart"""
+    response = jsonify({'success': False, 'message': 'Your cart was changed at the same time, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 409
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Cached read-only snapshot; the ORM User only loads if a route needs more
+    return principals.load(int(user_id))
 
 # Admin required decorator
 def admin_required(f):
@@ -42,259 +103,21 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_admin:
             flash('You need admin privileges to access this page.', 'danger')
-            return redirect(url_for('home'))
+            return redirect(url_for('main.home'))
         return f(*args, **kwargs)
     return decorated_function
 
-# Initialize database and seed data
-def init_db():
-    with app.app_context():
-        db.create_all()
-        
-        # Create admin user if not exists
-        admin = User.query.filter_by(email='admin@shopeasy.com').first()
-        if not admin:
-            admin = User(
-                email='admin@shopeasy.com',
-                username='admin',
-                is_admin=True
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-        
-        # Seed products if empty
-        if Product.query.count() == 0:
-            products = [
-                # Electronics Products
-                Product(
-                    name="Wireless Headphones",
-                    description="High-quality wireless headphones with noise cancellation",
-                    price=99.99,
-                    image_url="https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=400&h=300&fit=crop",
-                    category="Electronics",
-                    stock=50,
-                    rating=4.5,
-                    features=["Noise Cancellation", "30hr Battery", "Wireless", "Bluetooth 5.0", "Foldable Design", "Built-in Mic", "Premium Sound"]
-                ),
-                Product(
-                    name="Smart Watch",
-                    description="Feature-rich smartwatch with health monitoring",
-                    price=199.99,
-                    image_url="https://images.unsplash.com/photo-1523275335684-37898b6baf30?w=400&h=300&fit=crop",
-                    category="Electronics",
-                    stock=30,
-                    rating=4.2,
-                    features=["Heart Rate Monitor", "GPS", "Water Resistant", "Sleep Tracking", "Fitness Modes", "Notifications", "Long Battery"]
-                ),
-                Product(
-                    name="Laptop",
-                    description="Powerful laptop for work and gaming",
-                    price=899.99,
-                    image_url="https://images.unsplash.com/photo-1496181133206-80ce9b88a853?w=400&h=300&fit=crop",
-                    category="Electronics",
-                    stock=15,
-                    rating=4.8,
-                    features=["16GB RAM", "512GB SSD", "Intel i7", "15.6 Display", "Backlit Keyboard", "Windows 11", "Lightweight"]
-                ),
-                Product(
-                    name="Wireless Mouse",
-                    description="Ergonomic wireless mouse with precision tracking",
-                    price=29.99,
-                    image_url="https://images.unsplash.com/photo-1527864550417-7fd91fc51a46?w=400&h=300&fit=crop",
-                    category="Electronics",
-                    stock=100,
-                    rating=4.3,
-                    features=["Wireless", "Ergonomic", "Long Battery", "DPI Adjustable", "Silent Click", "USB Receiver"]
-                ),
-                
-                # Fashion Products
-                Product(
-                    name="Running Shoes",
-                    description="Comfortable running shoes for all terrains",
-                    price=79.99,
-                    image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?w=400&h=300&fit=crop",
-                    category="Fashion",
-                    stock=45,
-                    rating=4.7,
-                    features=["Lightweight", "Breathable", "Durable", "Cushioned Sole", "Anti-Slip", "Mesh Upper"]
-                ),
-                Product(
-                    name="Backpack",
-                    description="Waterproof backpack with laptop compartment",
-                    price=39.99,
-                    image_url="https://images.unsplash.com/photo-1553062407-98eeb64c6a62?w=400&h=300&fit=crop",
-                    category="Fashion",
-                    stock=40,
-                    rating=4.6,
-                    features=["Waterproof", "Laptop Sleeve", "Multiple Pockets", "USB Port", "Padded Straps", "30L Capacity"]
-                ),
-                Product(
-                    name="Sunglasses",
-                    description="Stylish UV protection sunglasses",
-                    price=49.99,
-                    image_url="https://images.unsplash.com/photo-1572635196237-14b3f281503f?w=400&h=300&fit=crop",
-                    category="Fashion",
-                    stock=60,
-                    rating=4.4,
-                    features=["UV Protection", "Polarized", "Lightweight", "Scratch Resistant", "Metal Frame", "Case Included"]
-                ),
-                Product(
-                    name="Leather Jacket",
-                    description="Premium leather jacket for all seasons",
-                    price=149.99,
-                    image_url="https://images.unsplash.com/photo-1551028719-00167b16eac5?w=400&h=300&fit=crop",
-                    category="Fashion",
-                    stock=20,
-                    rating=4.9,
-                    features=["Genuine Leather", "Warm", "Stylish", "Multiple Pockets", "Zipper Closure", "Premium Quality"]
-                ),
-                
-                # Home Products
-                Product(
-                    name="Coffee Maker",
-                    description="Automatic coffee maker with timer",
-                    price=49.99,
-                    image_url="https://images.unsplash.com/photo-1517668808822-9ebb02f2a0e6?w=400&h=300&fit=crop",
-                    category="Home",
-                    stock=25,
-                    rating=4.3,
-                    features=["24hr Timer", "Auto Shut-off", "Programmable", "12 Cup Capacity", "Keep Warm", "Easy Clean"]
-                ),
-                Product(
-                    name="Desk Lamp",
-                    description="LED desk lamp with adjustable brightness",
-                    price=29.99,
-                    image_url="https://images.unsplash.com/photo-1507473885765-e6ed057f782c?w=400&h=300&fit=crop",
-                    category="Home",
-                    stock=60,
-                    rating=4.4,
-                    features=["Adjustable Brightness", "USB Port", "Modern Design", "Touch Control", "Eye Protection", "Energy Saving"]
-                ),
-                Product(
-                    name="Wall Clock",
-                    description="Modern minimalist wall clock",
-                    price=24.99,
-                    image_url="https://images.unsplash.com/photo-1563861826100-9cb868fdbe1c?w=400&h=300&fit=crop",
-                    category="Home",
-                    stock=35,
-                    rating=4.2,
-                    features=["Silent Movement", "Modern Design", "Easy to Read", "Battery Operated", "12 Inch", "Wall Mount"]
-                ),
-                Product(
-                    name="Plant Pot Set",
-                    description="Set of 3 ceramic plant pots",
-                    price=19.99,
-                    image_url="https://images.unsplash.com/photo-1485955900006-10f4d324d411?w=400&h=300&fit=crop",
-                    category="Home",
-                    stock=50,
-                    rating=4.5,
-                    features=["Ceramic", "Drainage Holes", "Set of 3", "Different Sizes", "Indoor/Outdoor", "Decorative"]
-                ),
-                
-                # Sports Products
-                Product(
-                    name="Yoga Mat",
-                    description="Non-slip yoga mat with carrying strap",
-                    price=34.99,
-                    image_url="https://images.unsplash.com/photo-1601925260368-ae2f83cf8b7f?w=400&h=300&fit=crop",
-                    category="Sports",
-                    stock=70,
-                    rating=4.6,
-                    features=["Non-slip", "Eco-friendly", "6mm Thick", "Carrying Strap", "Easy Clean", "Durable Material"]
-                ),
-                Product(
-                    name="Dumbbell Set",
-                    description="Adjustable dumbbell set for home workout",
-                    price=89.99,
-                    image_url="https://images.unsplash.com/photo-1517836357463-d25dfeac3438?w=400&h=300&fit=crop",
-                    category="Sports",
-                    stock=30,
-                    rating=4.7,
-                    features=["Adjustable Weight", "Compact", "Durable", "5-25 lbs Range", "Anti-Roll Design", "Rubber Coated"]
-                ),
-                Product(
-                    name="Water Bottle",
-                    description="Insulated stainless steel water bottle",
-                    price=19.99,
-                    image_url="https://images.unsplash.com/photo-1602143407151-7111542de6e8?w=400&h=300&fit=crop",
-                    category="Sports",
-                    stock=100,
-                    rating=4.5,
-                    features=["Insulated", "BPA Free", "750ml", "Leak Proof", "24hr Cold", "Stainless Steel"]
-                ),
-                
-                # Books Products
-                Product(
-                    name="Python Programming Book",
-                    description="Complete guide to Python programming",
-                    price=39.99,
-                    image_url="https://images.unsplash.com/photo-1589998059171-988d887df646?w=400&h=300&fit=crop",
-                    category="Books",
-                    stock=50,
-                    rating=4.8,
-                    features=["Beginner Friendly", "500 Pages", "Code Examples", "Exercises", "Hardcover", "Latest Edition"]
-                ),
-                Product(
-                    name="Business Strategy Book",
-                    description="Essential business strategies for success",
-                    price=29.99,
-                    image_url="https://images.unsplash.com/photo-1507003211169-0a1dd7228f2d?w=400&h=300&fit=crop",
-                    category="Books",
-                    stock=40,
-                    rating=4.6,
-                    features=["Best Seller", "Case Studies", "Practical Tips", "300 Pages", "Paperback", "Expert Author"]
-                ),
-                Product(
-                    name="Cookbook Collection",
-                    description="Delicious recipes from around the world",
-                    price=34.99,
-                    image_url="https://images.unsplash.com/photo-1476224203421-9ac39bcb3327?w=400&h=300&fit=crop",
-                    category="Books",
-                    stock=35,
-                    rating=4.7,
-                    features=["200+ Recipes", "Full Color", "Step by Step", "Nutritional Info", "Hardcover", "Illustrated"]
-                ),
-                
-                # Toys Products
-                Product(
-                    name="Building Blocks Set",
-                    description="Creative building blocks for kids",
-                    price=44.99,
-                    image_url="https://images.unsplash.com/photo-1558060370-d644479cb6f7?w=400&h=300&fit=crop",
-                    category="Toys",
-                    stock=60,
-                    rating=4.9,
-                    features=["500 Pieces", "Safe Materials", "Age 3+", "Educational", "Storage Box", "Multiple Colors"]
-                ),
-                Product(
-                    name="Remote Control Car",
-                    description="High-speed RC car with rechargeable battery",
-                    price=59.99,
-                    image_url="https://images.unsplash.com/photo-1517524008697-84bbe3c3fd98?w=400&h=300&fit=crop",
-                    category="Toys",
-                    stock=45,
-                    rating=4.5,
-                    features=["High Speed", "Rechargeable", "Remote Control", "Durable", "LED Lights", "Age 6+"]
-                ),
-                Product(
-                    name="Puzzle Game",
-                    description="Challenging 1000-piece jigsaw puzzle",
-                    price=24.99,
-                    image_url="https://images.unsplash.com/photo-1611604548018-d56bbd85d681?w=400&h=300&fit=crop",
-                    category="Toys",
-                    stock=55,
-                    rating=4.4,
-                    features=["1000 Pieces", "Beautiful Art", "Premium Quality", "Age 8+", "Gift Box", "Poster Included"]
-                )
-            ]
-            db.session.add_all(products)
-        
-        db.session.commit()
-        print("Database initialized successfully!")
-
 # ==================== AUTHENTICATION ROUTES ====================
 
-@app.route('/api/register', methods=['POST'])
+def registration_conflict_response(conflicts):
+    if 'email' in conflicts:
+        return jsonify({'success': False, 'message': 'Email already registered'}), 400
+    if 'username' in conflicts:
+        return jsonify({'success': False, 'message': 'Username already taken'}), 400
+    return jsonify({'success': False, 'message': 'Email or username already registered'}), 400
+
+@main.route('/api/register', methods=['POST'])
+@rate_limiter.limit('auth')
 def register():
     """User registration"""
     data = request.get_json()
@@ -303,14 +126,12 @@ def register():
     if not data.get('email') or not data.get('password') or not data.get('username'):
         return jsonify({'success': False, 'message': 'All fields are required'}), 400
     
-    # Check if user exists
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({'success': False, 'message': 'Email already registered'}), 400
-    
-    if User.query.filter_by(username=data['username']).first():
-        return jsonify({'success': False, 'message': 'Username already taken'}), 400
+    # Check both unique fields in one query
+    conflicts = registration_conflicts(data['email'], data['username'])
+    if conflicts:
+        return registration_conflict_response(conflicts)
     
-    # Create new user
+    # Create new user (bcrypt runs on the bounded hashing executor)
     user = User(
         email=data['email'],
         username=data['username']
@@ -318,13 +139,19 @@ def register():
     user.set_password(data['password'])
     
     db.session.add(user)
-    db.session.commit()
-    
-    # Send welcome email
-    send_welcome_email(user, app)
+    # Welcome email is queued in the same transaction and sent by a job worker
+    send_welcome_email(user, commit=False)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent sign-up took the email or username after our check: the unique index decides
+        db.session.rollback()
+        return registration_conflict_response(registration_conflicts(data['email'], data['username']))
+    job_queue.wake()
     
     # Log user in
     login_user(user)
+    cart_store.merge_guest_cart(user.id)
     
     return jsonify({
         'success': True,
@@ -337,7 +164,8 @@ def register():
         }
     })
 
-@app.route('/api/login', methods=['POST'])
+@main.route('/api/login', methods=['POST'])
+@rate_limiter.limit('auth')
 def login():
     """User login"""
     data = request.get_json()
@@ -348,7 +176,12 @@ def login():
     user = User.query.filter_by(email=data['email']).first()
     
     if user and user.check_password(data['password']):
+        if password_hasher.needs_rehash(user.password_hash):
+            # BCRYPT_LOG_ROUNDS changed since this hash was made: upgrade it while we have the password
+            user.set_password(data['password'])
+            db.session.commit()
         login_user(user)
+        cart_store.merge_guest_cart(user.id)
         return jsonify({
             'success': True,
             'message': 'Login successful!',
@@ -362,14 +195,16 @@ def login():
     
     return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
 
-@app.route('/api/logout', methods=['POST'])
+@main.route('/api/logout', methods=['POST'])
+@rate_limiter.limit()
 @login_required
 def logout():
     """User logout"""
     logout_user()
     return jsonify({'success': True, 'message': 'Logged out successfully'})
 
-@app.route('/api/current-user')
+@main.route('/api/current-user')
+@rate_limiter.limit()
 def get_current_user():
     """Get current logged-in user"""
     if current_user.is_authenticated:
@@ -386,11 +221,9 @@ def get_current_user():
 
 # ==================== PRODUCT ROUTES ====================
 
-@app.route('/api/products')
-def get_products():
-    """Get all products"""
-    products = Product.query.all()
-    return jsonify([{
+def product_to_dict(p):
+    """Serialize a product for the storefront API"""
+    return {
         'id': p.id,
         'name': p.name,
         'description': p.description,
@@ -401,23 +234,58 @@ def get_products():
         'inStock': p.in_stock,
         'rating': p.rating,
         'features': p.features or []
-    } for p in products])
+    }
+
+@main.route('/api/products')
+@rate_limiter.limit('browse')
+@etag(catalog_version)
+@cache.cached('catalog')
+def get_products():
+    """
+    Get products
+
+    Without `limit`/`cursor` the whole catalog is returned as a list (legacy
+    mode). With them, one keyset page is returned together with `next_cursor`.
+    """
+    category = request.args.get('category')
+    if category == 'all':
+        category = None
+    sort = request.args.get('sort', 'newest')
+    if sort not in PRODUCT_SORTS:
+        return jsonify({'success': False, 'message': f'Invalid sort: {sort}'}), 400
+
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        query = Product.query
+        if category:
+            query = query.filter_by(category=category)
+        return jsonify([product_to_dict(p) for p in query.all()])
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    try:
+        products, next_cursor = paginate_products(
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            category=category,
+            sort=sort
+        )
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({
+        'products': [product_to_dict(p) for p in products],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
 
-@app.route('/api/products/<int:product_id>')
+@main.route('/api/products/<int:product_id>')
+@rate_limiter.limit('browse')
+@etag(catalog_version)
+@cache.cached('catalog')
 def get_product(product_id):
     """Get single product"""
     product = Product.query.get_or_404(product_id)
     return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'price': product.price,
-        'image': product.image_url,
-        'category': product.category,
-        'stock': product.stock,
-        'inStock': product.in_stock,
-        'rating': product.rating,
-        'features': product.features or [],
+        **product_to_dict(product),
         'reviews': [{
             'id': r.id,
             'user': r.user.username,
@@ -427,87 +295,162 @@ def get_product(product_id):
         } for r in product.reviews]
     })
 
+@main.route('/api/search')
+@rate_limiter.limit('browse')
+@etag(catalog_version)
+@cache.cached('catalog')
+def search_products():
+    """Full-text product search with prefix matching and relevance ranking"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    category = request.args.get('category') or None
+    if category == 'all':
+        category = None
+
+    if not query:
+        return jsonify({'query': query, 'products': []})
+
+    product_ids = product_search.search(query, limit=limit, category=category)
+    if not product_ids:
+        return jsonify({'query': query, 'products': []})
+
+    by_id = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+
+    return jsonify({
+        'query': query,
+        'products': [product_to_dict(by_id[pid]) for pid in product_ids if pid in by_id]
+    })
+
 # ==================== CART ROUTES ====================
 
-@app.route('/api/cart')
+@main.route('/api/cart')
+@rate_limiter.limit('cart')
+@etag(lambda: cart_version(cart_store.lines()), private=True)
 def get_cart():
     """Get cart items"""
-    cart = session.get('cart', [])
-    return jsonify(cart)
+    return jsonify(cart_store.items())
 
-@app.route('/api/cart/add', methods=['POST'])
+@main.route('/api/cart/add', methods=['POST'])
+@rate_limiter.limit('cart')
 def add_to_cart():
     """Add item to cart"""
     data = request.get_json()
     product_id = data.get('product_id')
     
-    product = Product.query.get_or_404(product_id)
+    product = db.get_or_404(Product, product_id)
     
     if not product.in_stock:
         return jsonify({'success': False, 'message': 'Product out of stock'}), 400
     
-    cart = session.get('cart', [])
-    
-    # Check if product already in cart
-    cart_item = next((item for item in cart if item['id'] == product_id), None)
-    
-    if cart_item:
-        if cart_item['quantity'] < product.stock:
-            cart_item['quantity'] += 1
-        else:
-            return jsonify({'success': False, 'message': 'Not enough stock'}), 400
-    else:
-        cart.append({
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'image': product.image_url,
-            'quantity': 1
-        })
+    quantity = cart_store.lines().get(product.id, 0)
+    if quantity >= product.stock:
+        return jsonify({'success': False, 'message': 'Not enough stock'}), 400
     
-    session['cart'] = cart
-    return jsonify({'success': True, 'cart': cart})
+    cart_store.set_quantity(product.id, quantity + 1)
+    return jsonify({'success': True, 'cart': cart_store.items()})
 
-@app.route('/api/cart/remove', methods=['POST'])
+@main.route('/api/cart/remove', methods=['POST'])
+@rate_limiter.limit('cart')
 def remove_from_cart():
     """Remove item from cart"""
     data = request.get_json()
     product_id = data.get('product_id')
     
-    cart = session.get('cart', [])
-    cart = [item for item in cart if item['id'] != product_id]
-    
-    session['cart'] = cart
-    return jsonify({'success': True, 'cart': cart})
+    if product_id in cart_store.lines():
+        cart_store.set_quantity(product_id, 0)
+    return jsonify({'success': True, 'cart': cart_store.items()})
 
-@app.route('/api/cart/update', methods=['POST'])
+@main.route('/api/cart/update', methods=['POST'])
+@rate_limiter.limit('cart')
 def update_cart_quantity():
     """Update cart item quantity"""
     data = request.get_json()
     product_id = data.get('product_id')
     quantity = data.get('quantity')
     
-    product = Product.query.get_or_404(product_id)
+    product = db.get_or_404(Product, product_id)
     
     if quantity > product.stock:
         return jsonify({'success': False, 'message': 'Not enough stock'}), 400
     
-    cart = session.get('cart', [])
-    cart_item = next((item for item in cart if item['id'] == product_id), None)
-    
-    if cart_item:
-        if quantity <= 0:
-            cart = [item for item in cart if item['id'] != product_id]
+    if product.id in cart_store.lines():
+        cart_store.set_quantity(product.id, quantity)
+    return jsonify({'success': True, 'cart': cart_store.items()})
+
+CART_BATCH_MAX_OPS = 50
+
+@main.route('/api/cart/batch', methods=['POST'])
+@rate_limiter.limit('cart')
+def batch_cart():
+    """
+    Apply several cart operations in one request
+    
+    Body: {"ops": [{"op": "add", "product_id": 1, "quantity": 1},
+                   {"op": "update", "product_id": 2, "quantity": 3},
+                   {"op": "remove", "product_id": 3}]}
+    Operations run in order against one product lookup; a failed operation
+    is reported in results and does not stop the others.
+    """
+    data = request.get_json(silent=True) or {}
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'success': False, 'message': 'ops must be a non-empty list'}), 400
+    if len(ops) > CART_BATCH_MAX_OPS:
+        return jsonify({'success': False, 'message': f'At most {CART_BATCH_MAX_OPS} ops per batch'}), 400
+    
+    lines = dict(cart_store.lines())
+    ids = set(lines)
+    for op in ops:
+        if isinstance(op, dict) and isinstance(op.get('product_id'), int):
+            ids.add(op['product_id'])
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))} if ids else {}
+    
+    results = []
+    changed = {}
+    for op in ops:
+        kind = op.get('op') if isinstance(op, dict) else None
+        product_id = op.get('product_id') if isinstance(op, dict) else None
+        quantity = op.get('quantity', 1 if kind == 'add' else None) if isinstance(op, dict) else None
+        product = products.get(product_id)
+        current = lines.get(product_id, 0)
+        
+        if kind not in ('add', 'update', 'remove'):
+            error = 'Unknown op'
+        elif not isinstance(product_id, int):
+            error = 'product_id must be an integer'
+        elif product is None and kind != 'remove':
+            error = 'Product not found'
+        elif kind != 'remove' and not isinstance(quantity, int):
+            error = 'quantity must be an integer'
+        elif kind == 'add' and (quantity <= 0 or current + quantity > product.stock):
+            error = 'Product out of stock' if not product.in_stock else 'Not enough stock'
+        elif kind == 'update' and quantity > product.stock:
+            error = 'Not enough stock'
         else:
-            cart_item['quantity'] = quantity
+            error = None
+            new_quantity = {'add': current + (quantity or 0), 'update': quantity, 'remove': 0}[kind]
+            if new_quantity > 0:
+                lines[product_id] = new_quantity
+            else:
+                lines.pop(product_id, None)
+            changed[product_id] = max(new_quantity, 0)
+        
+        results.append({'success': True} if error is None else
+                       {'success': False, 'product_id': product_id, 'message': error})
     
-    session['cart'] = cart
-    return jsonify({'success': True, 'cart': cart})
+    cart_store.set_many(changed)
+    return jsonify({
+        'success': all(r['success'] for r in results),
+        'results': results,
+        'cart': cart_store.items(lines, products)
+    })
 
 # ==================== WISHLIST ROUTES ====================
 
-@app.route('/api/wishlist')
+@main.route('/api/wishlist')
+@rate_limiter.limit('cart')
 @login_required
+@etag(lambda: wishlist_version(current_user.id), private=True)
 def get_wishlist():
     """Get user wishlist"""
     wishlist_items = Wishlist.query.filter_by(user_id=current_user.id).all()
@@ -519,7 +462,8 @@ def get_wishlist():
         'inStock': item.product.in_stock
     } for item in wishlist_items])
 
-@app.route('/api/wishlist/toggle', methods=['POST'])
+@main.route('/api/wishlist/toggle', methods=['POST'])
+@rate_limiter.limit('cart')
 @login_required
 def toggle_wishlist():
     """Add/remove item from wishlist"""
@@ -556,7 +500,8 @@ def toggle_wishlist():
         } for item in wishlist]
     })
 
-@app.route('/api/wishlist/clear', methods=['POST'])
+@main.route('/api/wishlist/clear', methods=['POST'])
+@rate_limiter.limit('cart')
 @login_required
 def clear_wishlist():
     """Clear user wishlist"""
@@ -567,12 +512,42 @@ def clear_wishlist():
 
 # ==================== CHECKOUT & ORDER ROUTES ====================
 
-@app.route('/api/checkout', methods=['POST'])
+def checkout_response(order):
+    """
+    Accepted-order payload; 202 while the payment is still being settled
+    
+    No Stripe call here: the settle_payment job creates the payment intent
+    and the client fetches its client_secret from the status endpoint.
+    """
+    return jsonify({
+        'success': True,
+        'message': 'Order received, confirming payment' if order.payment_status == 'pending' else 'Order placed successfully!',
+        'order_number': order.order_number,
+        'status': order.status,
+        'payment_status': order.payment_status,
+        'status_url': url_for('main.order_status', order_number=order.order_number)
+    }), 202 if order.payment_status == 'pending' else 200
+
+@main.route('/api/checkout', methods=['POST'])
+@rate_limiter.limit('checkout', priority='checkout')
 @login_required
 def checkout():
-    """Process checkout"""
+    """
+    Accept an order: reserve stock, persist it as pending and return at once
+    
+    Payment is settled by the settle_payment job (order_settlement.py); the
+    SPA polls /api/orders/<order_number>/status until it is paid or failed.
+    """
     data = request.get_json()
-    cart = session.get('cart', [])
+    
+    # A resubmitted checkout (same Idempotency-Key header) returns the order it already created
+    checkout_key = request.headers.get('Idempotency-Key', '')[:64] or None
+    if checkout_key:
+        existing = Order.query.filter_by(user_id=current_user.id, checkout_key=checkout_key).first()
+        if existing:
+            return checkout_response(existing)
+    
+    cart = cart_store.lines()
     
     if not cart:
         return jsonify({'success': False, 'message': 'Cart is empty'}), 400
@@ -586,34 +561,20 @@ def checkout():
         if not data.get(field):
             return jsonify({'success': False, 'message': f'{field} is required'}), 400
     
-    # Calculate total
-    total_amount = sum(item['price'] * item['quantity'] for item in cart)
+    # Reserve stock for every line up front (atomic, no read-modify-write)
+    reservation = reserve_stock(dict(cart))
+    if not reservation.ok:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': reservation.message, 'failures': reservation.failures}), 400
     
-    # Create payment intent (OPTIONAL - Skip if Stripe not configured)
-    payment_id = None
-    try:
-        if app.config.get('STRIPE_SECRET_KEY'):
-            payment_intent = create_payment_intent(
-                amount=total_amount,
-                metadata={
-                    'user_id': current_user.id,
-                    'user_email': current_user.email
-                }
-            )
-            if payment_intent:
-                payment_id = payment_intent.id
-    except Exception as e:
-        print(f"Stripe payment skipped: {e}")
-        # Continue without payment - for testing
-    
-    # Create order
+    # Create order (total from current catalog prices)
     order = Order(
         order_number=f'ORD-{uuid.uuid4().hex[:8].upper()}',
         user_id=current_user.id,
-        total_amount=total_amount,
-        status='confirmed',  # Auto-confirm for testing
-        payment_status='completed',  # Auto-complete for testing
-        payment_id=payment_id or f'TEST-{uuid.uuid4().hex[:8]}',
+        total_amount=reservation.total,
+        status='pending',
+        payment_status='pending',
+        checkout_key=checkout_key,
         shipping_name=data['shipping_name'],
         shipping_email=data['shipping_email'],
         shipping_address=data['shipping_address'],
@@ -627,48 +588,85 @@ def checkout():
     db.session.add(order)
     db.session.flush()  # Get order ID
     
-    # Create order items and update stock
-    for item in cart:
-        product = Product.query.get(item['id'])
-        if product.stock < item['quantity']:
-            db.session.rollback()
-            return jsonify({'success': False, 'message': f'Not enough stock for {product.name}'}), 400
-        
-        order_item = OrderItem(
+    # Create order items (stock was already taken by the reservation)
+    for product_id, quantity in reservation.lines.items():
+        db.session.add(OrderItem(
             order_id=order.id,
-            product_id=product.id,
-            quantity=item['quantity'],
-            price=product.price
-        )
-        db.session.add(order_item)
-        
-        # Update stock
-        product.stock -= item['quantity']
+            product_id=product_id,
+            quantity=quantity,
+            price=reservation.products[product_id].price
+        ))
     
-    db.session.commit()
+    schedule_settlement(order)  # Same transaction: the job exists exactly when the order does
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same checkout was submitted twice concurrently and the other request won
+        db.session.rollback()
+        existing = Order.query.filter_by(user_id=current_user.id, checkout_key=checkout_key).first()
+        if existing is None:
+            raise
+        return checkout_response(existing)
+    job_queue.wake()
+    cache.invalidate('catalog')
     
     # Clear cart
-    session['cart'] = []
+    cart_store.clear()
+    
+    return checkout_response(order)
+
+@main.route('/api/orders/<order_number>/status')
+@rate_limiter.limit(priority='checkout')
+@login_required
+def order_status(order_number):
+    """
+    Settlement progress of an order (polled by the SPA after checkout)
+    
+    ?client_secret=1 also returns the pending order's payment intent
+    client_secret for Stripe.js to confirm; None until the settle_payment
+    job has created the intent, so the client polls again.
+    """
+    row = db.session.query(Order.status, Order.payment_status, Order.payment_id) \
+        .filter(Order.order_number == order_number, Order.user_id == current_user.id).first()
+    if row is None:
+        return jsonify({'success': False, 'message': 'Order not found'}), 404
+    body = {
+        'order_number': order_number,
+        'status': row.status,
+        'payment_status': row.payment_status,
+        'settled': row.payment_status != 'pending'
+    }
+    if request.args.get('client_secret'):
+        intent = None
+        if row.payment_status == 'pending' and (row.payment_id or '').startswith('pi_'):
+            intent = retrieve_payment_intent(row.payment_id)
+        body['payment_client_secret'] = intent.client_secret if intent is not None else None
+    response = jsonify(body)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@main.route('/api/webhooks/stripe', methods=['POST'])
+@rate_limiter.exempt()
+def stripe_webhook():
+    """Receive Stripe events: verify, store once, apply in the background"""
+    if not current_app.config.get('STRIPE_WEBHOOK_SECRET'):
+        return jsonify({'success': False, 'message': 'Stripe webhooks are not configured'}), 503
     
-    # Send confirmation email (OPTIONAL - Skip if email not configured)
     try:
-        if app.config.get('MAIL_USERNAME'):
-            send_order_confirmation_email(order, app)
-    except Exception as e:
-        print(f"Email sending skipped: {e}")
+        event = verify_event(request.get_data(as_text=True), request.headers.get('Stripe-Signature', ''))
+    except WebhookError as e:
+        return jsonify({'success': False, 'message': f'Invalid webhook: {e}'}), 400
     
-    return jsonify({
-        'success': True,
-        'message': 'Order placed successfully!',
-        'order_number': order.order_number,
-        'payment_client_secret': 'test_secret_for_demo'
-    })
+    return jsonify({'received': True, 'queued': record_event(event)})
 
-@app.route('/api/orders')
+@main.route('/api/orders')
+@rate_limiter.limit(priority='checkout')
 @login_required
+@etag(lambda: orders_version(current_user.id), private=True)
 def get_orders():
     """Get user orders"""
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+    orders = orders_for_user(current_user.id)
     return jsonify([{
         'id': order.id,
         'order_number': order.order_number,
@@ -683,11 +681,12 @@ def get_orders():
         } for item in order.items]
     } for order in orders])
 
-@app.route('/api/orders/<int:order_id>')
+@main.route('/api/orders/<int:order_id>')
+@rate_limiter.limit(priority='checkout')
 @login_required
 def get_order(order_id):
     """Get single order details"""
-    order = Order.query.get_or_404(order_id)
+    order = get_order_or_404(order_id)
     
     # Check if user owns this order
     if order.user_id != current_user.id and not current_user.is_admin:
@@ -722,7 +721,10 @@ def get_order(order_id):
 
 # ==================== REVIEW ROUTES ====================
 
-@app.route('/api/reviews/<int:product_id>')
+@main.route('/api/reviews/<int:product_id>')
+@rate_limiter.limit('browse')
+@etag(catalog_version)
+@cache.cached('catalog')
 def get_product_reviews(product_id):
     """Get reviews for a product"""
     reviews = Review.query.filter_by(product_id=product_id).order_by(Review.created_at.desc()).all()
@@ -734,7 +736,8 @@ def get_product_reviews(product_id):
         'created_at': review.created_at.strftime('%Y-%m-%d')
     } for review in reviews])
 
-@app.route('/api/reviews/add', methods=['POST'])
+@main.route('/api/reviews/add', methods=['POST'])
+@rate_limiter.limit()
 @login_required
 def add_review():
     """Add product review"""
@@ -767,9 +770,10 @@ def add_review():
         comment=comment
     )
     
+    # Product rating counters are updated in SQL by the Review insert hook
     db.session.add(review)
-    product.update_rating()
     db.session.commit()
+    cache.invalidate('catalog')
     
     return jsonify({
         'success': True,
@@ -785,7 +789,8 @@ def add_review():
 
 # ==================== ADMIN ROUTES ====================
 
-@app.route('/admin')
+@main.route('/admin')
+@rate_limiter.limit(priority='admin')
 @admin_required
 def admin_dashboard():
     """Admin dashboard"""
@@ -796,16 +801,15 @@ def admin_dashboard():
         Order.payment_status == 'completed'
     ).scalar() or 0
     
-    recent_orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
-    
     return render_template_string(ADMIN_DASHBOARD_TEMPLATE, 
                                  total_users=total_users,
                                  total_products=total_products,
                                  total_orders=total_orders,
                                  total_revenue=total_revenue,
-                                 recent_orders=recent_orders)
+                                 recent_orders=recent_orders(limit=10))
 
-@app.route('/api/admin/products', methods=['GET', 'POST'])
+@main.route('/api/admin/products', methods=['GET', 'POST'])
+@rate_limiter.limit(priority='admin')
 @admin_required
 def admin_products():
     """Admin product management"""
@@ -823,7 +827,11 @@ def admin_products():
         )
         
         db.session.add(product)
+        db.session.flush()  # Get product ID for the search index
+        product_search.index_product(product)
         db.session.commit()
+        cache.invalidate('catalog')
+        product_search.invalidate()
         
         return jsonify({'success': True, 'message': 'Product added successfully', 'product_id': product.id})
     
@@ -840,15 +848,19 @@ def admin_products():
         'rating': p.rating
     } for p in products])
 
-@app.route('/api/admin/products/<int:product_id>', methods=['PUT', 'DELETE'])
+@main.route('/api/admin/products/<int:product_id>', methods=['PUT', 'DELETE'])
+@rate_limiter.limit(priority='admin')
 @admin_required
 def admin_product_detail(product_id):
     """Update or delete product"""
     product = Product.query.get_or_404(product_id)
     
     if request.method == 'DELETE':
+        product_search.remove_product(product.id)
         db.session.delete(product)
         db.session.commit()
+        cache.invalidate('catalog')
+        product_search.invalidate()
         return jsonify({'success': True, 'message': 'Product deleted successfully'})
     
     # PUT request
@@ -864,15 +876,19 @@ def admin_product_detail(product_id):
     if data.get('features'):
         product.features = data['features'].split(',') if isinstance(data['features'], str) else data['features']
     
+    product_search.index_product(product)
     db.session.commit()
+    cache.invalidate('catalog')
+    product_search.invalidate()
     
     return jsonify({'success': True, 'message': 'Product updated successfully'})
 
-@app.route('/api/admin/orders')
+@main.route('/api/admin/orders')
+@rate_limiter.limit('export', priority='admin')
 @admin_required
 def admin_orders():
     """Get all orders for admin"""
-    orders = Order.query.order_by(Order.created_at.desc()).all()
+    orders = recent_orders()
     return jsonify([{
         'id': order.id,
         'order_number': order.order_number,
@@ -883,7 +899,8 @@ def admin_orders():
         'created_at': order.created_at.strftime('%Y-%m-%d %H:%M')
     } for order in orders])
 
-@app.route('/api/admin/orders/<int:order_id>/status', methods=['PUT'])
+@main.route('/api/admin/orders/<int:order_id>/status', methods=['PUT'])
+@rate_limiter.limit(priority='admin')
 @admin_required
 def update_order_status(order_id):
     """Update order status"""
@@ -893,46 +910,122 @@ def update_order_status(order_id):
     new_status = data.get('status')
     if new_status not in ['pending', 'confirmed', 'shipped', 'delivered', 'cancelled']:
         return jsonify({'success': False, 'message': 'Invalid status'}), 400
+    if order.status == 'cancelled':
+        # Its stock is released and its payment cancelled or refunded
+        return jsonify({'success': False, 'message': 'A cancelled order cannot be reopened'}), 409
     
-    order.status = new_status
-    db.session.commit()
+    if new_status == 'cancelled':
+        # Releases the stock and cancels or refunds the payment (order_settlement)
+        cancel_order(order)
+    else:
+        order.status = new_status
+        db.session.commit()
     
     return jsonify({'success': True, 'message': 'Order status updated'})
 
-@app.route('/api/admin/users')
+@main.route('/api/admin/cache')
+@rate_limiter.limit(priority='admin')
+@admin_required
+def admin_cache_stats():
+    """Cache hit/miss counters for this process"""
+    return jsonify({**cache.stats(), 'principals': principals.stats()})
+
+@main.route('/api/admin/db-pool')
+@rate_limiter.limit(priority='admin')
+@admin_required
+def admin_db_pool_stats():
+    """Connection pool checkout wait statistics for this process"""
+    return jsonify(pool_stats.snapshot(db.engine.pool))
+
+@main.route('/api/admin/users')
+@rate_limiter.limit('export', priority='admin')
 @admin_required
 def admin_users():
-    """Get all users"""
-    users = User.query.all()
-    return jsonify([{
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'is_admin': user.is_admin,
-        'created_at': user.created_at.strftime('%Y-%m-%d'),
-        'total_orders': len(user.orders)
-    } for user in users])
+    """Get users with order aggregates, paginated, sortable and searchable"""
+    sort = request.args.get('sort', 'created_at')
+    if sort not in USER_SORTS:
+        return jsonify({'success': False, 'message': f'Invalid sort: {sort}'}), 400
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    
+    rows, total = user_summaries(
+        search=request.args.get('q', '').strip() or None,
+        sort=sort,
+        descending=request.args.get('order', 'desc') != 'asc',
+        page=page,
+        per_page=per_page
+    )
+    
+    return jsonify({
+        'users': [{
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'is_admin': user.is_admin,
+            'created_at': user.created_at.strftime('%Y-%m-%d'),
+            'total_orders': total_orders,
+            'total_spent': round(float(total_spent), 2),
+            'last_order_at': last_order_at.strftime('%Y-%m-%d') if last_order_at else None
+        } for user, total_orders, total_spent, last_order_at in rows],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    })
+
+@main.route('/metrics')
+@rate_limiter.exempt()
+def prometheus_metrics():
+    """Request, database and cache metrics in Prometheus text format"""
+    if not metrics.enabled:
+        return jsonify({'success': False, 'message': 'Metrics are disabled'}), 404
+    if not metrics.authorized():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    return metrics.export(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+                                   'Cache-Control': 'no-store'}
+
+@main.route('/healthz')
+@rate_limiter.exempt()
+def healthz():
+    """Liveness probe: the process is serving requests (no I/O)"""
+    return jsonify({'status': 'ok'}), 200, {'Cache-Control': 'no-store'}
+
+@main.route('/readyz')
+@rate_limiter.exempt()
+def readyz():
+    """Readiness probe: database reachable, schema in place and not draining"""
+    ready, details = health.readiness()
+    return jsonify({'status': 'ready' if ready else 'unavailable', **details}), 200 if ready else 503, \
+        {'Cache-Control': 'no-store'}
 
 # ==================== MAIN ROUTE ====================
 
-@app.route('/')
+@main.route('/')
+@rate_limiter.limit('browse')
 def home():
-    """Main application page"""
-    products = Product.query.all()
-    return render_template_string(MAIN_TEMPLATE, products=products)
+    """Main application page (the catalog is loaded by app.js from /api/products)"""
+    # Card payments need both keys; without Stripe orders auto-complete (see order_settlement)
+    stripe_public_key = current_app.config.get('STRIPE_PUBLIC_KEY') if current_app.config.get('STRIPE_SECRET_KEY') else None
+    return render_template_string(MAIN_TEMPLATE, stripe_public_key=stripe_public_key)
 
-@app.route('/orders')
+@main.route('/orders')
+@rate_limiter.limit(priority='checkout')
 @login_required
 def orders_page():
     """User orders page"""
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+    orders = orders_for_user(current_user.id)
     return render_template_string(ORDERS_PAGE_TEMPLATE, orders=orders)
 
 
 
 if __name__ == '__main__':
+    # Development server only; production runs gunicorn against wsgi:app
+    app = create_app()
+    
     # Initialize database
-    init_db()
+    with app.app_context():
+        init_db()
     
     # Run application
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=app.config.get('DEBUG', False))
@@ -0,0 +1,208 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CacheGeneration
+
+
+class LRUCacheBackend:
+    """In-process cache with least-recently-used eviction and per-entry TTL"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCacheBackend:
+    """Cache shared by all replicas, stored in Redis (requires the redis package)"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def counter(self, key):
+        value = self._client.get(key)
+        return int(value) if value else 0
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+class DatabaseCounters:
+    """
+    Generation counters in the cache_generations table
+
+    Used with the in-process backend, so an invalidation in one worker or
+    pod reaches all of them. A value read is reused for `ttl` seconds,
+    which bounds how long another process serves the old generation.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._seen = {}  # key -> (value, read at)
+
+    def counter(self, key):
+        seen = self._seen.get(key)
+        if seen is not None and time.monotonic() - seen[1] < self.ttl:
+            return seen[0]
+        value = db.session.execute(select(CacheGeneration.value).where(CacheGeneration.key == key)).scalar() or 0
+        self._seen[key] = (value, time.monotonic())
+        return value
+
+    def incr(self, key):
+        """Bump and commit (call after the write being invalidated has committed)"""
+        bump = update(CacheGeneration).where(CacheGeneration.key == key).values(value=CacheGeneration.value + 1)
+        if not db.session.execute(bump).rowcount:
+            db.session.add(CacheGeneration(key=key, value=1))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another process created the row first
+                db.session.rollback()
+                db.session.execute(bump)
+        db.session.commit()
+        value = db.session.execute(select(CacheGeneration.value).where(CacheGeneration.key == key)).scalar()
+        self._seen[key] = (value, time.monotonic())
+        return value
+
+
+class Cache:
+    """
+    Response cache for read-mostly endpoints
+
+    Entries live in a namespace (e.g. 'catalog'). Invalidating a namespace
+    bumps its generation counter, which is part of every key, so all of its
+    entries become unreachable at once and age out of the backend. Counters
+    are shared by every process: kept in Redis with the redis backend, in
+    the database (DatabaseCounters) with the in-process one.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.counters = None
+        self.default_ttl = 60
+        self.prefix = ''
+        self._stats_lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        if backend == 'redis':
+            self.backend = self.counters = RedisCacheBackend(app.config['CACHE_REDIS_URL'])
+        elif backend == 'memory':
+            self.backend = LRUCacheBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+            self.counters = DatabaseCounters(app.config.get('CACHE_GENERATION_TTL', 1.0))
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 60)
+        self.prefix = app.config.get('CACHE_KEY_PREFIX', 'shopeasy:')
+        app.extensions['cache'] = self
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
+
+    def generation(self, namespace):
+        return self.counters.counter(f'{self.prefix}gen:{namespace}')
+
+    def invalidate(self, namespace):
+        """Drop every cached entry in namespace, in every process; returns its new generation"""
+        generation = self.counters.incr(f'{self.prefix}gen:{namespace}')
+        self._count('invalidations')
+        return generation
+
+    def make_key(self, namespace):
+        """Cache key for the current request: namespace generation, path and query string"""
+        args = urlencode(sorted(request.args.items(multi=True)))
+        return f'{self.prefix}{namespace}:{self.generation(namespace)}:{request.path}?{args}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl or self.default_ttl)
+        self._count('sets')
+
+    def cached(self, namespace, ttl=None):
+        """Cache successful JSON responses of a view, keyed by path and query parameters"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                key = self.make_key(namespace)
+                body = self.get(key)
+                if body is not None:
+                    return current_app.response_class(body, mimetype='application/json')
+
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and response.mimetype == 'application/json':
+                    self.set(key, response.get_data(), ttl)
+                return response
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['backend'] = self.backend.name
+        if isinstance(self.backend, LRUCacheBackend):
+            stats['entries'] = len(self.backend)
+        return stats
+
+
+cache = Cache()
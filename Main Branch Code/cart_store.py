@@ -0,0 +1,306 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Lock
+
+from flask import g, session
+from flask_login import current_user
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CartItem, Product
+
+
+class CartConflict(Exception):
+    """A cart write kept colliding with concurrent writes to the same cart; the client should retry"""
+
+
+class MemoryCartBackend:
+    """Carts in this process only (development and tests; not shared across pods)"""
+
+    name = 'memory'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._carts = {}  # cart key -> ({product_id: quantity}, expires_at)
+        self._lock = Lock()
+
+    def _lines(self, key):
+        entry = self._carts.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return {}
+        return entry[0]
+
+    def get(self, key):
+        with self._lock:
+            return dict(self._lines(key))
+
+    def set_quantity(self, key, product_id, quantity):
+        with self._lock:
+            lines = self._lines(key)
+            if quantity > 0:
+                lines[product_id] = quantity
+            else:
+                lines.pop(product_id, None)
+            self._carts[key] = (lines, time.monotonic() + self.ttl)
+
+    def set_many(self, key, quantities):
+        with self._lock:
+            lines = self._lines(key)
+            for product_id, quantity in quantities.items():
+                if quantity > 0:
+                    lines[product_id] = quantity
+                else:
+                    lines.pop(product_id, None)
+            self._carts[key] = (lines, time.monotonic() + self.ttl)
+
+    def clear(self, key):
+        with self._lock:
+            self._carts.pop(key, None)
+
+    def merge(self, source, target):
+        with self._lock:
+            lines = self._lines(target)
+            for product_id, quantity in self._lines(source).items():
+                lines[product_id] = lines.get(product_id, 0) + quantity
+            self._carts.pop(source, None)
+            self._carts[target] = (lines, time.monotonic() + self.ttl)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._carts.items() if expires_at <= now]:
+                del self._carts[key]
+
+
+class RedisCartBackend:
+    """Carts shared by all replicas, one Redis hash per cart (requires the redis package)"""
+
+    name = 'redis'
+
+    def __init__(self, url, ttl, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CART_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f'{self.prefix}cart:{key}'
+
+    def get(self, key):
+        return {int(pid): int(qty) for pid, qty in self._client.hgetall(self._key(key)).items()}
+
+    def set_quantity(self, key, product_id, quantity):
+        pipe = self._client.pipeline()
+        if quantity > 0:
+            pipe.hset(self._key(key), product_id, quantity)
+        else:
+            pipe.hdel(self._key(key), product_id)
+        pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+
+    def set_many(self, key, quantities):
+        pipe = self._client.pipeline()
+        for product_id, quantity in quantities.items():
+            if quantity > 0:
+                pipe.hset(self._key(key), product_id, quantity)
+            else:
+                pipe.hdel(self._key(key), product_id)
+        pipe.expire(self._key(key), self.ttl)
+        pipe.execute()
+
+    def clear(self, key):
+        self._client.delete(self._key(key))
+
+    def merge(self, source, target):
+        lines = self.get(source)
+        pipe = self._client.pipeline()
+        for product_id, quantity in lines.items():
+            pipe.hincrby(self._key(target), product_id, quantity)
+        pipe.delete(self._key(source))
+        pipe.expire(self._key(target), self.ttl)
+        pipe.execute()
+
+    def purge_expired(self):
+        pass  # Redis expires idle carts itself
+
+
+class DatabaseCartBackend:
+    """Carts in the cart_items table, shared by every pod using the database"""
+
+    name = 'database'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get(self, key):
+        rows = db.session.query(CartItem.product_id, CartItem.quantity) \
+            .filter(CartItem.cart_key == key).order_by(CartItem.id).all()
+        return dict(rows)
+
+    def set_quantity(self, key, product_id, quantity):
+        if quantity <= 0:
+            db.session.execute(delete(CartItem).where(CartItem.cart_key == key, CartItem.product_id == product_id))
+            db.session.commit()
+            return
+        for _ in range(2):
+            updated = db.session.execute(
+                update(CartItem)
+                .where(CartItem.cart_key == key, CartItem.product_id == product_id)
+                .values(quantity=quantity)
+            ).rowcount
+            if not updated:
+                db.session.add(CartItem(cart_key=key, product_id=product_id, quantity=quantity))
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                # A concurrent request inserted the same line first: update it instead
+                db.session.rollback()
+        raise CartConflict(f'Could not update cart {key}')
+
+    def set_many(self, key, quantities):
+        """Rewrite the changed lines in one transaction: one DELETE plus one multi-row INSERT"""
+        for _ in range(2):
+            db.session.execute(
+                delete(CartItem).where(CartItem.cart_key == key, CartItem.product_id.in_(list(quantities)))
+            )
+            db.session.add_all(
+                CartItem(cart_key=key, product_id=pid, quantity=qty) for pid, qty in quantities.items() if qty > 0
+            )
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                # A concurrent request wrote one of these lines in between: redo on top of it
+                db.session.rollback()
+        raise CartConflict(f'Could not update cart {key}')
+
+    def clear(self, key):
+        db.session.execute(delete(CartItem).where(CartItem.cart_key == key))
+        db.session.commit()
+
+    def merge(self, source, target):
+        lines = self.get(target)
+        for product_id, quantity in self.get(source).items():
+            lines[product_id] = lines.get(product_id, 0) + quantity
+        db.session.execute(delete(CartItem).where(CartItem.cart_key.in_([source, target])))
+        db.session.add_all(CartItem(cart_key=target, product_id=pid, quantity=qty) for pid, qty in lines.items())
+        db.session.commit()
+
+    def purge_expired(self):
+        """Delete whole carts whose newest line is older than the TTL (a cart lives while any line is touched)"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        # Derived table, so MySQL accepts a subquery on the table being deleted from
+        idle = select(CartItem.cart_key).group_by(CartItem.cart_key) \
+            .having(func.max(CartItem.updated_at) < cutoff).subquery()
+        count = db.session.execute(delete(CartItem).where(CartItem.cart_key.in_(select(idle.c.cart_key)))).rowcount
+        db.session.commit()
+        return count
+
+
+class CartStore:
+    """
+    Server-side shopping carts
+
+    A cart is a {product_id: quantity} mapping in the configured backend.
+    The session cookie only carries a guest cart id; signed-in users are
+    keyed by user id, so their cart follows them across devices and pods.
+    Names, prices and images are joined in from the catalog when the cart
+    is read, so they are never stale.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CART_BACKEND', 'database')
+        ttl = app.config.get('CART_TTL', 30 * 24 * 3600)
+        if backend == 'database':
+            self.backend = DatabaseCartBackend(ttl)
+        elif backend == 'memory':
+            self.backend = MemoryCartBackend(ttl)
+        elif backend == 'redis':
+            self.backend = RedisCartBackend(app.config['CART_REDIS_URL'], ttl,
+                                            app.config.get('CACHE_KEY_PREFIX', 'shopeasy:'))
+        else:
+            raise ValueError(f"Unknown CART_BACKEND: {backend}")
+        app.extensions['cart_store'] = self
+
+    def key(self, create=False):
+        """Cart key for the current request; creates a guest cart id only when writing"""
+        if current_user.is_authenticated:
+            key = f'user:{current_user.id}'
+        elif 'cart_id' in session:
+            key = f"guest:{session['cart_id']}"
+        elif create or 'cart' in session:
+            session['cart_id'] = uuid.uuid4().hex
+            key = f"guest:{session['cart_id']}"
+        else:
+            return None
+
+        legacy = session.pop('cart', None)
+        if legacy:
+            # Cart from a cookie issued before the server-side store
+            wanted = {int(item['id']): int(item['quantity']) for item in legacy}
+            for (product_id,) in db.session.query(Product.id).filter(Product.id.in_(list(wanted))).all():
+                self.backend.set_quantity(key, product_id, wanted[product_id])
+        return key
+
+    def lines(self):
+        """{product_id: quantity} of the current cart (read once per request)"""
+        if 'cart_lines' not in g:
+            key = self.key()
+            g.cart_lines = self.backend.get(key) if key else {}
+        return g.cart_lines
+
+    def set_quantity(self, product_id, quantity):
+        self.backend.set_quantity(self.key(create=True), product_id, quantity)
+        g.pop('cart_lines', None)
+
+    def set_many(self, quantities):
+        """Apply {product_id: quantity} changes at once (quantity 0 removes the line)"""
+        if quantities:
+            self.backend.set_many(self.key(create=True), quantities)
+        g.pop('cart_lines', None)
+
+    def clear(self):
+        key = self.key()
+        if key:
+            self.backend.clear(key)
+        g.pop('cart_lines', None)
+
+    def merge_guest_cart(self, user_id):
+        """Fold the anonymous cart of this session into the user's cart (call at login)"""
+        cart_id = session.pop('cart_id', None)
+        if cart_id:
+            self.backend.merge(f'guest:{cart_id}', f'user:{user_id}')
+        g.pop('cart_lines', None)
+
+    def items(self, lines=None, products=None):
+        """
+        Cart lines with product details; vanished products are skipped
+
+        Products are loaded in one IN query unless the caller already has
+        them ({product_id: Product} covering every line).
+        """
+        lines = self.lines() if lines is None else lines
+        if not lines:
+            return []
+        if products is None:
+            products = {p.id: p for p in Product.query.filter(Product.id.in_(list(lines)))}
+        return [{
+            'id': product_id,
+            'name': products[product_id].name,
+            'price': products[product_id].price,
+            'image': products[product_id].image_url,
+            'quantity': quantity
+        } for product_id, quantity in lines.items() if product_id in products]
+
+
+cart_store = CartStore()
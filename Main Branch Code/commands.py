@@ -0,0 +1,458 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, literal, text
+
+from models import db, User, Product, Order
+from cart_store import cart_store
+from job_queue import job_queue
+import payment_utils
+import stripe_webhooks
+from reconciliation import Checkpoint, reconcile_payments
+
+
+def upgrade_schema():
+    """
+    Bring tables created by an earlier release up to the current models
+
+    create_all only creates missing tables. This adds the columns, indexes
+    and unique constraints added to existing tables since (unique
+    constraints as unique indexes, which SQLite can add in place) and
+    backfills new denormalized columns. Returns the added column names.
+    """
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    added = []
+
+    for table in db.metadata.sorted_tables:
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        indexes |= {u['name'] for u in inspector.get_unique_constraints(table.name)}
+
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} ' \
+                  f'{column.type.compile(dialect=connection.dialect)}'
+            if not column.nullable:
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is None:
+                    raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} without a default')
+                default = literal(default, column.type).compile(dialect=connection.dialect,
+                                                                compile_kwargs={'literal_binds': True})
+                ddl += f' NOT NULL DEFAULT {default}'
+            connection.execute(text(ddl))
+            added.append(f'{table.name}.{column.name}')
+
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+        for constraint in table.constraints:
+            if isinstance(constraint, db.UniqueConstraint) and constraint.name and constraint.name not in indexes:
+                connection.execute(text(
+                    f'CREATE UNIQUE INDEX {quote(constraint.name)} ON {quote(table.name)} '
+                    f'({", ".join(quote(c.name) for c in constraint.columns)})'
+                ))
+
+    if {'products.rating_sum', 'products.rating_count'} & set(added):
+        Product.recompute_ratings()
+    db.session.commit()
+    return added
+
+
+def init_db():
+    """Create the schema (upgrading existing tables) and seed the admin user and demo catalog"""
+    db.create_all()
+    for column in upgrade_schema():
+        print(f"Added column {column}")
+    
+    # Create admin user if not exists
+    admin = User.query.filter_by(email='admin@shopeasy.com').first()
+    if not admin:
+        admin = User(
+            email='admin@shopeasy.com',
+            username='admin',
+            is_admin=True
+        )
+        admin.set_password('admin123')
+        db.session.add(admin)
+    
+    # Seed products if empty
+    if Product.query.count() == 0:
+        products = [
+            # Electronics Products
+            Product(
+                name="Wireless Headphones",
+                description="High-quality wireless headphones with noise cancellation",
+                price=99.99,
+                image_url="https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=400&h=300&fit=crop",
+                category="Electronics",
+                stock=50,
+                rating=4.5,
+                features=["Noise Cancellation", "30hr Battery", "Wireless", "Bluetooth 5.0", "Foldable Design", "Built-in Mic", "Premium Sound"]
+            ),
+            Product(
+                name="Smart Watch",
+                description="Feature-rich smartwatch with health monitoring",
+                price=199.99,
+                image_url="https://images.unsplash.com/photo-1523275335684-37898b6baf30?w=400&h=300&fit=crop",
+                category="Electronics",
+                stock=30,
+                rating=4.2,
+                features=["Heart Rate Monitor", "GPS", "Water Resistant", "Sleep Tracking", "Fitness Modes", "Notifications", "Long Battery"]
+            ),
+            Product(
+                name="Laptop",
+                description="Powerful laptop for work and gaming",
+                price=899.99,
+                image_url="https://images.unsplash.com/photo-1496181133206-80ce9b88a853?w=400&h=300&fit=crop",
+                category="Electronics",
+                stock=15,
+                rating=4.8,
+                features=["16GB RAM", "512GB SSD", "Intel i7", "15.6 Display", "Backlit Keyboard", "Windows 11", "Lightweight"]
+            ),
+            Product(
+                name="Wireless Mouse",
+                description="Ergonomic wireless mouse with precision tracking",
+                price=29.99,
+                image_url="https://images.unsplash.com/photo-1527864550417-7fd91fc51a46?w=400&h=300&fit=crop",
+                category="Electronics",
+                stock=100,
+                rating=4.3,
+                features=["Wireless", "Ergonomic", "Long Battery", "DPI Adjustable", "Silent Click", "USB Receiver"]
+            ),
+            
+            # Fashion Products
+            Product(
+                name="Running Shoes",
+                description="Comfortable running shoes for all terrains",
+                price=79.99,
+                image_url="https://images.unsplash.com/photo-1542291026-7eec264c27ff?w=400&h=300&fit=crop",
+                category="Fashion",
+                stock=45,
+                rating=4.7,
+                features=["Lightweight", "Breathable", "Durable", "Cushioned Sole", "Anti-Slip", "Mesh Upper"]
+            ),
+            Product(
+                name="Backpack",
+                description="Waterproof backpack with laptop compartment",
+                price=39.99,
+                image_url="https://images.unsplash.com/photo-1553062407-98eeb64c6a62?w=400&h=300&fit=crop",
+                category="Fashion",
+                stock=40,
+                rating=4.6,
+                features=["Waterproof", "Laptop Sleeve", "Multiple Pockets", "USB Port", "Padded Straps", "30L Capacity"]
+            ),
+            Product(
+                name="Sunglasses",
+                description="Stylish UV protection sunglasses",
+                price=49.99,
+                image_url="https://images.unsplash.com/photo-1572635196237-14b3f281503f?w=400&h=300&fit=crop",
+                category="Fashion",
+                stock=60,
+                rating=4.4,
+                features=["UV Protection", "Polarized", "Lightweight", "Scratch Resistant", "Metal Frame", "Case Included"]
+            ),
+            Product(
+                name="Leather Jacket",
+                description="Premium leather jacket for all seasons",
+                price=149.99,
+                image_url="https://images.unsplash.com/photo-1551028719-00167b16eac5?w=400&h=300&fit=crop",
+                category="Fashion",
+                stock=20,
+                rating=4.9,
+                features=["Genuine Leather", "Warm", "Stylish", "Multiple Pockets", "Zipper Closure", "Premium Quality"]
+            ),
+            
+            # Home Products
+            Product(
+                name="Coffee Maker",
+                description="Automatic coffee maker with timer",
+                price=49.99,
+                image_url="https://images.unsplash.com/photo-1517668808822-9ebb02f2a0e6?w=400&h=300&fit=crop",
+                category="Home",
+                stock=25,
+                rating=4.3,
+                features=["24hr Timer", "Auto Shut-off", "Programmable", "12 Cup Capacity", "Keep Warm", "Easy Clean"]
+            ),
+            Product(
+                name="Desk Lamp",
+                description="LED desk lamp with adjustable brightness",
+                price=29.99,
+                image_url="https://images.unsplash.com/photo-1507473885765-e6ed057f782c?w=400&h=300&fit=crop",
+                category="Home",
+                stock=60,
+                rating=4.4,
+                features=["Adjustable Brightness", "USB Port", "Modern Design", "Touch Control", "Eye Protection", "Energy Saving"]
+            ),
+            Product(
+                name="Wall Clock",
+                description="Modern minimalist wall clock",
+                price=24.99,
+                image_url="https://images.unsplash.com/photo-1563861826100-9cb868fdbe1c?w=400&h=300&fit=crop",
+                category="Home",
+                stock=35,
+                rating=4.2,
+                features=["Silent Movement", "Modern Design", "Easy to Read", "Battery Operated", "12 Inch", "Wall Mount"]
+            ),
+            Product(
+                name="Plant Pot Set",
+                description="Set of 3 ceramic plant pots",
+                price=19.99,
+                image_url="https://images.unsplash.com/photo-1485955900006-10f4d324d411?w=400&h=300&fit=crop",
+                category="Home",
+                stock=50,
+                rating=4.5,
+                features=["Ceramic", "Drainage Holes", "Set of 3", "Different Sizes", "Indoor/Outdoor", "Decorative"]
+            ),
+            
+            # Sports Products
+            Product(
+                name="Yoga Mat",
+                description="Non-slip yoga mat with carrying strap",
+                price=34.99,
+                image_url="https://images.unsplash.com/photo-1601925260368-ae2f83cf8b7f?w=400&h=300&fit=crop",
+                category="Sports",
+                stock=70,
+                rating=4.6,
+                features=["Non-slip", "Eco-friendly", "6mm Thick", "Carrying Strap", "Easy Clean", "Durable Material"]
+            ),
+            Product(
+                name="Dumbbell Set",
+                description="Adjustable dumbbell set for home workout",
+                price=89.99,
+                image_url="https://images.unsplash.com/photo-1517836357463-d25dfeac3438?w=400&h=300&fit=crop",
+                category="Sports",
+                stock=30,
+                rating=4.7,
+                features=["Adjustable Weight", "Compact", "Durable", "5-25 lbs Range", "Anti-Roll Design", "Rubber Coated"]
+            ),
+            Product(
+                name="Water Bottle",
+                description="Insulated stainless steel water bottle",
+                price=19.99,
+                image_url="https://images.unsplash.com/photo-1602143407151-7111542de6e8?w=400&h=300&fit=crop",
+                category="Sports",
+                stock=100,
+                rating=4.5,
+                features=["Insulated", "BPA Free", "750ml", "Leak Proof", "24hr Cold", "Stainless Steel"]
+            ),
+            
+            # Books Products
+            Product(
+                name="Python Programming Book",
+                description="Complete guide to Python programming",
+                price=39.99,
+                image_url="https://images.unsplash.com/photo-1589998059171-988d887df646?w=400&h=300&fit=crop",
+                category="Books",
+                stock=50,
+                rating=4.8,
+                features=["Beginner Friendly", "500 Pages", "Code Examples", "Exercises", "Hardcover", "Latest Edition"]
+            ),
+            Product(
+                name="Business Strategy Book",
+                description="Essential business strategies for success",
+                price=29.99,
+                image_url="https://images.unsplash.com/photo-1507003211169-0a1dd7228f2d?w=400&h=300&fit=crop",
+                category="Books",
+                stock=40,
+                rating=4.6,
+                features=["Best Seller", "Case Studies", "Practical Tips", "300 Pages", "Paperback", "Expert Author"]
+            ),
+            Product(
+                name="Cookbook Collection",
+                description="Delicious recipes from around the world",
+                price=34.99,
+                image_url="https://images.unsplash.com/photo-1476224203421-9ac39bcb3327?w=400&h=300&fit=crop",
+                category="Books",
+                stock=35,
+                rating=4.7,
+                features=["200+ Recipes", "Full Color", "Step by Step", "Nutritional Info", "Hardcover", "Illustrated"]
+            ),
+            
+            # Toys Products
+            Product(
+                name="Building Blocks Set",
+                description="Creative building blocks for kids",
+                price=44.99,
+                image_url="https://images.unsplash.com/photo-1558060370-d644479cb6f7?w=400&h=300&fit=crop",
+                category="Toys",
+                stock=60,
+                rating=4.9,
+                features=["500 Pieces", "Safe Materials", "Age 3+", "Educational", "Storage Box", "Multiple Colors"]
+            ),
+            Product(
+                name="Remote Control Car",
+                description="High-speed RC car with rechargeable battery",
+                price=59.99,
+                image_url="https://images.unsplash.com/photo-1517524008697-84bbe3c3fd98?w=400&h=300&fit=crop",
+                category="Toys",
+                stock=45,
+                rating=4.5,
+                features=["High Speed", "Rechargeable", "Remote Control", "Durable", "LED Lights", "Age 6+"]
+            ),
+            Product(
+                name="Puzzle Game",
+                description="Challenging 1000-piece jigsaw puzzle",
+                price=24.99,
+                image_url="https://images.unsplash.com/photo-1611604548018-d56bbd85d681?w=400&h=300&fit=crop",
+                category="Toys",
+                stock=55,
+                rating=4.4,
+                features=["1000 Pieces", "Beautiful Art", "Premium Quality", "Age 8+", "Gift Box", "Poster Included"]
+            )
+        ]
+        db.session.add_all(products)
+    
+    db.session.commit()
+    print("Database initialized successfully!")
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create or upgrade tables and seed data (run once per deployment, not per worker)"""
+    init_db()
+
+
+@click.command('repair-ratings')
+@with_appcontext
+def repair_ratings_command():
+    """Recompute product rating counters from the reviews table"""
+    Product.recompute_ratings()
+    db.session.commit()
+    print("Product ratings recomputed.")
+
+
+@click.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+@with_appcontext
+def run_jobs_command(once):
+    """Process background jobs in the foreground (dedicated worker process)"""
+    while True:
+        processed = job_queue.run_pending(limit=100)
+        if once:
+            print(f"Processed {processed} job(s).")
+            return
+        if not processed:
+            time.sleep(job_queue.poll_interval)
+
+
+@click.command('requeue-dead-jobs')
+@click.option('--kind', default=None, help='Only requeue jobs of this kind.')
+@with_appcontext
+def requeue_dead_jobs_command(kind):
+    """Give dead-lettered jobs a fresh attempt budget"""
+    print(f"Requeued {job_queue.requeue_dead(kind)} job(s).")
+
+
+@click.command('purge-carts')
+@with_appcontext
+def purge_carts_command():
+    """Delete carts idle for longer than CART_TTL (database store; Redis expires them itself)"""
+    count = cart_store.backend.purge_expired()
+    print(f"Purged {count or 0} cart line(s).")
+
+
+@click.command('replay-stripe-events')
+@click.option('--type', 'event_type', default=None, help='Only events of this type, e.g. charge.refunded.')
+@click.option('--since', type=click.DateTime(), default=None, help='Only events received at or after this time.')
+@click.option('--event-id', default=None, help='A single stored event.')
+@with_appcontext
+def replay_stripe_events_command(event_type, since, event_id):
+    """Apply stored Stripe events again (e.g. after fixing a bug in event handling)"""
+    count = stripe_webhooks.requeue_events(event_type=event_type, since=since, event_id=event_id)
+    print(f"Queued {count} Stripe event(s) for processing")
+
+
+@click.command('stripe-event-fixture')
+@click.argument('order_number')
+@click.option('--type', 'event_type', default=stripe_webhooks.SUCCEEDED,
+              type=click.Choice(stripe_webhooks.HANDLED_EVENTS), help='Event type to generate.')
+@click.option('--amount-refunded', type=float, default=None, help='For charge.refunded: dollars refunded (default: all).')
+@click.option('--post', 'url', default=None, help='Send it signed to this webhook URL, e.g. http://localhost:5000/api/webhooks/stripe.')
+@with_appcontext
+def stripe_event_fixture_command(order_number, event_type, amount_refunded, url):
+    """Generate a signed Stripe event for a local order, print it and optionally deliver it"""
+    order = Order.query.filter_by(order_number=order_number).first()
+    if order is None:
+        raise click.ClickException(f'No order {order_number}')
+    secret = current_app.config.get('STRIPE_WEBHOOK_SECRET')
+    if not secret:
+        raise click.ClickException('Set STRIPE_WEBHOOK_SECRET to sign events')
+
+    payload = json.dumps(stripe_webhooks.build_event(event_type, order, amount_refunded), indent=2)
+    signature = stripe_webhooks.sign_payload(payload, secret)
+    if not url:
+        print(payload)
+        print(f"Stripe-Signature: {signature}")
+        return
+
+    request = urllib.request.Request(url, data=payload.encode('utf-8'), method='POST', headers={
+        'Content-Type': 'application/json',
+        'Stripe-Signature': signature,
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            print(f"{response.status} {response.read().decode('utf-8')}")
+    except urllib.error.HTTPError as e:
+        raise click.ClickException(f"{e.code} {e.read().decode('utf-8')}")
+
+
+@click.command('reconcile-payments')
+@click.option('--chunk-size', default=200, help='Orders loaded and checked per batch.')
+@click.option('--workers', default=8, help='Concurrent Stripe requests.')
+@click.option('--checkpoint', 'checkpoint_path', default='reconcile-payments.checkpoint.json',
+              help='Progress file; an interrupted run resumes from it.')
+@click.option('--report', 'report_path', default='reconcile-payments.csv', help='CSV report (appended when resuming).')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and scan all orders again.')
+@click.option('--no-refunds', is_flag=True, help='Report paid cancelled orders without refunding them.')
+@with_appcontext
+def reconcile_payments_command(chunk_size, workers, checkpoint_path, report_path, restart, no_refunds):
+    """Check every Stripe-paid order against Stripe, settle drift and refund cancelled orders"""
+    if not current_app.config.get('STRIPE_SECRET_KEY'):
+        raise click.ClickException('Set STRIPE_SECRET_KEY to reconcile payments')
+    checkpoint = Checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.clear()
+        checkpoint = Checkpoint(checkpoint_path)
+    elif checkpoint.resumed:
+        print(f"Resuming after order id {checkpoint.last_id} (run started {checkpoint.started_at})")
+
+    started = time.perf_counter()
+    try:
+        counts = reconcile_payments(checkpoint, report_path, chunk_size=chunk_size, workers=workers,
+                                    refund=not no_refunds)
+    except payment_utils.PaymentUnavailable as e:
+        raise click.ClickException(str(e))
+    print(f"Done in {time.perf_counter() - started:.1f}s: {counts}; report in {report_path}")
+    if checkpoint.retry:
+        # Keep the checkpoint: the next run retries these (and scans any newer orders)
+        raise click.ClickException(f"{len(checkpoint.retry)} order(s) could not be checked or refunded; "
+                                   f"run again to retry them")
+    checkpoint.clear()
+
+
+def register_commands(app):
+    """Attach the management commands to the app's `flask` CLI"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(repair_ratings_command)
+    app.cli.add_command(run_jobs_command)
+    app.cli.add_command(requeue_dead_jobs_command)
+    app.cli.add_command(purge_carts_command)
+    app.cli.add_command(replay_stripe_events_command)
+    app.cli.add_command(stripe_event_fixture_command)
+    app.cli.add_command(reconcile_payments_command)
+
+    if app.testing or os.environ.get('FLASK_ENV', 'development') in ('development', 'testing'):
+        # Benchmarks and load tests: never imported or registered in production
+        from dev_commands import register_dev_commands
+        register_dev_commands(app)
@@ -1,13 +1,32 @@
 import os
 from dotenv import load_dotenv
 
+from db_utils import engine_options, normalize_database_uri
+
 load_dotenv()
 
 class Config:
     """Base configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
+    
+    # Password hashing: bcrypt cost (2**rounds) and the per-process executor it runs on.
+    # Existing hashes are upgraded to a new cost at the user's next login.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # hashes running at once
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))  # queued; more gets a 503
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))  # seconds a login may wait; longer queues get a 503 up front
+    
+    # Signed-in user snapshots cached per process, so authenticated requests skip the users query.
+    # Role/email changes reach other pods within SESSION_PRINCIPAL_TTL seconds (0 disables).
+    SESSION_PRINCIPAL_CACHE_SIZE = int(os.environ.get('SESSION_PRINCIPAL_CACHE_SIZE', 1024))
+    SESSION_PRINCIPAL_TTL = int(os.environ.get('SESSION_PRINCIPAL_TTL', 30))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # SQLite connection pragmas (ignored for PostgreSQL)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    
     # Email Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -15,33 +34,134 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 2))  # open SMTP sessions per process
+    MAIL_POOL_MAX_IDLE = int(os.environ.get('MAIL_POOL_MAX_IDLE', 30))  # seconds before a NOOP check
+    MAIL_POOL_MAX_MESSAGES = int(os.environ.get('MAIL_POOL_MAX_MESSAGES', 100))  # then reconnect
     
     # Stripe Configuration
     STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')  # fake_stripe.py for local runs
+    PAYMENT_CONNECT_TIMEOUT = float(os.environ.get('PAYMENT_CONNECT_TIMEOUT', 3))  # seconds
+    PAYMENT_READ_TIMEOUT = float(os.environ.get('PAYMENT_READ_TIMEOUT', 10))
+    PAYMENT_MAX_RETRIES = int(os.environ.get('PAYMENT_MAX_RETRIES', 2))
+    PAYMENT_RETRY_BACKOFF = float(os.environ.get('PAYMENT_RETRY_BACKOFF', 0.25))  # seconds, doubled per retry
+    PAYMENT_DEADLINE = float(os.environ.get('PAYMENT_DEADLINE', 15))  # total budget per call incl. retries
+    PAYMENT_BREAKER_THRESHOLD = int(os.environ.get('PAYMENT_BREAKER_THRESHOLD', 5))  # consecutive failures
+    PAYMENT_BREAKER_RESET = float(os.environ.get('PAYMENT_BREAKER_RESET', 30))  # seconds before a trial call
+    STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')  # whsec_...; enables /api/webhooks/stripe
+    STRIPE_WEBHOOK_TOLERANCE = int(os.environ.get('STRIPE_WEBHOOK_TOLERANCE', 300))  # max signature age (seconds)
+    # Checkout accepts a pending order; a background job settles the payment
+    PAYMENT_SETTLE_POLL = float(os.environ.get('PAYMENT_SETTLE_POLL', 5))  # seconds, doubled per check (no webhook)
+    PAYMENT_SETTLE_POLL_MAX = float(os.environ.get('PAYMENT_SETTLE_POLL_MAX', 300))
+    PAYMENT_SETTLE_TIMEOUT = int(os.environ.get('PAYMENT_SETTLE_TIMEOUT', 1800))  # then cancel and release stock
+    
+    # Background Jobs (email delivery etc.)
+    # Worker threads per process; set to 0 when running `flask run-jobs` separately
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_BACKOFF_BASE = int(os.environ.get('JOB_BACKOFF_BASE', 30))  # seconds, doubled per attempt
+    JOB_BACKOFF_MAX = int(os.environ.get('JOB_BACKOFF_MAX', 3600))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 600))  # requeue jobs stuck in running
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 50))  # jobs per call for batch handlers
+    
+    # Rate limiting: token bucket per policy and user (or client IP when signed out)
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'redis' shares budgets across pods
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    # Proxies in front of the app that append X-Forwarded-For. With 0, clients are keyed by the
+    # connecting address; behind a load balancer that is the balancer or node, so every anonymous
+    # client would share one bucket. k8s sets 1 (the ELB); add one per extra proxy (e.g. an ingress).
+    # Never set it higher than the real hop count: clients could then pick their own key.
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+    RATE_LIMITS = {
+        'auth': '10/minute',  # login and sign-up: slows credential stuffing
+        'browse': '300/minute',
+        'cart': '240/minute',
+        'checkout': '20/minute',
+        'export': '30/minute',
+        'default': '600/minute',
+    }
+    # Seconds a request may have queued for a thread before it is shed with 503:
+    # admin pages at 25% of it, browsing at 50%, checkout at 100%
+    RATE_LIMIT_MAX_QUEUE_WAIT = float(os.environ.get('RATE_LIMIT_MAX_QUEUE_WAIT', 1.0))
+    # Queue start stamp: set by gunicorn_workers, or e.g. by nginx as "t=${msec}"
+    RATE_LIMIT_QUEUE_HEADER = os.environ.get('RATE_LIMIT_QUEUE_HEADER', 'X-Request-Start')
+    
+    # Metrics: Prometheus text format on /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+    # Shared by a pod's gunicorn workers so one scrape reports all of them (unset: scraped worker only)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # seconds between worker snapshots
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # require 'Authorization: Bearer <token>' on /metrics
+    
+    # Health checks: /healthz (liveness) and /readyz (readiness)
+    HEALTH_CHECK_TTL = float(os.environ.get('HEALTH_CHECK_TTL', 5))  # seconds a database check is reused
+    # While this file exists /readyz fails so the pod stops receiving traffic (k8s preStop creates it)
+    HEALTH_DRAIN_FILE = os.environ.get('HEALTH_DRAIN_FILE')
+    
+    # Cache Settings
+    # 'memory' keeps a per-process LRU; 'redis' shares entries across replicas and needs
+    # the redis package plus CACHE_REDIS_URL. Invalidations reach every process either
+    # way: with 'memory' the generation counters live in the database and a read is
+    # reused for CACHE_GENERATION_TTL seconds.
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_GENERATION_TTL = float(os.environ.get('CACHE_GENERATION_TTL', 1))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 60))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    
+    # Cart Settings
+    # 'database' (cart_items table) and 'redis' are shared by all pods; 'memory' is per process
+    CART_BACKEND = os.environ.get('CART_BACKEND', 'database')
+    CART_REDIS_URL = os.environ.get('CART_REDIS_URL', CACHE_REDIS_URL)
+    CART_TTL = int(os.environ.get('CART_TTL', 30 * 24 * 3600))  # idle carts expire after this (seconds)
     
     # App Settings
     APP_NAME = os.environ.get('APP_NAME', 'ShopEasy')
     ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@shopeasy.com')
+    SUPPORT_EMAIL = os.environ.get('SUPPORT_EMAIL', 'support@shopeasy.com')
+    APP_BASE_URL = os.environ.get('APP_BASE_URL', 'http://localhost:5000')  # links in emails
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     # Use SQLite for easy development (no PostgreSQL needed)
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+    SQLALCHEMY_DATABASE_URI = normalize_database_uri(os.environ.get('DATABASE_URL')) or \
         'sqlite:///ecommerce.db'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 2)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 3)),
+        statement_timeout_ms=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 60000))
+    )
 
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
-    # Use SQLite by default if DATABASE_URL not provided
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+    # Use SQLite by default if DATABASE_URL not provided (a warning is printed at startup)
+    SQLALCHEMY_DATABASE_URI = normalize_database_uri(os.environ.get('DATABASE_URL')) or \
         'sqlite:///ecommerce.db'
+    # Pool is per gunicorn worker: size it to GUNICORN_THREADS so every thread
+    # can hold a connection, and keep pods x workers x (size + overflow) below
+    # the server's max_connections
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 4)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        statement_timeout_ms=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000))
+    )
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    JOB_WORKERS = 0  # Run jobs explicitly with job_queue.run_pending()
+    BCRYPT_LOG_ROUNDS = 4  # Minimum cost: keep test runs fast
+    RATE_LIMIT_ENABLED = False
 
 config = {
     'development': DevelopmentConfig,
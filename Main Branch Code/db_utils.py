@@ -0,0 +1,136 @@
+import time
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+
+class PoolStats:
+    """Connection pool checkout counters for this process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            stats = {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+                'wait_seconds_avg': round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'idle': pool.checkedin(),
+            })
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+
+def _sqlite_pragmas(app):
+    in_memory = ':memory:' in app.config['SQLALCHEMY_DATABASE_URI']
+    pragmas = {
+        'busy_timeout': app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'synchronous': app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': app.config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'temp_store': 'MEMORY',
+    }
+    if not in_memory:
+        # Readers no longer block the writer (and vice versa)
+        pragmas['journal_mode'] = 'WAL'
+    return pragmas
+
+
+def init_app(app):
+    """Attach per-connection settings to the app's engine"""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = _sqlite_pragmas(app)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def engine_options(database_uri, pool_size=5, max_overflow=10, pool_timeout=10,
+                   pool_recycle=1800, statement_timeout_ms=15000, connect_timeout=5):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a database URI
+
+    PostgreSQL gets a pre-pinged, recycled QueuePool plus server-side
+    statement timeouts. SQLite files get a small pool (SQLite allows one
+    writer at a time anyway); in-memory SQLite keeps Flask-SQLAlchemy's
+    single static connection.
+    """
+    if database_uri.startswith('postgresql'):
+        return {
+            'poolclass': TimedQueuePool,
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'pool_recycle': pool_recycle,
+            'pool_pre_ping': True,
+            'connect_args': {
+                'connect_timeout': connect_timeout,
+                'application_name': 'shopeasy',
+                'options': f'-c statement_timeout={statement_timeout_ms}',
+            },
+        }
+    if database_uri.startswith('sqlite') and ':memory:' not in database_uri:
+        return {
+            'poolclass': TimedQueuePool,
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'connect_args': {'timeout': connect_timeout},
+        }
+    return {}
+
+
+def normalize_database_uri(uri):
+    """Accept the legacy postgres:// scheme that SQLAlchemy no longer recognises"""
+    if uri and uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
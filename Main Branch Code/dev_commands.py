@@ -0,0 +1,324 @@
+"""
+Benchmark and load-test commands for development and staging
+
+register_commands (commands.py) only imports this module when FLASK_ENV
+is development or testing, so production images do not ship them on
+their `flask` CLI.
+"""
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Lock, Thread
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+
+from models import db, User, Product
+from inventory import reserve_stock
+from mail_transport import SMTPConnectionPool
+from email_templates import EmailTemplates, SUBJECTS
+from smtp_sink import SMTPSink
+import payment_utils
+from fake_stripe import FakeStripe
+from password_hashing import password_hasher, HashingBusy
+from rate_limit import rate_limiter
+
+
+@click.command('bench-mail')
+@click.option('--count', default=500, help='Messages to send per strategy.')
+@click.option('--latency', default=0.05, help='Simulated handshake cost per SMTP connection (seconds).')
+@with_appcontext
+def bench_mail_command(count, latency):
+    """Compare one SMTP session per email with the pooled batch sender, against a local sink"""
+    sink = SMTPSink(port=0, latency=latency, keep_messages=False).start()
+    mail_state = current_app.extensions['mail']
+    # This process only benchmarks: point Flask-Mail at the sink
+    mail_state.server, mail_state.port = '127.0.0.1', sink.port
+    mail_state.use_tls = mail_state.use_ssl = mail_state.suppress = False
+    mail_state.username = mail_state.password = 'bench'
+    messages = [
+        Message(f'Benchmark {i}', sender='bench@localhost', recipients=[f'user{i}@example.com'], html='<p>Hi</p>')
+        for i in range(count)
+    ]
+
+    try:
+        start = time.perf_counter()
+        for msg in messages:
+            mail_state.send(msg)
+        per_message = time.perf_counter() - start
+        connections = sink.connections
+
+        pool = SMTPConnectionPool(current_app)
+        start = time.perf_counter()
+        batch_size = current_app.config.get('JOB_BATCH_SIZE', 50)
+        for i in range(0, count, batch_size):
+            pool.send_batch(messages[i:i + batch_size])
+        pooled = time.perf_counter() - start
+        pool.close()
+    finally:
+        sink.stop()
+
+    print(f"One session per email: {per_message:.2f}s ({connections} connections)")
+    print(f"Pooled batches:        {pooled:.2f}s ({sink.connections - connections} connections)")
+    print(f"Delivered {sink.message_count} of {2 * count} messages")
+
+
+@click.command('bench-emails')
+@click.option('--count', default=1000, help='Renders per template.')
+@click.option('--items', default=5, help='Line items in the sample order.')
+@with_appcontext
+def bench_emails_command(count, items):
+    """Measure email render cost per message, precompiled vs compiled on every call"""
+    start = time.perf_counter()
+    registry = EmailTemplates(current_app)
+    print(f"Compile all templates: {(time.perf_counter() - start) * 1000:.2f} ms (once per process)")
+
+    contexts = {
+        'order_confirmation': {
+            'order_number': 'ORD-BENCH',
+            'order_date': 'January 01, 2025',
+            'total_amount': 99.5 * items,
+            'items': [{'name': f'Product {i}', 'quantity': 1, 'price': 99.5} for i in range(items)],
+            'shipping': {'name': 'Bench User', 'address': '1 Main St', 'city': 'Springfield',
+                         'state': 'IL', 'zip': '62701', 'country': 'USA'},
+        },
+        'password_reset': {'username': 'bench', 'reset_token': 'x' * 32},
+        'welcome': {'username': 'bench'},
+    }
+    uncached = registry.env.overlay(cache_size=0)  # Recompiles the template on every lookup
+
+    for name in SUBJECTS:
+        start = time.perf_counter()
+        for _ in range(count):
+            registry.render(name, contexts[name])
+        precompiled = (time.perf_counter() - start) / count
+
+        start = time.perf_counter()
+        for _ in range(count):
+            uncached.get_template(f'{name}.html').render(contexts[name])
+        per_call = (time.perf_counter() - start) / count
+
+        print(f"{name:<20} precompiled {precompiled * 1e6:8.1f} us/email   "
+              f"compiled per call {per_call * 1e6:8.1f} us/email")
+
+
+@click.command('stress-stock')
+@click.option('--threads', default=16, help='Concurrent buyers.')
+@click.option('--attempts', default=5, help='Checkouts attempted per buyer.')
+@click.option('--stock', default=20, help='Units of each test product.')
+@with_appcontext
+def stress_stock_command(threads, attempts, stock):
+    """Race concurrent two-item reservations against the database and verify nothing is oversold"""
+    app = current_app._get_current_object()
+    products = [Product(name=f'Stress test product {i}', price=1.0, stock=stock, category='__stress__')
+                for i in range(2)]
+    db.session.add_all(products)
+    db.session.commit()
+    lines = {p.id: 1 for p in products}
+
+    outcomes = Counter()
+    outcomes_lock = Lock()
+    start_line = Barrier(threads)
+
+    def buyer():
+        with app.app_context():
+            start_line.wait()
+            for _ in range(attempts):
+                try:
+                    reservation = reserve_stock(dict(lines))
+                    if reservation.ok:
+                        db.session.commit()
+                        outcome = 'sold'
+                    else:
+                        db.session.rollback()
+                        outcome = 'rejected'
+                except Exception as e:
+                    db.session.rollback()
+                    outcome = type(e).__name__
+                with outcomes_lock:
+                    outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    buyers = [Thread(target=buyer) for _ in range(threads)]
+    for thread in buyers:
+        thread.start()
+    for thread in buyers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db.session.expire_all()
+    remaining = [db.session.get(Product, pid).stock for pid in lines]
+    print(f"{threads * attempts} checkouts in {elapsed:.2f}s: {dict(outcomes)}")
+    print(f"Remaining stock: {remaining} (started at {stock})")
+    correct = all(left == stock - outcomes['sold'] and left >= 0 for left in remaining)
+
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+    if not correct:
+        raise click.ClickException('Stock does not match the number of successful checkouts')
+    print('OK: no overselling and no partial reservations')
+
+
+@click.command('bench-payments')
+@click.option('--requests', 'total', default=200, help='Payment intents to create.')
+@click.option('--concurrency', default=8, help='Parallel callers (like gunicorn threads).')
+@click.option('--latency', default=0.05, help='Fake Stripe response time (seconds).')
+@click.option('--failure-rate', default=0.0, help='Fraction of fake Stripe requests that return 500.')
+@click.option('--outage', is_flag=True, help='Fake Stripe answers every request with 503.')
+@with_appcontext
+def bench_payments_command(total, concurrency, latency, failure_rate, outage):
+    """Measure payment call latency and duplicates against a local fake Stripe with injected faults"""
+    app = current_app._get_current_object()
+    fake = FakeStripe(port=0, latency=latency, failure_rate=failure_rate).start()
+    fake.configure(down=outage)
+    # This process only benchmarks: point the Stripe client at the fake
+    app.config['STRIPE_SECRET_KEY'] = 'sk_test_fake'
+    app.config['STRIPE_API_BASE'] = fake.url
+    payment_utils.init_app(app)
+    payment_utils.breaker.record_success()
+
+    def create(i):
+        with app.app_context():
+            start = time.perf_counter()
+            intent = payment_utils.create_payment_intent(10.0, idempotency_key=f'bench-{i}')
+            return time.perf_counter() - start, intent is not None
+
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(create, range(total)))
+    finally:
+        fake.stop()
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    succeeded = sum(ok for _, ok in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(f"{succeeded}/{total} intents created; {fake.counters['requests']} requests reached Stripe")
+    print(f"Latency ms: p50 {percentile(50):.0f}  p95 {percentile(95):.0f}  "
+          f"p99 {percentile(99):.0f}  max {latencies[-1] * 1000:.0f}")
+    print(f"Objects created: {fake.counters['payment_intents']} for {succeeded} keys "
+          f"(idempotent replays: {fake.counters['replays']}); circuit {payment_utils.breaker.state}")
+
+
+@click.command('bench-hash')
+@click.option('--rounds', multiple=True, type=int, help='bcrypt costs to measure (default: 10, 12 and the configured one).')
+@click.option('--count', default=20, help='Hashes per measurement.')
+@click.option('--burst', default=50, help='Simultaneous logins thrown at the hashing service afterwards.')
+@with_appcontext
+def bench_hash_command(rounds, count, burst):
+    """Report bcrypt hashes/sec per cost and how the bounded hashing service absorbs a login burst"""
+    costs = sorted(set(rounds or (10, 12, password_hasher.rounds)))
+    print(f"{'rounds':>6} {'hashes/s':>10} {'ms/hash':>8} {'hashes/s x' + str(password_hasher.workers):>14}")
+    for cost in costs:
+        rate, latency = password_hasher.benchmark(cost, count)
+        parallel_rate, _ = password_hasher.benchmark(cost, count, concurrency=password_hasher.workers)
+        print(f"{cost:>6} {rate:>10.1f} {latency:>8.1f} {parallel_rate:>14.1f}")
+
+    stored = password_hasher.hash('burst-password')
+    outcomes = Counter()
+    latencies = []
+    lock = Lock()
+    start_line = Barrier(burst)
+
+    def login():
+        start_line.wait()
+        started = time.perf_counter()
+        try:
+            password_hasher.verify(stored, 'burst-password')
+            outcome = 'verified'
+        except HashingBusy:
+            outcome = 'shed (503)'
+        with lock:
+            outcomes[outcome] += 1
+            if outcome == 'verified':
+                latencies.append(time.perf_counter() - started)
+
+    threads = [Thread(target=login) for _ in range(burst)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    slowest = latencies[-1] * 1000 if latencies else 0
+    print(f"Burst of {burst} logins at cost {password_hasher.rounds} "
+          f"({password_hasher.workers} workers, {password_hasher.max_pending} queued): "
+          f"{dict(outcomes)} in {elapsed:.2f}s, slowest accepted {slowest:.0f} ms")
+
+
+@click.command('loadtest-signup')
+@click.option('--users', default=200, help='Sign-ups to attempt.')
+@click.option('--concurrency', default=16, help='Simultaneous clients (a campaign burst).')
+@click.option('--duplicate-rate', default=0.2, help='Fraction of sign-ups that race for an email already in flight.')
+@with_appcontext
+def loadtest_signup_command(users, concurrency, duplicate_rate):
+    """Burst POST /api/register through the full app stack and check no duplicate accounts or errors slip through"""
+    app = current_app._get_current_object()
+    if not app.testing and os.environ.get('FLASK_ENV', 'development') not in ('development', 'testing'):
+        raise click.ClickException('loadtest-signup creates and deletes accounts: run it with FLASK_ENV=development '
+                                   'or testing, against a database you can write to')
+    run = uuid.uuid4().hex[:8]
+    unique = max(1, int(users * (1 - duplicate_rate)))
+    emails = [f'loadtest-{run}-{i % unique}@example.com' for i in range(users)]
+    random.shuffle(emails)
+
+    def signup(email):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/api/register', json={
+            'email': email,
+            'username': email.split('@')[0],
+            'password': 'loadtest-password',
+        })
+        return response.status_code, time.perf_counter() - started
+
+    # Every client shares one address: the auth budget would answer 429 instead of racing the inserts
+    limiting = rate_limiter.enabled
+    rate_limiter.enabled = False
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(signup, emails))
+    finally:
+        rate_limiter.enabled = limiting
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for _, latency in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    created = User.query.filter(User.email.like(f'loadtest-{run}-%')).count()
+    print(f"{users} sign-ups ({unique} distinct) in {elapsed:.2f}s = {users / elapsed:.1f}/s: {dict(statuses)}")
+    print(f"Latency ms: p50 {percentile(50):.0f}  p95 {percentile(95):.0f}  p99 {percentile(99):.0f}")
+    print(f"Accounts created: {created} (expected {unique})")
+
+    User.query.filter(User.email.like(f'loadtest-{run}-%')).delete(synchronize_session=False)
+    db.session.commit()
+
+    if statuses.get(429):
+        raise click.ClickException('Sign-ups were rate limited (429), so the race was not exercised')
+    if statuses.get(500) or created != statuses.get(200, 0) or created > unique:
+        raise click.ClickException('Duplicate accounts or server errors during the burst')
+    print(f"OK: no duplicates; {statuses.get(503, 0)} shed with 503 by the hashing queue")
+
+
+def register_dev_commands(app):
+    """Attach the benchmark and load-test commands to the app's `flask` CLI"""
+    app.cli.add_command(bench_mail_command)
+    app.cli.add_command(bench_emails_command)
+    app.cli.add_command(stress_stock_command)
+    app.cli.add_command(bench_payments_command)
+    app.cli.add_command(bench_hash_command)
+    app.cli.add_command(loadtest_signup_command)
@@ -0,0 +1,220 @@
+from datetime import datetime
+from threading import Lock
+
+from jinja2 import DictLoader, Environment, select_autoescape
+from markupsafe import Markup
+
+# ==================== TEMPLATE SOURCES ====================
+
+STYLES = """
+body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+.container { max-width: 600px; margin: 0 auto; padding: 20px; }
+.header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }
+.header.plain { background: #667eea; }
+.content { background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }
+.button { display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin-top: 20px; }
+.panel { background: white; padding: 20px; border-radius: 8px; margin: 20px 0; }
+.item { border-bottom: 1px solid #eee; padding: 10px 0; }
+.total { font-size: 20px; font-weight: bold; color: #667eea; margin-top: 20px; }
+.warning { background: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 20px 0; }
+.footer { text-align: center; margin-top: 30px; color: #666; font-size: 12px; }
+"""
+
+TEMPLATES = {
+    'fragments/styles.css': STYLES,
+
+    'fragments/footer.html': """
+<div class="footer">
+    <p>&copy; {{ year }} {{ app_name }}. All rights reserved.</p>
+    <p>If you have any questions, contact us at {{ support_email }}</p>
+</div>
+""",
+
+    'layout.html': """<!DOCTYPE html>
+<html>
+<head>
+    <style>{{ fragment('fragments/styles.css') }}</style>
+</head>
+<body>
+    <div class="container">
+        <div class="header{% block header_class %}{% endblock %}">
+            {% block header %}{% endblock %}
+        </div>
+        <div class="content">
+            {% block content %}{% endblock %}
+        </div>
+        {{ fragment('fragments/footer.html', year=year) }}
+    </div>
+</body>
+</html>
+""",
+
+    'order_confirmation.html': """{% extends 'layout.html' %}
+{% block header %}
+<h1>🎉 Order Confirmed!</h1>
+<p>Thank you for your purchase</p>
+{% endblock %}
+{% block content %}
+<p>Hi {{ shipping.name }},</p>
+<p>Your order has been confirmed and will be shipped soon.</p>
+
+<div class="panel">
+    <h3>Order Details</h3>
+    <p><strong>Order Number:</strong> {{ order_number }}</p>
+    <p><strong>Order Date:</strong> {{ order_date }}</p>
+
+    <h4 style="margin-top: 20px;">Items:</h4>
+    {% for item in items %}
+    <div class="item"><strong>{{ item.name }}</strong> x {{ item.quantity }} - ${{ '%.2f' % (item.price * item.quantity) }}</div>
+    {% endfor %}
+
+    <div class="total">Total: ${{ '%.2f' % total_amount }}</div>
+</div>
+
+<div class="panel">
+    <h3>Shipping Address</h3>
+    <p>{{ shipping.address }}<br>
+    {{ shipping.city }}, {{ shipping.state }} {{ shipping.zip }}<br>
+    {{ shipping.country }}</p>
+</div>
+
+<p>We'll send you another email when your order ships.</p>
+
+<center>
+    <a href="{{ base_url }}/orders" class="button">Track Your Order</a>
+</center>
+{% endblock %}
+""",
+
+    'password_reset.html': """{% extends 'layout.html' %}
+{% block header_class %} plain{% endblock %}
+{% block header %}
+<h1>🔐 Password Reset</h1>
+{% endblock %}
+{% block content %}
+{% set reset_url = base_url ~ '/reset-password/' ~ reset_token %}
+<p>Hi {{ username }},</p>
+<p>You requested to reset your password. Click the button below to reset it:</p>
+
+<center>
+    <a href="{{ reset_url }}" class="button">Reset Password</a>
+</center>
+
+<div class="warning">
+    <strong>⚠️ Security Notice:</strong><br>
+    This link will expire in 1 hour. If you didn't request this, please ignore this email.
+</div>
+
+<p>If the button doesn't work, copy and paste this link:<br>
+{{ reset_url }}</p>
+{% endblock %}
+""",
+
+    'welcome.html': """{% extends 'layout.html' %}
+{% block header %}
+<h1>🎉 Welcome to {{ app_name }}!</h1>
+<p>Your account has been created successfully</p>
+{% endblock %}
+{% block content %}
+<p>Hi {{ username }},</p>
+<p>Thank you for joining {{ app_name }}! We're excited to have you as part of our community.</p>
+
+<div class="panel">
+    <h3>What you can do now:</h3>
+    <div class="item">🛍️ Browse thousands of products</div>
+    <div class="item">❤️ Save items to your wishlist</div>
+    <div class="item">📦 Track your orders in real-time</div>
+    <div class="item">⭐ Write reviews and ratings</div>
+    <div class="item">🎁 Get exclusive deals and offers</div>
+</div>
+
+<center>
+    <a href="{{ base_url }}" class="button">Start Shopping</a>
+</center>
+
+<p style="margin-top: 30px;">If you have any questions, feel free to reach out to our support team.</p>
+{% endblock %}
+""",
+}
+
+# Subject line per email; the body template is '<name>.html'
+SUBJECTS = {
+    'order_confirmation': 'Order Confirmation - {{ order_number }}',
+    'password_reset': 'Password Reset Request',
+    'welcome': 'Welcome to {{ app_name }}, {{ username }}!',
+}
+
+
+class EmailTemplates:
+    """
+    Registry of compiled email templates
+
+    Every template is compiled once at init_app. Emails render from plain
+    dict snapshots (JSON-safe, so they can travel in a job payload) and
+    fragments such as the stylesheet and footer are rendered once per
+    distinct argument set (the footer's year) and reused.
+    """
+
+    def __init__(self, app=None):
+        self.env = None
+        self._compiled = {}
+        self._fragments = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.env = Environment(
+            loader=DictLoader(TEMPLATES),
+            autoescape=select_autoescape(default=True, default_for_string=True),
+            trim_blocks=True,
+            lstrip_blocks=True,
+            auto_reload=False,
+        )
+        self.env.globals.update(
+            app_name=app.config.get('APP_NAME', 'ShopEasy'),
+            support_email=app.config.get('SUPPORT_EMAIL', 'support@shopeasy.com'),
+            base_url=app.config.get('APP_BASE_URL', 'http://localhost:5000').rstrip('/'),
+            fragment=self.fragment,
+        )
+        self._fragments = {}
+        text_env = self.env.overlay(autoescape=False)  # Subjects are plain text headers
+        self._compiled = {
+            name: (text_env.from_string(subject), self.env.get_template(f'{name}.html'))
+            for name, subject in SUBJECTS.items()
+        }
+        app.extensions['email_templates'] = self
+
+    def fragment(self, name, **args):
+        """Render a fragment once per distinct args and return the cached markup"""
+        key = (name, *sorted(args.items()))
+        html = self._fragments.get(key)
+        if html is None:
+            with self._lock:
+                html = self._fragments.get(key)
+                if html is None:
+                    html = Markup(self.env.get_template(name).render(args))
+                    self._fragments[key] = html
+        return html
+
+    def render(self, name, context):
+        """
+        Render an email
+
+        Args:
+            name: Template name, a key of SUBJECTS
+            context: Plain data snapshot (dicts, lists, strings and numbers);
+                `year` defaults to the current year
+
+        Returns:
+            (subject, html) tuple
+        """
+        try:
+            subject, body = self._compiled[name]
+        except KeyError:
+            raise LookupError(f"Unknown email template: {name}")
+        context = {'year': datetime.utcnow().year, **context}
+        return subject.render(context), body.render(context)
+
+
+email_templates = EmailTemplates()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import func
+
+from cache_utils import cache
+from models import db, Product, Order, Wishlist
+
+
+def make_etag(*parts):
+    """Strong entity tag from data version parts plus the request path and query string"""
+    raw = json.dumps([request.path, sorted(request.args.items(multi=True)), parts], default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def etag(version_fn, private=False):
+    """
+    Conditional GET for a JSON view
+
+    version_fn returns a small value that changes whenever the response
+    would. If it matches the client's If-None-Match, a 304 is returned
+    without running the view or serializing anything.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            tag = make_etag(version_fn(*args, **kwargs))
+            cache_control = 'private, no-cache' if private else 'public, no-cache'
+
+            if tag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(tag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return decorated_function
+    return decorator
+
+
+# ==================== DATA VERSIONS ====================
+
+def catalog_version(*args, **kwargs):
+    """
+    Product count and latest Product.updated_at
+
+    Memoized in the 'catalog' cache namespace, so it is recomputed only after
+    a catalog write invalidates the namespace (or the entry expires).
+    """
+    key = f'{cache.prefix}catalog:{cache.generation("catalog")}:version'
+    version = cache.get(key)
+    if version is None:
+        count, updated = db.session.query(func.count(Product.id), func.max(Product.updated_at)).one()
+        version = f'{count}:{updated.isoformat() if updated else ""}'
+        cache.set(key, version)
+    return version.decode('utf-8') if isinstance(version, bytes) else version
+
+
+def cart_version(lines):
+    """Cart lines, plus the catalog version for names and prices"""
+    return (sorted(lines.items()), catalog_version())
+
+
+def wishlist_version(user_id):
+    """Wishlist size and newest entry, plus the catalog version for price/stock changes"""
+    count, newest = db.session.query(func.count(Wishlist.id), func.max(Wishlist.created_at)) \
+        .filter(Wishlist.user_id == user_id).one()
+    return (count, newest, catalog_version())
+
+
+def orders_version(user_id):
+    """Order count and latest Order.updated_at, plus the catalog version for product names"""
+    count, updated = db.session.query(func.count(Order.id), func.max(Order.updated_at)) \
+        .filter(Order.user_id == user_id).one()
+    return (count, updated, catalog_version())
@@ -0,0 +1,217 @@
+"""
+Local stand-in for the Stripe API, for development and load tests
+
+Implements the endpoints payment_utils uses, honours Idempotency-Key the way
+Stripe does and can inject latency, errors and outages. Point the app at it:
+
+    python fake_stripe.py --port 12111 --latency 0.2 --failure-rate 0.1
+    STRIPE_API_BASE=http://localhost:12111 STRIPE_SECRET_KEY=sk_test_fake
+
+Faults can also be changed while it runs:
+
+    curl -X POST localhost:12111/_fake/config -d '{"down": true}'
+"""
+import argparse
+import json
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qsl
+
+
+def _unflatten(pairs):
+    """Stripe form encoding (metadata[order]=1) to nested dicts"""
+    data = {}
+    for key, value in pairs:
+        match = re.fullmatch(r'(\w+)\[(\w+)\]', key)
+        if match:
+            data.setdefault(match.group(1), {})[match.group(2)] = value
+        else:
+            data[key] = value
+    return data
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        raw = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def do_GET(self):
+        self.dispatch('GET', {})
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == '/_fake/config':
+            self.server.configure(**json.loads(body or '{}'))
+            return self.send_json(200, self.server.settings())
+        self.dispatch('POST', _unflatten(parse_qsl(body)))
+
+    def dispatch(self, method, params):
+        fake = self.server
+        fake.count('requests')
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.down:
+            return self.send_json(503, {'error': {'type': 'api_error', 'message': 'Service unavailable'}})
+        if fake.failure_rate and random.random() < fake.failure_rate:
+            return self.send_json(500, {'error': {'type': 'api_error', 'message': 'Injected failure'}})
+
+        key = self.headers.get('Idempotency-Key')
+        if method == 'POST' and key:
+            cached = fake.replay(key, self.path)
+            if cached:
+                fake.count('replays')
+                return self.send_json(*cached, headers={'Idempotent-Replayed': 'true'})
+
+        status, body = fake.handle(method, self.path, params)
+        if method == 'POST' and key:
+            fake.remember(key, self.path, status, body)
+        self.send_json(status, body)
+
+
+class FakeStripe(ThreadingHTTPServer):
+    """In-memory Stripe API; objects and counters are inspectable from scripts"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=12111, latency=0.0, failure_rate=0.0):
+        super().__init__((host, port), FakeStripeHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.down = False
+        self.objects = {}
+        self.counters = {'requests': 0, 'replays': 0, 'payment_intents': 0, 'refunds': 0}
+        self._idempotent = {}
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def configure(self, latency=None, failure_rate=None, down=None):
+        if latency is not None:
+            self.latency = float(latency)
+        if failure_rate is not None:
+            self.failure_rate = float(failure_rate)
+        if down is not None:
+            self.down = bool(down)
+
+    def settings(self):
+        return {'latency': self.latency, 'failure_rate': self.failure_rate, 'down': self.down,
+                'counters': dict(self.counters)}
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def replay(self, key, path):
+        with self._lock:
+            return self._idempotent.get((key, path))
+
+    def remember(self, key, path, status, body):
+        with self._lock:
+            self._idempotent.setdefault((key, path), (status, body))
+
+    def store(self, obj):
+        with self._lock:
+            self.objects[obj['id']] = obj
+        return obj
+
+    def handle(self, method, path, params):
+        parts = path.split('?')[0].strip('/').split('/')  # e.g. v1/payment_intents/pi_x/confirm
+
+        if parts[:2] == ['v1', 'payment_intents']:
+            if method == 'POST' and len(parts) == 2:
+                self.count('payment_intents')
+                intent_id = f'pi_{uuid.uuid4().hex[:24]}'
+                confirmed = params.get('confirm') == 'true'
+                return 200, self.store({
+                    'id': intent_id,
+                    'object': 'payment_intent',
+                    'amount': int(params.get('amount', 0)),
+                    'currency': params.get('currency', 'usd'),
+                    'status': 'succeeded' if confirmed else 'requires_payment_method',
+                    'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:16]}',
+                    'metadata': params.get('metadata', {}),
+                    'created': int(time.time()),
+                })
+            intent = self.objects.get(parts[2]) if len(parts) > 2 else None
+            if intent is None:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': 'No such payment_intent'}}
+            if method == 'POST' and parts[3:] == ['confirm']:
+                intent['status'] = 'succeeded'
+            elif method == 'POST' and parts[3:] == ['cancel']:
+                intent['status'] = 'canceled'
+            return 200, intent
+
+        if parts == ['v1', 'refunds'] and method == 'POST':
+            intent = self.objects.get(params.get('payment_intent'))
+            if intent is None:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': 'No such payment_intent'}}
+            self.count('refunds')
+            return 200, self.store({
+                'id': f're_{uuid.uuid4().hex[:24]}',
+                'object': 'refund',
+                'amount': int(params.get('amount', intent['amount'])),
+                'payment_intent': intent['id'],
+                'status': 'succeeded',
+            })
+
+        if parts == ['v1', 'checkout', 'sessions'] and method == 'POST':
+            session_id = f'cs_test_{uuid.uuid4().hex[:24]}'
+            return 200, self.store({
+                'id': session_id,
+                'object': 'checkout.session',
+                'url': f'{self.url}/pay/{session_id}',
+                'metadata': params.get('metadata', {}),
+            })
+
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({path})'}}
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever, name='fake-stripe', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local fake Stripe API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    args = parser.parse_args()
+
+    fake = FakeStripe(args.host, args.port, latency=args.latency, failure_rate=args.failure_rate)
+    print(f"Fake Stripe listening on {fake.url}")
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {fake.counters}")
+        fake.server_close()
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, FloatField, IntegerField, SelectField, BooleanField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, NumberRange
-from models import User
+from query_utils import registration_conflicts
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -22,15 +22,16 @@ class RegisterForm(FlaskForm):
         EqualTo('password', message='Passwords must match')
     ])
     
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
-            raise ValidationError('Email already registered. Please use a different email.')
-    
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            raise ValidationError('Username already taken. Please choose a different username.')
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        # Both uniqueness checks in one query
+        conflicts = registration_conflicts(self.email.data, self.username.data)
+        if 'email' in conflicts:
+            self.email.errors.append('Email already registered. Please use a different email.')
+        if 'username' in conflicts:
+            self.username.errors.append('Username already taken. Please choose a different username.')
+        return not conflicts
 
 class ProductForm(FlaskForm):
     name = StringField('Product Name', validators=[DataRequired(), Length(max=200)])
@@ -0,0 +1,86 @@
+"""
+Gunicorn configuration
+
+Every setting can be overridden with an environment variable so the same
+image can be tuned per environment from k8s/deployment.yaml.
+"""
+import os
+import signal
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Worker processes. Size to the container CPU limit, not the node's cores
+# (os.cpu_count() reports the node inside Kubernetes).
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# gthread serves several requests per worker while one waits on the database,
+# SMTP or Stripe; this subclass also stamps each request's queue time for load
+# shedding (gunicorn_workers.py). Use 'gevent' (requires the gevent package)
+# for very high connection counts, or 'sync' to disable threading.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gunicorn_workers.QueueTimedThreadWorker')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Off by default: each worker imports the application itself, so a HUP
+# (graceful reload) starts workers on the code and config now on disk.
+# GUNICORN_PRELOAD=True loads it once in the master and forks workers from
+# it instead, for faster boots and shared memory pages; HUP then restarts
+# workers on the old code and only a full restart deploys new code (fine
+# in Kubernetes, where every rollout replaces the pod).
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'False') == 'True'
+
+# Keep connections from the load balancer open between requests
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Time given to in-flight requests on SIGTERM / HUP before workers are killed
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Recycle workers periodically to bound memory growth; jitter avoids
+# restarting every worker at the same moment
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Drop metrics snapshots and the drain marker left by a previous run of this pod"""
+    from metrics import metrics
+    metrics.directory = os.environ.get('METRICS_DIR') or None
+    metrics.clear_directory()
+    drain_file = os.environ.get('HEALTH_DRAIN_FILE')
+    if drain_file and os.path.exists(drain_file):
+        os.remove(drain_file)
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master process"""
+    if not preload_app:
+        return
+    from models import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Fail /readyz as soon as this worker is told to shut down, then let gunicorn drain it"""
+    from health import health
+    stop = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        health.start_draining()
+        stop(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    """Write this worker's final metrics so its counters outlive it"""
+    from metrics import metrics
+    app = server.app.wsgi()
+    with app.app_context():
+        metrics.flush()
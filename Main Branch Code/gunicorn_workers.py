@@ -0,0 +1,29 @@
+"""
+gunicorn worker that tells the app how long each request queued
+
+gthread accepts connections on the main thread and hands them to a fixed
+thread pool; a request that arrives while every thread is busy waits in the
+pool's queue, invisible to the app. This worker stamps the moment a request
+became readable as X-Request-Start (replacing any client-sent value), so
+the rate limiter can shed by queue wait (see rate_limit.py).
+
+Selected in gunicorn.conf.py: worker_class = 'gunicorn_workers.QueueTimedThreadWorker'
+"""
+import time
+
+from gunicorn.workers.gthread import ThreadWorker
+
+HEADER = 'X-REQUEST-START'
+
+
+class QueueTimedThreadWorker(ThreadWorker):
+
+    def enqueue_req(self, conn):
+        # New connections and keep-alive connections with a new request both pass here
+        conn.enqueued_at = time.time()
+        super().enqueue_req(conn)
+
+    def handle_request(self, req, conn):
+        req.headers = [(name, value) for name, value in req.headers if name != HEADER]
+        req.headers.append((HEADER, f't={conn.enqueued_at:.6f}'))
+        return super().handle_request(req, conn)
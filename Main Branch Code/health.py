@@ -0,0 +1,92 @@
+import os
+import time
+from threading import Lock
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+
+from models import db, Job
+
+
+class HealthCheck:
+    """
+    Liveness and readiness for Kubernetes probes
+
+    /healthz only shows that the process serves requests. /readyz also
+    needs the database. That means a SELECT 1, plus the queued-job count,
+    cached for HEALTH_CHECK_TTL seconds so probes cost one round trip per
+    interval per process. Until it first succeeds, every table the models
+    define must exist (init-db has run: there are no migrations).
+    Readiness fails as soon as the pod drains: HEALTH_DRAIN_FILE exists
+    (the preStop hook creates it) or this worker received SIGTERM.
+
+    A pool checkout timeout means the pod is busy, not broken. It keeps the
+    previous result, so readiness does not flap under load and push the
+    pod's traffic onto its neighbours.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 5
+        self.drain_file = None
+        self.draining = False
+        self._lock = Lock()
+        self._checked_at = None
+        self._schema_ok = False
+        self._result = {'database': 'unknown', 'schema': 'unknown', 'job_queue_depth': None}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('HEALTH_CHECK_TTL', 5)
+        self.drain_file = app.config.get('HEALTH_DRAIN_FILE') or None
+        app.extensions['health'] = self
+
+    def start_draining(self):
+        """Fail readiness from now on in this process"""
+        self.draining = True
+
+    def is_draining(self):
+        return self.draining or (self.drain_file is not None and os.path.exists(self.drain_file))
+
+    def readiness(self):
+        """(ready, details) for /readyz"""
+        if self.is_draining():
+            return False, {'draining': True}
+        result = self._database()
+        ready = result['database'] in ('ok', 'busy') and result['schema'] == 'ok'
+        return ready, {**result, 'draining': False, 'checked_seconds_ago': round(time.monotonic() - self._checked_at, 3)}
+
+    def _database(self):
+        fresh = self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl
+        # Only one thread refreshes; the others answer from the last result meanwhile
+        if fresh or not self._lock.acquire(blocking=self._checked_at is None):
+            return self._result
+        try:
+            self._result = self._check()
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self._result
+
+    def _check(self):
+        result = dict(self._result)
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+                if not self._schema_ok:
+                    missing = sorted(set(db.metadata.tables) - set(inspect(conn).get_table_names()))
+                    self._schema_ok = not missing
+                    result['schema'] = 'ok' if not missing else f"missing tables: {', '.join(missing)}"
+                result['job_queue_depth'] = conn.scalar(
+                    select(func.count()).select_from(Job).where(Job.status == 'queued')
+                )
+            result['database'] = 'ok'
+        except PoolTimeoutError:
+            result['database'] = 'busy'
+        except SQLAlchemyError as e:
+            print(f"Readiness check failed: {e}")
+            result['database'] = 'unavailable'
+        return result
+
+
+health = HealthCheck()
@@ -0,0 +1,132 @@
+from sqlalchemy import case, update
+
+from models import db, Product
+
+
+class Reservation:
+    """Outcome of reserve_stock: the locked products and any per-item failures"""
+
+    def __init__(self, lines, products):
+        self.lines = lines  # {product_id: quantity}
+        self.products = products  # {product_id: Product}
+        self.failures = []
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def fail(self, product_id, reason, available=0):
+        product = self.products.get(product_id)
+        self.failures.append({
+            'product_id': product_id,
+            'name': product.name if product else None,
+            'requested': self.lines[product_id],
+            'available': available,
+            'reason': reason,  # not_found | insufficient_stock
+        })
+
+    @property
+    def message(self):
+        if self.ok:
+            return None
+        names = [f['name'] or f"product {f['product_id']}" for f in self.failures]
+        return f"Not enough stock for {', '.join(names)}"
+
+    @property
+    def total(self):
+        """Order total at current catalog prices"""
+        return sum(self.products[pid].price * qty for pid, qty in self.lines.items())
+
+
+def reserve_stock(lines):
+    """
+    Atomically take stock for every line of an order
+
+    One IN query loads the products (with SELECT ... FOR UPDATE in id order on
+    PostgreSQL, so concurrent multi-item checkouts lock rows in the same order
+    and cannot deadlock). One conditional UPDATE then decrements every line
+    WHERE stock >= quantity, so two checkouts can never both take the last
+    unit. Nothing is committed: the caller commits together with the order,
+    or rolls back if the reservation is not ok.
+
+    Args:
+        lines: {product_id: quantity}
+
+    Returns:
+        Reservation
+    """
+    ids = sorted(lines)
+    query = Product.query.filter(Product.id.in_(ids)).order_by(Product.id)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update()
+    products = {p.id: p for p in query.all()}
+    reservation = Reservation(lines, products)
+
+    # Cheap pre-check against the rows we just read
+    for product_id in ids:
+        product = products.get(product_id)
+        if product is None:
+            reservation.fail(product_id, 'not_found')
+        elif product.stock < lines[product_id]:
+            reservation.fail(product_id, 'insufficient_stock', product.stock)
+    if not reservation.ok:
+        return reservation
+
+    reserved = _decrement(lines)
+    for product in products.values():
+        db.session.expire(product, ['stock', 'updated_at'])
+
+    # A concurrent checkout took the stock between our read and the UPDATE
+    for product_id in ids:
+        if product_id not in reserved:
+            reservation.fail(product_id, 'insufficient_stock', products[product_id].stock)
+    return reservation
+
+
+def _decrement(lines):
+    """Conditionally decrement stock; returns the ids that had enough"""
+    if db.engine.dialect.update_returning:
+        quantity = case(lines, value=Product.id)
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id.in_(list(lines)), Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .returning(Product.id),
+            execution_options={'synchronize_session': False}
+        )
+        return {row.id for row in result}
+
+    # No UPDATE ... RETURNING (e.g. MySQL): one conditional UPDATE per line
+    reserved = set()
+    for product_id, qty in sorted(lines.items()):
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.stock >= qty)
+            .values(stock=Product.stock - qty),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount:
+            reserved.add(product_id)
+    return reserved
+
+
+def release_stock(lines):
+    """
+    Put reserved stock back (payment failed or order cancelled)
+
+    One UPDATE adds every line back; like reserve_stock nothing is
+    committed, so the caller releases in the same transaction that
+    changes the order's status.
+
+    Args:
+        lines: {product_id: quantity}
+    """
+    if not lines:
+        return
+    quantity = case(lines, value=Product.id)
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(list(lines)))
+        .values(stock=Product.stock + quantity),
+        execution_options={'synchronize_session': False}
+    )
@@ -0,0 +1,259 @@
+import os
+import random
+import time
+import traceback
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+from sqlalchemy import update
+
+from models import db, Job
+
+
+class JobQueue:
+    """
+    Persistent background job queue backed by the jobs table
+
+    A fixed number of worker threads per process claim due jobs with a
+    conditional UPDATE (so several pods can share the table), run the
+    registered handler and either mark the job done, reschedule it with
+    exponential backoff, or dead-letter it after max_attempts.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self.batch_kinds = set()
+        self._threads = []
+        self._pid = None
+        self._start_lock = Lock()
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._last_recovery = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', 2)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 2.0)
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', 5)
+        self.backoff_base = app.config.get('JOB_BACKOFF_BASE', 30)
+        self.backoff_max = app.config.get('JOB_BACKOFF_MAX', 3600)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', 600)
+        self.batch_size = app.config.get('JOB_BATCH_SIZE', 50)
+        app.extensions['job_queue'] = self
+
+        # Workers start lazily in each process (after gunicorn forks)
+        app.before_request(self.ensure_started)
+
+    def handler(self, kind, batch=False):
+        """
+        Register the function that runs jobs of this kind
+
+        A regular handler receives one payload. A batch handler receives a
+        list of payloads of due jobs of the same kind and returns a list of
+        the same length holding None for each success or the exception
+        that failed that job.
+        """
+        def decorator(f):
+            self.handlers[kind] = f
+            if batch:
+                self.batch_kinds.add(kind)
+            else:
+                self.batch_kinds.discard(kind)
+            return f
+        return decorator
+
+    def enqueue(self, kind, payload=None, max_attempts=None, delay=0, commit=True):
+        """
+        Persist a job and wake a local worker
+
+        Pass commit=False to enqueue inside the caller's transaction, so the
+        job only exists if the surrounding write commits.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        job = Job(
+            kind=kind,
+            payload=payload or {},
+            max_attempts=max_attempts or self.max_attempts,
+            run_at=datetime.utcnow() + timedelta(seconds=delay)
+        )
+        db.session.add(job)
+        if commit:
+            db.session.commit()
+            self.wake()
+        return job
+
+    def wake(self):
+        """Start a local worker on new work (call after committing jobs enqueued with commit=False)"""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def depth(self):
+        """Number of jobs waiting to run"""
+        return Job.query.filter(Job.status == 'queued').count()
+
+    # ==================== WORKERS ====================
+
+    def ensure_started(self):
+        if self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork(): start a fresh set in this process
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            processed = 0
+            try:
+                with self.app.app_context():
+                    processed = self.run_pending()
+            except Exception as e:
+                print(f"Job worker error: {e}")
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_pending(self, limit=10):
+        """Claim and run up to limit due jobs; returns how many ran"""
+        self._recover_stale()
+        processed = 0
+        while processed < limit:
+            job = self._claim_next()
+            if job is None:
+                break
+            if job.kind in self.batch_kinds:
+                jobs = [job]
+                while len(jobs) < self.batch_size:
+                    more = self._claim_next(kind=job.kind)
+                    if more is None:
+                        break
+                    jobs.append(more)
+                self._run_batch(jobs)
+                processed += len(jobs)
+            else:
+                self._run(job)
+                processed += 1
+        return processed
+
+    def _claim_next(self, kind=None):
+        now = datetime.utcnow()
+        candidates = db.session.query(Job.id).filter(
+            Job.status == 'queued',
+            Job.run_at <= now
+        )
+        if kind is not None:
+            candidates = candidates.filter(Job.kind == kind)
+        candidates = candidates.order_by(Job.run_at, Job.id).limit(5).all()
+
+        for (job_id,) in candidates:
+            # Only one worker (in any process) wins the queued -> running transition
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        return None
+
+    def _run(self, job):
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind: {job.kind}")
+            handler(job.payload or {})
+        except Exception as e:
+            db.session.rollback()
+            self._fail(job.id, job.attempts, job.max_attempts, e)
+            return
+
+        db.session.execute(
+            update(Job).where(Job.id == job.id).values(status='done', locked_at=None, last_error=None)
+        )
+        db.session.commit()
+
+    def _run_batch(self, jobs):
+        handler = self.handlers.get(jobs[0].kind)
+        try:
+            results = handler([job.payload or {} for job in jobs])
+            if len(results) != len(jobs):
+                raise RuntimeError(f"Batch handler returned {len(results)} results for {len(jobs)} jobs")
+        except Exception as e:
+            db.session.rollback()
+            results = [e] * len(jobs)
+
+        done = [job.id for job, error in zip(jobs, results) if error is None]
+        if done:
+            db.session.execute(
+                update(Job).where(Job.id.in_(done)).values(status='done', locked_at=None, last_error=None)
+            )
+            db.session.commit()
+        for job, error in zip(jobs, results):
+            if error is not None:
+                self._fail(job.id, job.attempts, job.max_attempts, error)
+
+    def _fail(self, job_id, attempts, max_attempts, error):
+        message = ''.join(traceback.format_exception_only(type(error), error)).strip()
+        if attempts >= max_attempts:
+            values = {'status': 'dead', 'locked_at': None, 'last_error': message}
+            print(f"Job {job_id} dead-lettered after {attempts} attempts: {message}")
+        else:
+            values = {
+                'status': 'queued',
+                'locked_at': None,
+                'last_error': message,
+                'run_at': datetime.utcnow() + timedelta(seconds=self.backoff(attempts)),
+            }
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+
+    def backoff(self, attempts):
+        """Exponential backoff with full jitter, capped at backoff_max seconds"""
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _recover_stale(self):
+        """Requeue jobs left running by a worker that died (e.g. a pod restart)"""
+        if time.monotonic() - self._last_recovery < self.stale_after / 4:
+            return
+        self._last_recovery = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        db.session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.locked_at < cutoff)
+            .values(status='queued', locked_at=None)
+        )
+        db.session.commit()
+
+    def requeue_dead(self, kind=None):
+        """Move dead-lettered jobs back to the queue with a fresh attempt budget"""
+        query = update(Job).where(Job.status == 'dead')
+        if kind:
+            query = query.where(Job.kind == kind)
+        count = db.session.execute(
+            query.values(status='queued', attempts=0, run_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return count
+
+
+job_queue = JobQueue()
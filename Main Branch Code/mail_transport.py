@@ -0,0 +1,153 @@
+import smtplib
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import BoundedSemaphore
+
+from flask_mail import Connection
+
+# Errors after which an SMTP session cannot be reused (every smtplib error is an
+# OSError, so refused recipients or rejected data must not be lumped in here)
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class PooledConnection:
+    """An open Flask-Mail connection plus bookkeeping for reuse"""
+
+    def __init__(self, mail_state):
+        self.connection = Connection(mail_state)
+        self.connection.__enter__()  # Opens the SMTP session (TLS + login)
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+    def alive(self, max_idle):
+        if self.connection.host is None:  # MAIL_SUPPRESS_SEND
+            return True
+        if time.monotonic() - self.last_used < max_idle:
+            return True
+        # Idle for a while: the server may have dropped us, check cheaply
+        try:
+            return self.connection.host.noop()[0] == 250
+        except CONNECTION_ERRORS:
+            return False
+
+    def send(self, message):
+        self.connection.send(message)
+        self.last_used = time.monotonic()
+        self.sent += 1
+
+    def close(self):
+        try:
+            self.connection.__exit__(None, None, None)
+        except CONNECTION_ERRORS:
+            pass
+
+
+class SMTPConnectionPool:
+    """
+    Small pool of authenticated SMTP sessions shared by mail senders
+
+    Opening an SMTP session costs a TCP handshake, STARTTLS and AUTH; the
+    pool keeps up to MAIL_POOL_SIZE sessions open, reuses them across
+    messages and replaces any the server has closed.
+    """
+
+    def __init__(self, app=None):
+        self._idle = LifoQueue()
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config.get('MAIL_POOL_SIZE', 2)
+        self.max_idle = app.config.get('MAIL_POOL_MAX_IDLE', 30)
+        # Recycle a session after this many messages (many providers cap it)
+        self.max_messages = app.config.get('MAIL_POOL_MAX_MESSAGES', 100)
+        self.acquire_timeout = app.config.get('MAIL_POOL_TIMEOUT', 30)
+        self._slots = BoundedSemaphore(self.size)
+        self._mail_state = app.extensions['mail']
+        app.extensions['mail_pool'] = self
+
+    @contextmanager
+    def connection(self):
+        """Borrow an open session; it goes back to the pool unless it broke"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError('No SMTP connection available')
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled
+        except CONNECTION_ERRORS:
+            if pooled is not None:
+                pooled.close()
+            pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                if pooled.sent >= self.max_messages:
+                    pooled.close()
+                else:
+                    self._idle.put(pooled)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except Empty:
+                return PooledConnection(self._mail_state)
+            if pooled.alive(self.max_idle):
+                return pooled
+            pooled.close()
+
+    def send(self, message):
+        """Send one message, reconnecting once if the pooled session was dropped"""
+        return self.send_batch([message])[0]
+
+    def send_batch(self, messages):
+        """
+        Send messages over one pooled session
+
+        Returns a list aligned with messages holding None for each delivered
+        message or the exception that prevented delivery.
+        """
+        results = [None] * len(messages)
+        pending = list(range(len(messages)))
+        reconnected = False
+
+        while pending:
+            try:
+                with self.connection() as pooled:
+                    while pending:
+                        index = pending[0]
+                        try:
+                            pooled.send(messages[index])
+                        except CONNECTION_ERRORS:
+                            raise
+                        except Exception as e:
+                            # Message-level failure: the session is still usable
+                            results[index] = e
+                        pending.pop(0)
+            except CONNECTION_ERRORS as e:
+                if reconnected:
+                    for index in pending:
+                        results[index] = e
+                    break
+                # Session went away mid-batch: retry the rest on a fresh one
+                reconnected = True
+            except Exception as e:
+                # Could not open a session at all (e.g. authentication failed)
+                for index in pending:
+                    results[index] = e
+                break
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+mail_pool = SMTPConnectionPool()
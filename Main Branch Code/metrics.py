@@ -0,0 +1,383 @@
+import glob
+import json
+import os
+import time
+from threading import Lock
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+NAMESPACE = 'shopeasy'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of one process, rendered in Prometheus text format
+
+    Gauges are merged across processes by `mode`: 'sum' or 'max' over live
+    processes, or 'live' for values only the scraped process reports (never
+    written to snapshot files). Counters and histograms are always summed,
+    including those of exited workers, so they never go backwards.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.families = {}  # name -> (type, help, buckets, mode)
+        self._samples = {}  # name -> {label tuple: value, or [bucket counts..., sum]}
+
+    def define(self, name, kind, help, buckets=None, mode='sum'):
+        with self._lock:
+            self.families[name] = (kind, help, tuple(buckets or ()), mode)
+            self._samples.setdefault(name, {})
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            samples = self._samples[name]
+            samples[labels] = samples.get(labels, 0) + amount
+
+    def set(self, name, labels=(), value=0):
+        with self._lock:
+            self._samples[name][labels] = value
+
+    def observe(self, name, labels, value):
+        buckets = self.families[name][2]
+        with self._lock:
+            samples = self._samples[name]
+            counts = samples.get(labels)
+            if counts is None:
+                counts = samples[labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def snapshot(self, include_live=True):
+        """{name: [[labels, value], ...]}, JSON-serialisable"""
+        with self._lock:
+            return {
+                name: [[list(labels), value if not isinstance(value, list) else list(value)]
+                       for labels, value in samples.items()]
+                for name, samples in self._samples.items()
+                if include_live or self.families[name][3] != 'live'
+            }
+
+    def merge(self, snapshots):
+        """Combine (snapshot, alive) pairs into {name: {label tuple: value}}"""
+        merged = {name: {} for name in self.families}
+        for snapshot, alive in snapshots:
+            for name, samples in snapshot.items():
+                if name not in self.families:
+                    continue
+                kind, _, _, mode = self.families[name]
+                if kind == 'gauge' and not alive:
+                    continue
+                target = merged[name]
+                for labels, value in samples:
+                    labels = tuple(tuple(pair) for pair in labels)
+                    current = target.get(labels)
+                    if current is None:
+                        target[labels] = value
+                    elif kind == 'histogram':
+                        target[labels] = [a + b for a, b in zip(current, value)]
+                    elif mode == 'max':
+                        target[labels] = max(current, value)
+                    else:
+                        target[labels] = current + value
+        return merged
+
+    def render(self, merged):
+        lines = []
+        for name, (kind, help, buckets, _) in self.families.items():
+            samples = merged.get(name)
+            if not samples:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(samples.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """
+    Request instrumentation exported on /metrics
+
+    Records, per endpoint: latency, status codes, request and response
+    sizes, and how many SQL statements (and how much time in them) each
+    request needed; plus in-flight requests and the counters the cache,
+    principal cache, rate limiter, connection pool and payment breaker
+    already keep.
+
+    Each gunicorn worker keeps its own registry. With METRICS_DIR set, a
+    worker writes a snapshot there at most every METRICS_FLUSH_INTERVAL
+    seconds, and a scrape (which reaches one worker) merges them all, so
+    one scrape covers the whole pod. Without it only the scraped worker is
+    reported.
+    """
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5
+        self.token = None
+        self._flushed_at = 0.0
+        self._started = time.time_ns()
+        self._collectors = []
+        self._define()
+        if app is not None:
+            self.init_app(app)
+
+    def _define(self):
+        define = self.registry.define
+        define(f'{NAMESPACE}_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status')
+        define(f'{NAMESPACE}_http_request_duration_seconds', 'histogram', 'Request latency by endpoint',
+               LATENCY_BUCKETS)
+        define(f'{NAMESPACE}_http_requests_in_flight', 'gauge', 'Requests being served right now')
+        define(f'{NAMESPACE}_http_request_size_bytes', 'histogram', 'Request body size by endpoint', SIZE_BUCKETS)
+        define(f'{NAMESPACE}_http_response_size_bytes', 'histogram', 'Response body size by endpoint', SIZE_BUCKETS)
+        define(f'{NAMESPACE}_http_request_db_queries', 'histogram', 'SQL statements executed per request',
+               QUERY_COUNT_BUCKETS)
+        define(f'{NAMESPACE}_http_request_db_seconds', 'histogram', 'Time spent in SQL per request',
+               LATENCY_BUCKETS)
+        define(f'{NAMESPACE}_db_query_duration_seconds', 'histogram',
+               'SQL statement latency (requests and background jobs)', LATENCY_BUCKETS)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        self.token = app.config.get('METRICS_TOKEN') or None
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_query(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def end_query(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+            self.registry.observe(f'{NAMESPACE}_db_query_duration_seconds', (), elapsed)
+            if has_request_context() and 'metrics_started' in g:
+                g.metrics_queries += 1
+                g.metrics_query_seconds += elapsed
+
+    def collector(self, fn=None, scrape_only=False):
+        """
+        Register fn() -> [(name, type, help, labels, value), ...], called before each snapshot
+
+        Use it for values other extensions already count; type 'gauge' may
+        carry a merge mode as 'gauge:max' or 'gauge:live'. scrape_only
+        collectors (e.g. ones that query the database) run only on /metrics.
+        """
+        if fn is None:
+            return lambda fn: self.collector(fn, scrape_only)
+        self._collectors.append((fn, scrape_only))
+        return fn
+
+    # ==================== REQUESTS ====================
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+        self.registry.inc(f'{NAMESPACE}_http_requests_in_flight', (), 1)
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        g.metrics_response_size = response.calculate_content_length()
+        return response
+
+    def _teardown_request(self, exc=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        registry = self.registry
+        registry.inc(f'{NAMESPACE}_http_requests_in_flight', (), -1)
+
+        endpoint = (('endpoint', request.endpoint or 'unmatched'),)
+        method = request.method if request.method in METHODS else 'OTHER'
+        status = g.get('metrics_status', 500 if exc is not None else 200)
+        registry.inc(f'{NAMESPACE}_http_requests_total', endpoint + (('method', method), ('status', str(status))))
+        registry.observe(f'{NAMESPACE}_http_request_duration_seconds', endpoint, elapsed)
+        registry.observe(f'{NAMESPACE}_http_request_size_bytes', endpoint, request.content_length or 0)
+        response_size = g.get('metrics_response_size')
+        if response_size is not None:
+            registry.observe(f'{NAMESPACE}_http_response_size_bytes', endpoint, response_size)
+        registry.observe(f'{NAMESPACE}_http_request_db_queries', endpoint, g.metrics_queries)
+        registry.observe(f'{NAMESPACE}_http_request_db_seconds', endpoint, g.metrics_query_seconds)
+
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    # ==================== EXPORT ====================
+
+    def collect(self, scrape=False):
+        """Copy the collectors' current values into the registry"""
+        for fn, scrape_only in self._collectors:
+            if scrape_only and not scrape:
+                continue
+            try:
+                samples = fn()
+            except Exception as e:
+                print(f"Metrics collector {fn.__name__} failed: {e}")
+                continue
+            for name, kind, help, labels, value in samples:
+                if name not in self.registry.families:
+                    kind, _, mode = kind.partition(':')
+                    self.registry.define(name, kind, help, mode=mode or 'sum')
+                self.registry.set(name, tuple(labels), value)
+
+    def _path(self):
+        return os.path.join(self.directory, f'{os.getpid()}-{self._started}.json')
+
+    def flush(self, collect=True):
+        """Write this process's snapshot to METRICS_DIR (atomically, for concurrent scrapes)"""
+        self._flushed_at = time.monotonic()
+        if not self.directory:
+            return
+        if collect:
+            self.collect()
+        path = self._path()
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.registry.snapshot(include_live=False), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Failed to write metrics snapshot {path}: {e}")
+
+    def clear_directory(self):
+        """Remove old snapshots (once, before workers start: see gunicorn.conf.py)"""
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                os.remove(path)
+
+    def export(self):
+        """Prometheus text exposition of this pod (or process, without METRICS_DIR)"""
+        self.collect(scrape=True)
+        snapshots = [(self.registry.snapshot(), True)]
+        if self.directory:
+            self.flush(collect=False)
+            own = self._path()
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                pid = int(os.path.basename(path).split('-')[0])
+                snapshots.append((snapshot, _alive(pid)))
+        return self.registry.render(self.registry.merge(snapshots))
+
+    def authorized(self):
+        """True unless METRICS_TOKEN is set and the request does not carry it as a bearer token"""
+        if not self.token:
+            return True
+        return request.headers.get('Authorization', '') == f'Bearer {self.token}'
+
+
+metrics = Metrics()
+
+
+@metrics.collector
+def _extension_stats():
+    """Counters kept by other extensions (imported lazily: they import nothing from here)"""
+    from cache_utils import cache
+    from db_utils import pool_stats
+    from payment_utils import breaker
+    from rate_limit import rate_limiter
+    from session_principal import principals
+
+    samples = []
+    for name, stats in (('catalog', cache.stats()), ('principals', principals.stats())):
+        samples.append((f'{NAMESPACE}_cache_hits_total', 'counter', 'Cache hits', [('cache', name)], stats['hits']))
+        samples.append((f'{NAMESPACE}_cache_misses_total', 'counter', 'Cache misses', [('cache', name)],
+                        stats['misses']))
+
+    if rate_limiter.backend is not None:
+        for decision, count in rate_limiter.stats().items():
+            if decision in ('allowed', 'limited', 'shed'):
+                samples.append((f'{NAMESPACE}_rate_limit_decisions_total', 'counter',
+                                'Rate limiter outcomes (limited = 429, shed = 503)', [('decision', decision)], count))
+
+    pool = pool_stats.snapshot(db.engine.pool)
+    samples.append((f'{NAMESPACE}_db_pool_checkouts_total', 'counter', 'Connection pool checkouts', [],
+                    pool['checkouts']))
+    samples.append((f'{NAMESPACE}_db_pool_timeouts_total', 'counter', 'Connection pool checkout timeouts', [],
+                    pool['timeouts']))
+    samples.append((f'{NAMESPACE}_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection',
+                    [], pool['wait_seconds_total']))
+    if 'checked_out' in pool:
+        samples.append((f'{NAMESPACE}_db_pool_checked_out', 'gauge', 'Connections in use', [],
+                        pool['checked_out']))
+
+    state = breaker.state
+    for name in ('closed', 'half-open', 'open'):
+        samples.append((f'{NAMESPACE}_payment_circuit_state', 'gauge:max', 'Stripe circuit breaker state',
+                        [('state', name)], int(state == name)))
+    return samples
+
+
+@metrics.collector(scrape_only=True)
+def _job_queue_depth():
+    """Queued jobs: one COUNT query per scrape"""
+    from job_queue import job_queue
+    return [(f'{NAMESPACE}_job_queue_depth', 'gauge:live', 'Jobs waiting to run', [], job_queue.depth())]
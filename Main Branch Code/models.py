@@ -1,10 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from flask_bcrypt import Bcrypt
+from sqlalchemy import event, func, case, cast, select, update, Float
 from datetime import datetime
 
+from password_hashing import password_hasher
+
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -22,10 +23,10 @@ class User(UserMixin, db.Model):
     wishlist = db.relationship('Wishlist', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
     
     def __repr__(self):
         return f'<User {self.email}>'
@@ -36,31 +37,53 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Float, nullable=False, index=True)
     image_url = db.Column(db.String(500))
-    category = db.Column(db.String(100))
+    category = db.Column(db.String(100), index=True)
     stock = db.Column(db.Integer, default=0)
     rating = db.Column(db.Float, default=0.0)
+    rating_sum = db.Column(db.Integer, default=0, nullable=False)  # Sum of review ratings
+    rating_count = db.Column(db.Integer, default=0, nullable=False)  # Number of reviews
     features = db.Column(db.JSON)  # Store as JSON array
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     reviews = db.relationship('Review', backref='product', lazy=True, cascade='all, delete-orphan')
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
     wishlist_items = db.relationship('Wishlist', backref='product', lazy=True, cascade='all, delete-orphan')
+    cart_items = db.relationship('CartItem', backref='product', lazy=True, cascade='all, delete-orphan')
+    
+    # Keyset pagination by rating orders on (rating, id): one index serves both the sort and the cursor
+    __table_args__ = (db.Index('ix_products_rating_id', 'rating', 'id'),)
     
     @property
     def in_stock(self):
         return self.stock > 0
     
-    def update_rating(self):
-        """Calculate average rating from reviews"""
-        if self.reviews:
-            total = sum(review.rating for review in self.reviews)
-            self.rating = round(total / len(self.reviews), 1)
-        else:
-            self.rating = 0.0
+    @staticmethod
+    def recompute_ratings():
+        """
+        Rebuild rating_sum, rating_count and rating from the reviews table
+        
+        Repairs the denormalized counters in two set-based UPDATEs. Products
+        without reviews keep their current rating.
+        """
+        review_sum = select(func.coalesce(func.sum(Review.rating), 0)) \
+            .where(Review.product_id == Product.id).scalar_subquery()
+        review_count = select(func.count(Review.id)) \
+            .where(Review.product_id == Product.id).scalar_subquery()
+        
+        db.session.execute(
+            update(Product).values(rating_sum=review_sum, rating_count=review_count),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(
+            update(Product).where(Product.rating_count > 0).values(
+                rating=func.round(cast(Product.rating_sum, Float) / Product.rating_count, 1)
+            ),
+            execution_options={'synchronize_session': False}
+        )
     
     def __repr__(self):
         return f'<Product {self.name}>'
@@ -75,6 +98,7 @@ class Order(db.Model):
     status = db.Column(db.String(50), default='pending')  # pending, confirmed, shipped, delivered, cancelled
     payment_status = db.Column(db.String(50), default='pending')  # pending, completed, failed
     payment_id = db.Column(db.String(200))  # Stripe payment ID
+    checkout_key = db.Column(db.String(64))  # Client Idempotency-Key; a resubmitted checkout returns this order
     
     # Shipping details
     shipping_name = db.Column(db.String(200))
@@ -92,6 +116,8 @@ class Order(db.Model):
     # Relationships
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (db.UniqueConstraint('user_id', 'checkout_key', name='unique_order_checkout_key'),)
+    
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
@@ -120,6 +146,65 @@ class Review(db.Model):
     def __repr__(self):
         return f'<Review {self.id}>'
 
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(100), nullable=False)  # Handler name, e.g. send_email
+    payload = db.Column(db.JSON)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, dead
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Earliest time to (re)try
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+class StripeEvent(db.Model):
+    __tablename__ = 'stripe_events'
+    
+    id = db.Column(db.String(255), primary_key=True)  # Stripe event id (evt_...); a redelivery is a duplicate
+    type = db.Column(db.String(100), nullable=False)  # e.g. payment_intent.succeeded
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), default='received', nullable=False)  # received, processed
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<StripeEvent {self.id} {self.type}>'
+
+def _adjust_product_rating(connection, product_id, rating, delta):
+    """Apply one review insert (+1) or delete (-1) to the product counters in SQL"""
+    products = Product.__table__
+    new_sum = products.c.rating_sum + rating * delta
+    new_count = products.c.rating_count + delta
+    connection.execute(
+        products.update()
+        .where(products.c.id == product_id)
+        .values(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating=case(
+                (new_count > 0, func.round(cast(new_sum, Float) / new_count, 1)),
+                else_=0.0
+            )
+        )
+    )
+
+@event.listens_for(Review, 'after_insert')
+def review_inserted(mapper, connection, review):
+    _adjust_product_rating(connection, review.product_id, review.rating, 1)
+
+@event.listens_for(Review, 'after_delete')
+def review_deleted(mapper, connection, review):
+    _adjust_product_rating(connection, review.product_id, review.rating, -1)
+
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
     
@@ -133,3 +218,28 @@ class Wishlist(db.Model):
     
     def __repr__(self):
         return f'<Wishlist {self.id}>'
+
+class CartItem(db.Model):
+    """One cart line in the database cart store (see cart_store.py)"""
+    __tablename__ = 'cart_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cart_key = db.Column(db.String(64), nullable=False)  # user:<id> or guest:<uuid>
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('cart_key', 'product_id', name='unique_cart_line'),)
+    
+    def __repr__(self):
+        return f'<CartItem {self.cart_key} {self.product_id}>'
+
+class CacheGeneration(db.Model):
+    """Invalidation counter of a cache namespace, shared by every process (see cache_utils.py)"""
+    __tablename__ = 'cache_generations'
+    
+    key = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CacheGeneration {self.key}={self.value}>'
@@ -0,0 +1,274 @@
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, update
+
+from cache_utils import cache
+from email_utils import send_order_confirmation_email
+from inventory import release_stock
+from job_queue import job_queue
+from models import db, Order, OrderItem
+from payment_utils import (create_payment_intent, retrieve_payment_intent, get_payment_status,
+                           cancel_payment_intent, refund_payment)
+
+
+def schedule_settlement(order, commit=False):
+    """
+    Queue payment settlement for a freshly accepted order
+
+    Enqueued inside the checkout transaction by default, so the job exists
+    exactly when the pending order does; call job_queue.wake() after the
+    commit.
+    """
+    return job_queue.enqueue('settle_payment', {'order_id': order.id, 'checks': 0}, commit=commit)
+
+
+def payment_intent_for(order):
+    """
+    The order's Stripe payment intent, created on first use
+
+    Only the settle_payment job calls it, so checkout never waits on Stripe;
+    creation carries the per-order idempotency key, so a retried job always
+    gets the same intent (the status endpoint hands its client_secret out).
+
+    Returns:
+        Payment intent object, or None if Stripe is not configured, the
+        order is no longer pending or Stripe is unavailable
+    """
+    if not current_app.config.get('STRIPE_SECRET_KEY') or order.payment_status != 'pending':
+        return None
+    if order.payment_id:
+        return retrieve_payment_intent(order.payment_id)
+
+    intent = create_payment_intent(
+        amount=order.total_amount,
+        metadata={
+            'order_number': order.order_number,
+            'user_id': order.user_id,
+            'user_email': order.shipping_email
+        },
+        idempotency_key=f'order-{order.order_number}-payment-intent'
+    )
+    if intent is None:
+        return None
+    db.session.execute(
+        update(Order).where(Order.id == order.id, Order.payment_id.is_(None)).values(payment_id=intent.id),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    db.session.refresh(order)
+    return intent
+
+
+@job_queue.handler('settle_payment')
+def settle_payment(payload):
+    """
+    Job handler: move a pending order to paid or failed
+
+    Creates the payment intent if checkout could not (idempotent per order)
+    and checks its status, re-queueing itself with a growing
+    delay while the customer is still paying. With webhooks configured the
+    outcome arrives through stripe_webhooks instead and the job only looks
+    again at the deadline. Orders still unpaid after PAYMENT_SETTLE_TIMEOUT
+    seconds are cancelled and their stock is released. Stripe errors raise,
+    so the queue retries with backoff.
+    """
+    order = db.session.get(Order, payload['order_id'])
+    if order is None or order.payment_status != 'pending':
+        return  # Settled already (retry, webhook or admin)
+
+    config = current_app.config
+    if not config.get('STRIPE_SECRET_KEY'):
+        # Stripe not configured: auto-complete for testing
+        complete_order(order, order.payment_id or f'TEST-{uuid.uuid4().hex[:8]}')
+        return
+
+    if order.payment_id:
+        status = get_payment_status(order.payment_id)
+        if status is None:
+            raise RuntimeError(f"Could not check payment for {order.order_number}")
+    else:
+        intent = payment_intent_for(order)
+        if intent is None:
+            raise RuntimeError(f"Could not create payment intent for {order.order_number}")
+        status = intent.status
+
+    if status == 'succeeded':
+        if not complete_order(order, order.payment_id) and order.status == 'cancelled':
+            # Cancelled while the customer was paying: release the stock and give the money back
+            fail_order(order)
+            schedule_refund(order, order.payment_id, commit=True)
+    elif status == 'canceled':
+        fail_order(order)
+    elif datetime.utcnow() - order.created_at > timedelta(seconds=config.get('PAYMENT_SETTLE_TIMEOUT', 1800)):
+        if cancel_payment_intent(order.payment_id):
+            fail_order(order)
+        else:
+            raise RuntimeError(f"Could not cancel unpaid payment for {order.order_number}")
+    else:
+        checks = payload.get('checks', 0) + 1
+        timeout = config.get('PAYMENT_SETTLE_TIMEOUT', 1800)
+        if config.get('STRIPE_WEBHOOK_SECRET'):
+            # Stripe reports the outcome to /api/webhooks/stripe: only look again at the deadline
+            delay = max(0, timeout - (datetime.utcnow() - order.created_at).total_seconds())
+        else:
+            # Customer has not paid yet: look again later, backing off to PAYMENT_SETTLE_POLL_MAX
+            delay = min(config.get('PAYMENT_SETTLE_POLL', 5) * 2 ** (checks - 1), config.get('PAYMENT_SETTLE_POLL_MAX', 300))
+        job_queue.enqueue('settle_payment', {'order_id': order.id, 'checks': checks}, delay=delay)
+
+
+def schedule_refund(order, payment_id, commit=False):
+    """Queue a full refund of a payment captured for an order that is cancelled"""
+    return job_queue.enqueue('refund_payment', {'order_id': order.id, 'payment_id': payment_id}, commit=commit)
+
+
+@job_queue.handler('refund_payment')
+def refund_cancelled_order(payload):
+    """
+    Job handler: refund the payment of a cancelled order and record it
+
+    Stripe errors raise, so the queue retries with backoff and finally
+    dead-letters the job for an operator (`flask requeue-dead-jobs`).
+    """
+    payment_id = payload['payment_id']
+    # Full refund: shares its idempotency key with reconcile-payments, so the two never both refund
+    if refund_payment(payment_id) is None:
+        raise RuntimeError(f"Could not refund {payment_id} for cancelled order {payload['order_id']}")
+    db.session.execute(
+        update(Order).where(Order.id == payload['order_id'],
+                            Order.payment_status.in_(['failed', 'completed', 'partially_refunded']))
+        .values(payment_id=payment_id, payment_status='refunded'),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+
+def _settle(order_ids, *conditions, **values):
+    """
+    Move orders out of payment_status 'pending' in one UPDATE
+
+    Returns the ids this call settled; orders a concurrent settler (job,
+    webhook or admin) got to first, or that fail the extra conditions, are
+    left alone. Nothing is committed.
+    """
+    if not order_ids:
+        return set()
+    statement = update(Order).where(Order.id.in_(list(order_ids)), Order.payment_status == 'pending', *conditions) \
+        .values(**values)
+    if db.engine.dialect.update_returning:
+        result = db.session.execute(statement.returning(Order.id), execution_options={'synchronize_session': False})
+        return {row.id for row in result}
+
+    # No UPDATE ... RETURNING (e.g. MySQL): one conditional UPDATE per order
+    settled = set()
+    for order_id in sorted(order_ids):
+        result = db.session.execute(
+            statement.where(Order.id == order_id),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount:
+            settled.add(order_id)
+    return settled
+
+
+def complete_orders(payments):
+    """
+    Mark pending orders paid and queue their confirmation emails
+
+    The emails are queued in the same transaction, so an order is never
+    confirmed without its email.
+
+    Args:
+        payments: {order_id: payment_id}
+
+    Returns:
+        Ids of the orders settled by this call
+    """
+    # Never reopen an order an admin cancelled while it was being paid
+    settled = _settle(set(payments), Order.status != 'cancelled', status='confirmed', payment_status='completed',
+                      payment_id=case(payments, value=Order.id))
+    if settled:
+        for order in Order.query.filter(Order.id.in_(list(settled))):
+            send_order_confirmation_email(order, commit=False)
+    db.session.commit()
+    if settled:
+        job_queue.wake()
+    return settled
+
+
+def fail_orders(order_ids):
+    """
+    Cancel pending orders whose payment failed and put their stock back
+
+    Returns:
+        Ids of the orders settled by this call
+    """
+    settled = _settle(set(order_ids), status='cancelled', payment_status='failed')
+    if not settled:
+        db.session.rollback()
+        return settled
+    _release_order_stock(settled)
+    db.session.commit()
+    cache.invalidate('catalog')
+    return settled
+
+
+def _release_order_stock(order_ids):
+    lines = {}
+    for product_id, quantity in db.session.query(OrderItem.product_id, OrderItem.quantity) \
+            .filter(OrderItem.order_id.in_(list(order_ids))).all():
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    release_stock(lines)
+
+
+def cancel_order(order):
+    """
+    Admin cancellation: put the stock back and make sure the customer is not charged
+
+    A pending order is failed like an unpaid one and its payment intent
+    cancelled; if the customer paid in the meantime the payment is refunded.
+    A paid order is cancelled and refunded in full (refund_payment job).
+
+    Returns:
+        False if the order was cancelled already
+    """
+    if fail_orders([order.id]):
+        db.session.refresh(order)
+        if (order.payment_id or '').startswith('pi_') and not cancel_payment_intent(order.payment_id):
+            # Paid just now, or Stripe unavailable (reconcile-payments refunds it later)
+            if get_payment_status(order.payment_id) == 'succeeded':
+                schedule_refund(order, order.payment_id, commit=True)
+                job_queue.wake()
+        return True
+
+    cancelled = db.session.execute(
+        update(Order).where(Order.id == order.id, Order.status != 'cancelled').values(status='cancelled'),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not cancelled:
+        db.session.rollback()
+        return False
+    db.session.refresh(order)
+    _release_order_stock([order.id])
+    paid = order.payment_status in ('completed', 'partially_refunded')
+    if paid and (order.payment_id or '').startswith('pi_'):
+        schedule_refund(order, order.payment_id)
+    db.session.commit()
+    cache.invalidate('catalog')
+    job_queue.wake()
+    return True
+
+
+def complete_order(order, payment_id):
+    """Mark one pending order paid; False if it was settled already"""
+    settled = complete_orders({order.id: payment_id})
+    db.session.refresh(order)
+    return bool(settled)
+
+
+def fail_order(order):
+    """Cancel one pending order and release its stock; False if it was settled already"""
+    settled = fail_orders([order.id])
+    db.session.refresh(order)
+    return bool(settled)
@@ -0,0 +1,124 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from threading import Lock
+
+from flask_bcrypt import Bcrypt
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are queued in this process; the client should retry shortly"""
+
+
+class PasswordHasher:
+    """
+    Bcrypt hashing on a small dedicated executor
+
+    Each hash costs 2**BCRYPT_LOG_ROUNDS rounds of CPU. Running them on the
+    request threads lets a burst of logins occupy every gunicorn thread;
+    here at most PASSWORD_HASH_WORKERS hashes run at once per process, at
+    most PASSWORD_HASH_MAX_PENDING more wait, and anything beyond that is
+    rejected with HashingBusy instead of queueing behind catalog requests.
+    bcrypt releases the GIL, so the other request threads keep running.
+
+    The calling request thread still waits for its result, i.e. for its
+    place in the queue plus the hash itself: the executor bounds the CPU
+    spent on bcrypt, not the request threads tied up by logins. So a hash
+    that would not finish within PASSWORD_HASH_TIMEOUT, going by the
+    measured time per hash, is rejected before it is queued rather than
+    after the wait, and a request that times out withdraws its queued hash.
+    """
+
+    def __init__(self, app=None):
+        self.bcrypt = Bcrypt()
+        self.rounds = 12
+        self.workers = 2
+        self.max_pending = 16
+        self.timeout = 10.0
+        self._executor = None
+        self._pid = None
+        self._queued = 0  # submitted and not finished (running or waiting)
+        self._seconds = 0.0  # moving average time per hash
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.bcrypt.init_app(app)
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 16)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10.0)
+        self._pid = None  # start an executor with these settings on next use
+        self._seconds = 0.0  # and measure hashes at this cost afresh
+        app.extensions['password_hasher'] = self
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads do not survive fork(): one executor per gunicorn worker
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+                self._queued = 0
+                self._pid = os.getpid()
+            if self._queued >= self.workers + self.max_pending:
+                raise HashingBusy('Password hashing queue is full')
+            # Hashes ahead of this one run `workers` at a time; an idle queue always takes one
+            expected = (self._queued // self.workers + 1) * self._seconds
+            if self._queued and expected > self.timeout:
+                raise HashingBusy(f'Password hashing queue is {expected:.1f}s long')
+            self._queued += 1
+            executor = self._executor
+        try:
+            future = executor.submit(self._timed, fn, *args)
+        except BaseException:
+            self._finished(executor)
+            raise
+        future.add_done_callback(lambda _: self._finished(executor))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()  # still queued: do not spend the CPU on a response nobody waits for
+            raise HashingBusy(f'Password hashing took longer than {self.timeout}s')
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._seconds = elapsed if not self._seconds else 0.8 * self._seconds + 0.2 * elapsed
+
+    def _finished(self, executor):
+        with self._lock:
+            if executor is self._executor:  # not counted again by a newer executor
+                self._queued -= 1
+
+    def hash(self, password, rounds=None):
+        """bcrypt hash (str) of a password at the configured cost"""
+        return self._submit(self._hash, password, rounds or self.rounds)
+
+    def verify(self, password_hash, password):
+        """True if the password matches the stored hash"""
+        return self._submit(self.bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost than configured (e.g. '$2b$10$...')"""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def _hash(self, password, rounds):
+        return self.bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+    def benchmark(self, rounds, count, concurrency=1):
+        """Hash count passwords at this cost; returns (hashes per second, ms per hash)"""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda i: self._hash(f'benchmark-{i}', rounds), range(count)))
+        elapsed = time.perf_counter() - started
+        return count / elapsed, elapsed / count * 1000 * concurrency
+
+
+password_hasher = PasswordHasher()
@@ -1,11 +1,143 @@
+import random
+import time
+import uuid
+from threading import Lock
+
 import stripe
+from stripe import http_client
 from flask import current_app
 
+
+class PaymentUnavailable(Exception):
+    """Stripe was not called (circuit open) or the retry budget ran out"""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the payment provider is unhealthy
+    
+    After failure_threshold consecutive transient failures the circuit opens
+    and calls are rejected without touching the network. After reset_timeout
+    seconds one trial call is let through; success closes the circuit again.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+    
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+    
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+    
+    def end_trial(self):
+        """Let the next trial through even if this call recorded no outcome (e.g. it was interrupted)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+breaker = CircuitBreaker()
+
+
+def init_app(app):
+    """Configure the Stripe client: API base, connect/read timeouts and the circuit breaker"""
+    stripe.api_key = app.config.get('STRIPE_SECRET_KEY')
+    stripe.api_base = app.config.get('STRIPE_API_BASE', 'https://api.stripe.com')
+    stripe.max_network_retries = 0  # Retries go through _call, which shares one budget
+    stripe.default_http_client = http_client.RequestsClient(
+        timeout=(app.config.get('PAYMENT_CONNECT_TIMEOUT', 3), app.config.get('PAYMENT_READ_TIMEOUT', 10))
+    )
+    breaker.failure_threshold = app.config.get('PAYMENT_BREAKER_THRESHOLD', 5)
+    breaker.reset_timeout = app.config.get('PAYMENT_BREAKER_RESET', 30)
+    app.extensions['payments'] = breaker
+
 def init_stripe():
     """Initialize Stripe with secret key"""
     stripe.api_key = current_app.config['STRIPE_SECRET_KEY']
 
-def create_payment_intent(amount, currency='usd', metadata=None):
+def _is_transient(error):
+    """Network failures, timeouts, rate limits and 5xx are worth retrying; declines are not"""
+    if isinstance(error, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(error, stripe.error.APIError) and (error.http_status or 500) >= 500
+
+def _call(operation, *args, idempotency_key=None, **params):
+    """
+    Run a Stripe API call within the retry budget
+    
+    Up to PAYMENT_MAX_RETRIES retries with full-jitter exponential backoff,
+    never starting an attempt that could run past PAYMENT_DEADLINE seconds.
+    Writes always carry an idempotency key, so a retry can never create a
+    second object.
+    
+    Raises:
+        PaymentUnavailable: circuit open or budget exhausted
+        stripe.error.StripeError: non-transient errors (e.g. card declined)
+    """
+    config = current_app.config
+    attempts = config.get('PAYMENT_MAX_RETRIES', 2) + 1
+    backoff = config.get('PAYMENT_RETRY_BACKOFF', 0.25)
+    deadline = time.monotonic() + config.get('PAYMENT_DEADLINE', 15)
+    read_timeout = config.get('PAYMENT_READ_TIMEOUT', 10)
+    if idempotency_key:
+        params['idempotency_key'] = idempotency_key
+    
+    for attempt in range(1, attempts + 1):
+        if not breaker.allow():
+            raise PaymentUnavailable('Payment provider unavailable (circuit open)')
+        try:
+            result = operation(*args, **params)
+        except stripe.error.StripeError as e:
+            if not _is_transient(e):
+                breaker.record_success()  # Stripe answered; the request itself was bad
+                raise
+            breaker.record_failure()
+            delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+            if attempt == attempts or time.monotonic() + delay + read_timeout > deadline:
+                raise PaymentUnavailable(f'Payment provider failed after {attempt} attempt(s): {e}') from e
+            time.sleep(delay)
+            continue
+        except Exception:
+            # Not a Stripe answer (e.g. a bug or an unwrapped network error): counts against the provider
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            breaker.end_trial()
+
+def create_payment_intent(amount, currency='usd', metadata=None, idempotency_key=None):
     """
     Create a Stripe payment intent
     
@@ -13,6 +145,7 @@ def create_payment_intent(amount, currency='usd', metadata=None):
         amount: Amount in cents (e.g., 1000 = $10.00)
         currency: Currency code (default: 'usd')
         metadata: Additional data to attach to payment
+        idempotency_key: Key derived from the order; repeating it returns the same intent
     
     Returns:
         Payment intent object or None if error
@@ -20,8 +153,10 @@ def create_payment_intent(amount, currency='usd', metadata=None):
     try:
         init_stripe()
         
-        intent = stripe.PaymentIntent.create(
-            amount=int(amount * 100),  # Convert to cents
+        intent = _call(
+            stripe.PaymentIntent.create,
+            idempotency_key=idempotency_key or f'payment-intent-{uuid.uuid4().hex}',
+            amount=int(round(amount * 100)),  # Convert to cents
             currency=currency,
             metadata=metadata or {},
             automatic_payment_methods={
@@ -30,7 +165,7 @@ def create_payment_intent(amount, currency='usd', metadata=None):
         )
         
         return intent
-    except stripe.error.StripeError as e:
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
         print(f"Stripe error: {e}")
         return None
 
@@ -47,13 +182,13 @@ def confirm_payment(payment_intent_id):
     try:
         init_stripe()
         
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        intent = _call(stripe.PaymentIntent.retrieve, payment_intent_id)
         
         if intent.status == 'succeeded':
             return True
         
         return False
-    except stripe.error.StripeError as e:
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
         print(f"Stripe error: {e}")
         return False
 
@@ -73,7 +208,9 @@ def create_checkout_session(line_items, success_url, cancel_url, metadata=None):
     try:
         init_stripe()
         
-        session = stripe.checkout.Session.create(
+        session = _call(
+            stripe.checkout.Session.create,
+            idempotency_key=f'checkout-session-{uuid.uuid4().hex}',
             payment_method_types=['card'],
             line_items=line_items,
             mode='payment',
@@ -83,32 +220,60 @@ def create_checkout_session(line_items, success_url, cancel_url, metadata=None):
         )
         
         return session
-    except stripe.error.StripeError as e:
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
         print(f"Stripe error: {e}")
         return None
 
-def refund_payment(payment_intent_id, amount=None):
+def refund_payment(payment_intent_id, amount=None, reference=None):
     """
     Refund a payment
     
     Args:
         payment_intent_id: Stripe payment intent ID
-        amount: Amount to refund in cents (None = full refund)
+        amount: Amount to refund in dollars (None = full refund)
+        reference: Caller's id for this refund (e.g. a return number), required
+            for partial refunds. It is part of the idempotency key, so retrying
+            the same refund never refunds twice while a second refund of the
+            same amount still goes through. A full refund defaults to one per intent.
     
     Returns:
         Refund object or None if error
     """
+    if amount and not reference:
+        raise ValueError('Partial refunds need a reference')
     try:
         init_stripe()
         
         refund_params = {'payment_intent': payment_intent_id}
         if amount:
-            refund_params['amount'] = int(amount * 100)
+            refund_params['amount'] = int(round(amount * 100))
         
-        refund = stripe.Refund.create(**refund_params)
+        refund = _call(
+            stripe.Refund.create,
+            idempotency_key=f'refund-{payment_intent_id}-{reference or "full"}',
+            **refund_params
+        )
         
         return refund
-    except stripe.error.StripeError as e:
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
+        print(f"Stripe error: {e}")
+        return None
+
+def retrieve_payment_intent(payment_intent_id):
+    """
+    Fetch a payment intent
+    
+    Args:
+        payment_intent_id: Stripe payment intent ID
+    
+    Returns:
+        Payment intent object or None if error
+    """
+    try:
+        init_stripe()
+        
+        return _call(stripe.PaymentIntent.retrieve, payment_intent_id)
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
         print(f"Stripe error: {e}")
         return None
 
@@ -122,11 +287,28 @@ def get_payment_status(payment_intent_id):
     Returns:
         Status string or None if error
     """
+    intent = retrieve_payment_intent(payment_intent_id)
+    return intent.status if intent is not None else None
+
+def cancel_payment_intent(payment_intent_id):
+    """
+    Cancel a payment intent that was never paid
+    
+    Args:
+        payment_intent_id: Stripe payment intent ID
+    
+    Returns:
+        True if cancelled (or already cancelled), False otherwise
+    """
     try:
         init_stripe()
         
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-        return intent.status
-    except stripe.error.StripeError as e:
+        intent = _call(
+            stripe.PaymentIntent.cancel,
+            payment_intent_id,
+            idempotency_key=f'cancel-{payment_intent_id}'
+        )
+        return intent.status == 'canceled'
+    except (stripe.error.StripeError, PaymentUnavailable) as e:
         print(f"Stripe error: {e}")
-        return None
+        return False
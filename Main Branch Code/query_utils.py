@@ -0,0 +1,260 @@
+import base64
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, User, Product, Order, OrderItem
+
+# Sort options for the product listing: name -> (column, descending)
+PRODUCT_SORTS = {
+    'newest': (Product.created_at, True),
+    'oldest': (Product.created_at, False),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'rating': (Product.rating, True),
+}
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(value, row_id):
+    """Encode the keyset position (sort value, id) as an opaque URL-safe token"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor, column):
+    """
+    Decode a cursor produced by encode_cursor for the given sort column
+
+    The cursor is client input: anything but a scalar of the column's type
+    and an integer id raises InvalidCursor rather than reaching the query.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, json.JSONDecodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {e}')
+
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise InvalidCursor('Invalid cursor: id must be an integer')
+    python_type = column.type.python_type
+    if python_type is datetime:
+        try:
+            value = datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise InvalidCursor('Invalid cursor: expected an ISO timestamp')
+    elif python_type in (int, float):
+        if not _is_number(value):
+            raise InvalidCursor('Invalid cursor: expected a number')
+    elif not isinstance(value, python_type):
+        raise InvalidCursor(f'Invalid cursor: expected {python_type.__name__}')
+    return value, row_id
+
+
+def paginate_products(limit=DEFAULT_PAGE_SIZE, cursor=None, category=None, sort='newest'):
+    """
+    Fetch one page of products using keyset pagination
+
+    Rows are ordered by (sort column, id) so the cursor always points at a
+    unique position and each page is a single indexed range scan, no matter
+    how deep into the catalog the client has scrolled.
+
+    Args:
+        limit: Page size (clamped to MAX_PAGE_SIZE)
+        cursor: Token returned as next_cursor by the previous page
+        category: Optional category filter
+        sort: One of PRODUCT_SORTS
+
+    Returns:
+        Tuple of (products, next_cursor); next_cursor is None on the last page
+    """
+    column, descending = PRODUCT_SORTS[sort]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    query = Product.query
+    if category:
+        query = query.filter(Product.category == category)
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, column)
+        if descending:
+            query = query.filter((column < value) | ((column == value) & (Product.id < row_id)))
+        else:
+            query = query.filter((column > value) | ((column == value) & (Product.id > row_id)))
+
+    if descending:
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column.asc(), Product.id.asc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+
+    return rows, next_cursor
+
+
+# ==================== ORDER QUERIES ====================
+
+def order_query(with_items=True, with_user=False):
+    """
+    Base Order query with relationship loading strategies applied
+
+    Items (and their products) are fetched with one extra SELECT ... IN per
+    result set instead of one query per order and per item; the owning user
+    is a many-to-one, so it is joined into the main query.
+    """
+    options = []
+    if with_items:
+        options.append(selectinload(Order.items).joinedload(OrderItem.product))
+    if with_user:
+        options.append(joinedload(Order.user))
+    return Order.query.options(*options)
+
+
+def orders_for_user(user_id):
+    """All orders of a user, newest first, with items and products loaded"""
+    return order_query().filter(Order.user_id == user_id).order_by(Order.created_at.desc()).all()
+
+
+def get_order_or_404(order_id):
+    """Single order with items and products loaded"""
+    return order_query().filter(Order.id == order_id).first_or_404()
+
+
+def recent_orders(limit=None, with_items=False):
+    """Orders across all users, newest first, with the owning user loaded"""
+    query = order_query(with_items=with_items, with_user=True).order_by(Order.created_at.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+# ==================== USER QUERIES ====================
+
+USER_SORTS = ('created_at', 'username', 'email', 'total_orders', 'total_spent', 'last_order_at')
+
+
+def registration_conflicts(email, username):
+    """
+    Which of email/username already belong to an account, in one query
+
+    Both columns have unique indexes, so this is at most two index probes.
+    The database still has the final word: a concurrent sign-up can take a
+    name between this check and the insert (see register()).
+
+    Returns:
+        Set containing 'email' and/or 'username'
+    """
+    rows = db.session.query(User.email, User.username) \
+        .filter(or_(User.email == email, User.username == username)).limit(2).all()
+    conflicts = set()
+    for row_email, row_username in rows:
+        if row_email == email:
+            conflicts.add('email')
+        if row_username == username:
+            conflicts.add('username')
+    return conflicts
+
+
+def user_summaries(search=None, sort='created_at', descending=True, page=1, per_page=50):
+    """
+    One page of users with their order aggregates
+
+    Order count, lifetime spend (completed payments only) and last order
+    date come from a single grouped subquery joined to users, so no order
+    rows are loaded into memory.
+
+    Returns:
+        Tuple of (rows, total); each row has the User and its aggregates
+    """
+    stats = db.session.query(
+        Order.user_id.label('user_id'),
+        func.count(Order.id).label('total_orders'),
+        func.sum(db.case((Order.payment_status == 'completed', Order.total_amount), else_=0)).label('total_spent'),
+        func.max(Order.created_at).label('last_order_at')
+    ).group_by(Order.user_id).subquery()
+
+    total_orders = func.coalesce(stats.c.total_orders, 0).label('total_orders')
+    total_spent = func.coalesce(stats.c.total_spent, 0).label('total_spent')
+    last_order_at = stats.c.last_order_at.label('last_order_at')
+
+    query = db.session.query(User, total_orders, total_spent, last_order_at) \
+        .outerjoin(stats, stats.c.user_id == User.id)
+    count_query = db.session.query(func.count(User.id))
+
+    if search:
+        # The term matches literally: escape LIKE wildcards (e.g. '_' in an email address)
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = f'%{escaped}%'
+        condition = or_(User.username.ilike(pattern, escape='\\'), User.email.ilike(pattern, escape='\\'))
+        query = query.filter(condition)
+        count_query = count_query.filter(condition)
+
+    sort_column = {
+        'created_at': User.created_at,
+        'username': User.username,
+        'email': User.email,
+        'total_orders': total_orders,
+        'total_spent': total_spent,
+        'last_order_at': last_order_at,
+    }[sort]
+    if descending:
+        query = query.order_by(sort_column.desc(), User.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), User.id.asc())
+
+    rows = query.limit(per_page).offset((page - 1) * per_page).all()
+    return rows, count_query.scalar()
+
+
+# ==================== QUERY COUNTING ====================
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Count the SQL statements executed inside the block
+
+    Usage:
+        with count_queries() as counter:
+            client.get('/api/orders')
+        assert counter.count <= 3
+    """
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
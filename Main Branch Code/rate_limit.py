@@ -0,0 +1,235 @@
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, g, jsonify, request
+from flask_login import current_user
+
+# Share of RATE_LIMIT_MAX_QUEUE_WAIT a request of each priority class may have
+# spent queued before it is shed with 503: admin pages and exports give way
+# first, then browsing, and checkout only once it has waited the full budget
+PRIORITIES = {
+    'checkout': 1.0,
+    'browse': 0.5,
+    'admin': 0.25,
+}
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+
+def parse_rate(rate):
+    """'10/minute' -> (tokens per second, burst size)"""
+    count, _, period = rate.partition('/')
+    return int(count) / PERIODS[period], int(count)
+
+
+def parse_request_start(value):
+    """
+    Epoch seconds from an X-Request-Start header, or None
+
+    Accepts 't=<seconds>' as set by gunicorn_workers and nginx ($msec), and
+    bare milliseconds or microseconds as set by other proxies.
+    """
+    try:
+        started = float(value.strip().removeprefix('t='))
+    except (AttributeError, ValueError):
+        return None
+    while started > 1e11:  # ms or us since the epoch
+        started /= 1000
+    return started
+
+
+class MemoryRateLimitBackend:
+    """Token buckets in this process only (development, or one replica)"""
+
+    name = 'memory'
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Spend cost tokens; returns 0 if allowed, else seconds until enough have refilled"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by all replicas (requires the redis package)"""
+
+    name = 'redis'
+
+    # Refill and spend atomically on the server, so replicas never double-spend a bucket
+    SCRIPT = """
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, rate, burst, cost=1):
+        return float(self._take(keys=[f'{self.prefix}rl:{key}'], args=[rate, burst, time.time(), cost]))
+
+
+class RateLimiter:
+    """
+    Per-route request budgets and priority-based load shedding
+
+    Every request is charged to a token bucket for its route's policy,
+    keyed by user id when signed in and by client IP otherwise; an empty
+    bucket answers 429 with Retry-After.
+
+    Overload is measured as queue wait: how long the request sat accepted
+    but unserved, from the X-Request-Start stamp gunicorn_workers puts on
+    every request. In-flight counts cannot show it, as a worker never runs
+    more requests than it has threads. Once a request has waited past its
+    priority class's share of RATE_LIMIT_MAX_QUEUE_WAIT it gets an
+    immediate 503, with Retry-After growing with the wait. Answering
+    without touching the database drains the backlog, so admin pages and
+    exports give way first, then browsing, and checkout last.
+
+    Every route declares its policy and class with @rate_limiter.limit(...).
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = True
+        self.policies = {}
+        self.max_queue_wait = 1.0
+        self.queue_header = 'X-Request-Start'
+        self.trusted_proxies = 0
+        self._inflight = 0
+        self._lock = Lock()
+        self._stats = {'allowed': 0, 'limited': 0, 'shed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.policies = {name: parse_rate(rate) for name, rate in app.config.get('RATE_LIMITS', {}).items()}
+        self.max_queue_wait = app.config.get('RATE_LIMIT_MAX_QUEUE_WAIT', 1.0)
+        self.queue_header = app.config.get('RATE_LIMIT_QUEUE_HEADER', 'X-Request-Start')
+        self.trusted_proxies = app.config.get('RATE_LIMIT_TRUSTED_PROXIES', 0)
+        backend = app.config.get('RATE_LIMIT_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryRateLimitBackend(app.config.get('RATE_LIMIT_MAX_KEYS', 10000))
+        elif backend == 'redis':
+            self.backend = RedisRateLimitBackend(app.config['RATE_LIMIT_REDIS_URL'],
+                                                 app.config.get('CACHE_KEY_PREFIX', 'shopeasy:'))
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+        app.extensions['rate_limiter'] = self
+
+        if self.enabled:
+            app.before_request(self.check)
+            app.teardown_request(self.release)
+
+    def limit(self, policy='default', priority='browse'):
+        """Route decorator: charge requests to policy's budget and shed them as priority"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        def decorator(f):
+            f.rate_limit_policy = policy
+            f.rate_limit_priority = priority
+            return f
+        return decorator
+
+    def queue_wait(self):
+        """Seconds this request waited before a thread picked it up (None if it was not stamped)"""
+        started = parse_request_start(request.headers.get(self.queue_header))
+        if started is None:
+            return None
+        return max(0.0, time.time() - started)
+
+    def exempt(self, priority='checkout'):
+        """Route decorator: no request budget (e.g. provider webhooks), only load shedding"""
+        return self.limit(None, priority)
+
+    def client_ip(self):
+        """Caller's address; with RATE_LIMIT_TRUSTED_PROXIES set, read it from X-Forwarded-For"""
+        if self.trusted_proxies:
+            forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies]
+        return request.remote_addr or 'unknown'
+
+    def check(self):
+        if not self.enabled or request.endpoint in (None, 'static'):
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        policy = getattr(view, 'rate_limit_policy', 'default')
+        priority = getattr(view, 'rate_limit_priority', 'browse')
+
+        with self._lock:
+            self._inflight += 1
+        g.rate_limit_counted = True
+
+        waited = self.queue_wait()
+        if waited is not None and waited > self.max_queue_wait * PRIORITIES[priority]:
+            self._count('shed')
+            retry_after = max(1, math.ceil(2 * waited))
+            return self._reject(503, 'Server is busy, please retry shortly', retry_after)
+
+        if policy is not None and policy in self.policies:
+            rate, burst = self.policies[policy]
+            subject = f'user:{current_user.id}' if current_user.is_authenticated else f'ip:{self.client_ip()}'
+            wait = self.backend.take(f'{policy}:{subject}', rate, burst)
+            if wait > 0:
+                self._count('limited')
+                return self._reject(429, 'Too many requests, please slow down', max(1, math.ceil(wait)))
+
+        self._count('allowed')
+        return None
+
+    def release(self, exc=None):
+        if g.pop('rate_limit_counted', False):
+            with self._lock:
+                self._inflight -= 1
+
+    def _reject(self, status, message, retry_after):
+        response = jsonify({'success': False, 'message': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'inflight': self._inflight, 'max_queue_wait': self.max_queue_wait,
+                    'backend': self.backend.name}
+
+
+rate_limiter = RateLimiter()
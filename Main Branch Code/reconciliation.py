@@ -0,0 +1,228 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import update
+
+from models import db, Order
+from order_settlement import complete_orders, fail_orders
+from payment_utils import breaker, get_payment_status, refund_payment, PaymentUnavailable
+
+REPORT_FIELDS = ['order_id', 'order_number', 'payment_id', 'order_status', 'payment_status',
+                 'stripe_status', 'action', 'detail']
+
+
+class Checkpoint:
+    """
+    Progress of a reconciliation run in a small JSON file, replaced atomically after each chunk
+
+    Orders whose status could not be fetched, or whose refund failed, are
+    kept in `retry` (order id -> action counted for it) until a later
+    attempt handles them; the scan position moves on regardless.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_id = 0
+        self.counts = {}
+        self.retry = {}
+        self.started_at = datetime.utcnow().isoformat()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.last_id = state['last_id']
+            self.counts = state['counts']
+            self.retry = {int(order_id): action for order_id, action in state.get('retry', {}).items()}
+            self.started_at = state['started_at']
+
+    @property
+    def resumed(self):
+        return self.last_id > 0
+
+    def save(self, last_id, rows):
+        self.last_id = last_id
+        for row in rows:
+            # A retried order replaces the outcome counted for it last time
+            self._uncount(self.retry.pop(row['order_id'], None))
+            self.counts[row['action']] = self.counts.get(row['action'], 0) + 1
+            if row['action'] == 'error' or row.get('retry'):
+                self.retry[row['order_id']] = row['action']
+        self._write()
+
+    def forget(self, order_ids):
+        """Stop retrying orders that no longer qualify (e.g. deleted)"""
+        for order_id in order_ids:
+            self._uncount(self.retry.pop(order_id, None))
+        self._write()
+
+    def _uncount(self, action):
+        if action is not None:
+            self.counts[action] -= 1
+            if not self.counts[action]:
+                del self.counts[action]
+
+    def _write(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'last_id': self.last_id, 'counts': self.counts, 'retry': self.retry,
+                       'started_at': self.started_at}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def classify(order, stripe_status):
+    """
+    What to do about one order given its intent status at Stripe
+
+    Returns:
+        (action, detail); action is one of ok, complete, fail, refund,
+        awaiting, mismatch, error
+    """
+    local = order.payment_status
+    if stripe_status is None:
+        return 'error', 'status unavailable'
+    if stripe_status == 'succeeded':
+        if order.status == 'cancelled' and local in ('completed', 'failed'):
+            return 'refund', 'paid but cancelled'
+        if local == 'pending':
+            return 'complete', 'paid but still pending locally'
+        if local in ('completed', 'refunded', 'partially_refunded'):
+            return 'ok', ''
+        return 'mismatch', f'paid at Stripe but {local} locally'
+    if stripe_status == 'canceled':
+        if local == 'pending':
+            return 'fail', 'intent cancelled at Stripe'
+        if local == 'failed':
+            return 'ok', ''
+        return 'mismatch', f'intent cancelled at Stripe but {local} locally'
+    if local == 'pending':
+        return 'awaiting', stripe_status
+    return 'mismatch', f'intent {stripe_status} at Stripe but {local} locally'
+
+
+def reconcile_payments(checkpoint, report_path, chunk_size=200, workers=8, refund=True, progress=print):
+    """
+    Compare every Stripe-paid order with its payment intent and fix drift
+
+    Orders are scanned by id in chunks (keyset, so each chunk is one cheap
+    query). Intent statuses of a chunk are fetched concurrently on at most
+    `workers` connections; the shared circuit breaker stops the run if
+    Stripe is unavailable, and the checkpoint only moves past a chunk
+    once it has been fully handled, so a rerun resumes where this one
+    stopped. Orders whose status fetch or refund failed are recorded in
+    the checkpoint and tried again after the scan (and by the next run
+    while any remain). Refunds are full refunds keyed per intent, so an
+    order handled twice is never refunded twice.
+
+    Pending orders that were paid or cancelled at Stripe are settled,
+    cancelled orders that were paid are refunded (with refund=True) and
+    everything else that disagrees is reported.
+
+    Returns:
+        {action: count} for the whole run, including resumed progress
+    """
+    app = current_app._get_current_object()
+
+    def fetch(payment_id):
+        with app.app_context():
+            return get_payment_status(payment_id)
+
+    def issue_refund(payment_id):
+        with app.app_context():
+            return refund_payment(payment_id)
+
+    stripe_paid = Order.payment_id.like('pi\\_%', escape='\\')
+    new_report = not os.path.exists(report_path) or not checkpoint.resumed
+    with open(report_path, 'w' if new_report else 'a', newline='') as f, ThreadPoolExecutor(workers) as pool:
+        report = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+        if new_report:
+            report.writeheader()
+
+        def handle(orders, last_id):
+            statuses = list(pool.map(fetch, [order.payment_id for order in orders]))
+            if breaker.state == 'open':
+                raise PaymentUnavailable(f'Stripe unavailable; resume from order id {checkpoint.last_id}')
+
+            rows = []
+            for order, stripe_status in zip(orders, statuses):
+                action, detail = classify(order, stripe_status)
+                rows.append({
+                    'order_id': order.id,
+                    'order_number': order.order_number,
+                    'payment_id': order.payment_id,
+                    'order_status': order.status,
+                    'payment_status': order.payment_status,
+                    'stripe_status': stripe_status,
+                    'action': action,
+                    'detail': detail,
+                })
+            _apply(rows, pool, issue_refund, refund)
+
+            report.writerows(rows)
+            f.flush()
+            checkpoint.save(last_id, rows)
+
+        while True:
+            orders = Order.query.filter(Order.id > checkpoint.last_id, stripe_paid) \
+                .order_by(Order.id).limit(chunk_size).all()
+            if not orders:
+                break
+            handle(orders, orders[-1].id)
+            progress(f"Reconciled up to order id {checkpoint.last_id}: {checkpoint.counts}")
+
+        # One more attempt for every order that errored, in this run or an earlier one
+        pending = sorted(checkpoint.retry)
+        for start in range(0, len(pending), chunk_size):
+            ids = pending[start:start + chunk_size]
+            orders = Order.query.filter(Order.id.in_(ids), stripe_paid).order_by(Order.id).all()
+            checkpoint.forget(set(ids) - {order.id for order in orders})
+            if orders:
+                handle(orders, checkpoint.last_id)
+            progress(f"Retried {len(ids)} order(s); {len(checkpoint.retry)} still failing")
+
+    return checkpoint.counts
+
+
+def _apply(rows, pool, issue_refund, refund):
+    """Settle, fail and refund the orders of one chunk in bulk; records the outcome on each row"""
+    by_action = {}
+    for row in rows:
+        by_action.setdefault(row['action'], []).append(row)
+
+    if 'complete' in by_action:
+        settled = complete_orders({row['order_id']: row['payment_id'] for row in by_action['complete']})
+        _mark(by_action['complete'], settled, 'completed', 'settled elsewhere first')
+    if 'fail' in by_action:
+        settled = fail_orders([row['order_id'] for row in by_action['fail']])
+        _mark(by_action['fail'], settled, 'cancelled, stock released', 'settled elsewhere first')
+
+    if 'refund' in by_action:
+        candidates = by_action['refund']
+        if not refund:
+            for row in candidates:
+                row['detail'] += '; refund skipped (--no-refunds)'
+            return
+        refunds = list(pool.map(issue_refund, [row['payment_id'] for row in candidates]))
+        refunded = [row['order_id'] for row, result in zip(candidates, refunds) if result is not None]
+        if refunded:
+            db.session.execute(
+                update(Order).where(Order.id.in_(refunded)).values(payment_status='refunded'),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+        _mark(candidates, set(refunded), 'refunded', 'refund failed')
+        for row in candidates:
+            row['retry'] = row['order_id'] not in refunded
+
+
+def _mark(rows, done, success, failure):
+    for row in rows:
+        row['detail'] += f"; {success if row['order_id'] in done else failure}"
@@ -0,0 +1,307 @@
+import math
+import re
+import sqlite3
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import RLock
+
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from cache_utils import cache
+from models import db, Product
+
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+# Relative weight of a match in each indexed field
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'category': 2.0,
+    'features': 1.5,
+    'description': 1.0,
+}
+
+# A prefix-only match scores lower than a whole-word match
+PREFIX_PENALTY = 0.7
+
+
+def tokenize(value):
+    """Lowercase and split text into word tokens"""
+    if not value:
+        return []
+    return TOKEN_RE.findall(value.lower())
+
+
+def product_fields(product):
+    """Extract the searchable text fields of a product"""
+    return {
+        'name': product.name or '',
+        'description': product.description or '',
+        'category': product.category or '',
+        'features': ' '.join(product.features or []),
+    }
+
+
+class InMemorySearchIndex:
+    """
+    Inverted index held in process memory
+
+    Postings map token -> {product_id: weighted term frequency}. A sorted
+    vocabulary list allows prefix expansion with a binary search.
+
+    The index is rebuilt only when the 'search' cache generation moves,
+    i.e. after a product was added, edited or deleted (in any process when
+    the cache backend is shared); stock changes never touch it.
+    """
+
+    name = 'memory'
+    transactional = False  # not rolled back with the session: apply writes only after they commit
+
+    def __init__(self):
+        self._lock = RLock()
+        self._postings = defaultdict(dict)
+        self._doc_tokens = {}
+        self._categories = {}
+        self._vocabulary = []
+        self.generation = None
+
+    def ensure(self):
+        generation = cache.generation('search')
+        if generation != self.generation:
+            self.rebuild(Product.query.all())
+            self.generation = generation
+
+    def rebuild(self, products):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._doc_tokens = {}
+            self._categories = {}
+            self._vocabulary = []
+            for product in products:
+                self._add(product.id, product_fields(product))
+
+    def _add(self, product_id, fields):
+        self._categories[product_id] = fields['category']
+        weights = defaultdict(float)
+        for field, value in fields.items():
+            for token in tokenize(value):
+                weights[token] += FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                insort(self._vocabulary, token)
+            postings[product_id] = weight
+        self._doc_tokens[product_id] = set(weights)
+
+    def _remove(self, product_id):
+        self._categories.pop(product_id, None)
+        for token in self._doc_tokens.pop(product_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect_left(self._vocabulary, token)
+                if i < len(self._vocabulary) and self._vocabulary[i] == token:
+                    self._vocabulary.pop(i)
+
+    def index_product(self, product):
+        self.apply([(product.id, product_fields(product))])
+
+    def remove_product(self, product_id):
+        self.apply([(product_id, None)])
+
+    def apply(self, changes):
+        """Apply (product_id, fields) pairs; fields None removes the product"""
+        with self._lock:
+            for product_id, fields in changes:
+                self._remove(product_id)
+                if fields is not None:
+                    self._add(product_id, fields)
+
+    def _expand(self, term):
+        """Return vocabulary tokens starting with term"""
+        i = bisect_left(self._vocabulary, term)
+        matches = []
+        while i < len(self._vocabulary) and self._vocabulary[i].startswith(term):
+            matches.append(self._vocabulary[i])
+            i += 1
+        return matches
+
+    def search(self, query, limit, category=None):
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            total_docs = max(len(self._doc_tokens), 1)
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for token in self._expand(term):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total_docs / len(postings))
+                    factor = 1.0 if token == term else PREFIX_PENALTY
+                    for product_id, weight in postings.items():
+                        if category is not None and self._categories.get(product_id) != category:
+                            continue
+                        score = weight * idf * factor
+                        if score > term_scores.get(product_id, 0):
+                            term_scores[product_id] = score
+
+                # Every query term must match (AND semantics)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in term_scores.items() if pid in scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+
+class SQLiteFTSIndex:
+    """Search index stored in an SQLite FTS5 virtual table alongside the catalog"""
+
+    name = 'sqlite_fts5'
+    table = 'products_fts'
+    transactional = True  # written in the session's transaction, so it commits or rolls back with it
+
+    def __init__(self):
+        self._ready = False
+
+    def ensure(self):
+        if self._ready:
+            return
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            "name, description, category, features, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+        indexed = db.session.execute(text(f'SELECT count(*) FROM {self.table}')).scalar()
+        if not indexed and Product.query.count():
+            self.rebuild(Product.query.all())
+        db.session.commit()
+        self._ready = True
+
+    def rebuild(self, products):
+        db.session.execute(text(f'DELETE FROM {self.table}'))
+        for product in products:
+            self._insert(product)
+
+    def _insert(self, product):
+        db.session.execute(
+            text(f'INSERT INTO {self.table} (rowid, name, description, category, features) '
+                 'VALUES (:id, :name, :description, :category, :features)'),
+            {'id': product.id, **product_fields(product)}
+        )
+
+    def index_product(self, product):
+        self.remove_product(product.id)
+        self._insert(product)
+
+    def remove_product(self, product_id):
+        db.session.execute(text(f'DELETE FROM {self.table} WHERE rowid = :id'), {'id': product_id})
+
+    def search(self, query, limit, category=None):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Tokens are alphanumeric only, so quoting them is enough to keep
+        # user input out of the FTS query syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(FIELD_WEIGHTS[f]) for f in ('name', 'description', 'category', 'features'))
+        where = f'{self.table} MATCH :match'
+        params = {'match': match, 'limit': limit}
+        if category is not None:
+            # Filter inside the query so LIMIT counts only products in the category
+            where += ' AND category = :category'
+            params['category'] = category
+        rows = db.session.execute(
+            text(f'SELECT rowid FROM {self.table} WHERE {where} '
+                 f'ORDER BY bm25({self.table}, {weights}), rowid LIMIT :limit'),
+            params
+        )
+        return [row[0] for row in rows]
+
+
+class ProductSearch:
+    """Chooses a search backend for the configured database and keeps it up to date"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = None  # chosen for this app's database on first use
+        app.extensions['product_search'] = self
+
+    def _backend(self):
+        if self.backend is None:
+            backend = None
+            if db.engine.dialect.name == 'sqlite' and self._fts5_available():
+                backend = SQLiteFTSIndex()
+                try:
+                    backend.ensure()
+                except OperationalError as e:
+                    db.session.rollback()
+                    print(f"FTS5 search index unavailable, using in-memory index: {e}")
+                    backend = None
+            self.backend = backend or InMemorySearchIndex()
+        self.backend.ensure()
+        return self.backend
+
+    @staticmethod
+    def _fts5_available():
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+            return True
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            conn.close()
+
+    def search(self, query, limit=20, category=None):
+        """Return product IDs matching query (optionally only in category), best match first"""
+        return self._backend().search(query, limit, category)
+
+    def index_product(self, product):
+        """Add or refresh a product in the index (call before committing, then invalidate() after)"""
+        backend = self._backend()
+        if backend.transactional:
+            backend.index_product(product)
+        else:
+            g.setdefault('search_changes', []).append((product.id, product_fields(product)))
+
+    def remove_product(self, product_id):
+        """Drop a product from the index (call before committing, then invalidate() after)"""
+        backend = self._backend()
+        if backend.transactional:
+            backend.remove_product(product_id)
+        else:
+            g.setdefault('search_changes', []).append((product_id, None))
+
+    def invalidate(self):
+        """
+        After committing a catalog write: other processes rebuild their in-memory index
+
+        This process applies the changes recorded by index_product and
+        remove_product to its in-memory index now that they are committed
+        (a rolled-back write never reaches it). If another process wrote
+        in between, the generation skips ahead and the index is rebuilt.
+        """
+        backend = self._backend()
+        changes = g.pop('search_changes', [])
+        generation = cache.invalidate('search')
+        if isinstance(backend, InMemorySearchIndex) and generation == backend.generation + 1:
+            backend.apply(changes)
+            backend.generation = generation
+
+
+product_search = ProductSearch()
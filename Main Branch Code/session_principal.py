@@ -0,0 +1,111 @@
+from threading import Lock
+
+from sqlalchemy import event
+
+from cache_utils import LRUCacheBackend
+from models import db, User
+
+
+class Principal:
+    """
+    Read-only snapshot of the signed-in user, used as Flask-Login's current_user
+
+    Holds only what nearly every request needs. Any other attribute (orders,
+    created_at, check_password, ...) loads the full ORM User on first use,
+    once per request through the session's identity map.
+    """
+
+    __slots__ = ('id', 'email', 'username', 'is_admin')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, email, username, is_admin):
+        for name, value in zip(self.__slots__, (id, email, username, bool(is_admin))):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Principal is read-only; change the User row instead')
+
+    def get_id(self):
+        return str(self.id)
+
+    def load_user(self):
+        """The full ORM User behind this principal"""
+        return db.session.get(User, self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load_user(), name)
+
+    def __eq__(self, other):
+        get_id = getattr(other, 'get_id', None)
+        return get_id is not None and self.get_id() == get_id()
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<Principal {self.email}>'
+
+
+class PrincipalCache:
+    """
+    Per-process LRU+TTL of session principals keyed by user id
+
+    A hit means an authenticated request needs no users query. Changes made
+    through the ORM in this process drop the entry at once; other processes
+    and pods see them within SESSION_PRINCIPAL_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.backend = LRUCacheBackend(1024)
+        self.ttl = 30
+        self._stats_lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = LRUCacheBackend(app.config.get('SESSION_PRINCIPAL_CACHE_SIZE', 1024))
+        self.ttl = app.config.get('SESSION_PRINCIPAL_TTL', 30)
+        app.extensions['principals'] = self
+
+    def load(self, user_id):
+        """Principal for a session's user id, or None if the user no longer exists"""
+        principal = self.backend.get(user_id) if self.ttl else None
+        with self._stats_lock:
+            self._stats['hits' if principal is not None else 'misses'] += 1
+        if principal is not None:
+            return principal
+
+        row = db.session.query(User.id, User.email, User.username, User.is_admin) \
+            .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        if self.ttl:
+            self.backend.set(user_id, principal, self.ttl)
+        return principal
+
+    def discard(self, user_id):
+        self.backend.delete(user_id)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['entries'] = len(self.backend)
+        return stats
+
+
+principals = PrincipalCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _discard_principal(mapper, connection, target):
+    principals.discard(target.id)
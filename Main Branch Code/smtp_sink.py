@@ -0,0 +1,160 @@
+"""
+Local SMTP sink for development and load tests
+
+Accepts any sender, recipient and AUTH PLAIN credentials, keeps the messages
+in memory and never relays anything. Point the app at it with:
+
+    python smtp_sink.py --port 1025
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=False MAIL_USERNAME=dev MAIL_PASSWORD=dev
+"""
+import argparse
+import socket
+import socketserver
+import time
+from email import message_from_bytes
+from threading import Lock, Thread
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """One SMTP session: enough of RFC 5321 for smtplib and Flask-Mail"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        sink = self.server
+        sink.record_connection(self.connection)
+        try:
+            self.converse(sink)
+        except ConnectionError:
+            pass  # Client (or drop_connections) hung up mid-session
+        finally:
+            sink.forget_connection(self.connection)
+
+    def converse(self, sink):
+        if sink.latency:
+            time.sleep(sink.latency)  # Simulated TCP + TLS handshake cost
+        self.reply('220 localhost SMTP sink ready')
+        envelope = {'from': None, 'to': []}
+
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = line.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'AUTH':
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'MAIL':
+                envelope = {'from': line[10:].strip('<> '), 'to': []}
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                envelope['to'].append(line[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                sink.record_message(envelope, self.read_data())
+                envelope = {'from': None, 'to': []}
+                self.reply('250 OK: queued')
+            elif verb in ('RSET', 'NOOP'):
+                envelope = {'from': None, 'to': []}
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def read_data(self):
+        lines = []
+        for raw in self.rfile:
+            if raw in (b'.\r\n', b'.\n'):
+                break
+            lines.append(raw[1:] if raw.startswith(b'..') else raw)  # Undo dot-stuffing
+        return b''.join(lines)
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    In-memory SMTP server
+
+    Use start()/stop() from scripts, then inspect messages and connections
+    (the number of SMTP sessions opened) to check delivery and reuse.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=1025, latency=0.0, keep_messages=True):
+        super().__init__((host, port), SMTPSinkHandler)
+        self.latency = latency
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.message_count = 0
+        self.connections = 0
+        self._open = set()
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def record_connection(self, conn):
+        with self._lock:
+            self.connections += 1
+            self._open.add(conn)
+
+    def forget_connection(self, conn):
+        with self._lock:
+            self._open.discard(conn)
+
+    def drop_connections(self):
+        """Hang up on every open session, like a server timing out idle clients"""
+        with self._lock:
+            open_connections, self._open = self._open, set()
+        for conn in open_connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def record_message(self, envelope, data):
+        with self._lock:
+            self.message_count += 1
+            if self.keep_messages:
+                self.messages.append({
+                    'from': envelope['from'],
+                    'to': envelope['to'],
+                    'message': message_from_bytes(data),
+                })
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local SMTP sink')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to delay each new connection, to mimic a remote TLS server')
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, latency=args.latency, keep_messages=False)
+    print(f"SMTP sink listening on {args.host}:{sink.port}")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Received {sink.message_count} messages over {sink.connections} connections")
+        sink.server_close()
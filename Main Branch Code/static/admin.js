@@ -336,16 +336,58 @@ async function updateOrderStatus(orderId, newStatus) {
 
 // ==================== USERS MANAGEMENT ====================
 
+let usersState = {page: 1, perPage: 50, sort: 'created_at', order: 'desc', q: ''};
+let usersSearchTimer = null;
+
+document.getElementById('usersSearch')?.addEventListener('input', function(e) {
+    clearTimeout(usersSearchTimer);
+    usersSearchTimer = setTimeout(() => {
+        usersState.q = e.target.value.trim();
+        usersState.page = 1;
+        loadUsers();
+    }, 300);
+});
+
 async function loadUsers() {
     try {
-        const response = await fetch('/api/admin/users');
-        const users = await response.json();
-        renderUsersTable(users);
+        const params = new URLSearchParams({
+            page: usersState.page,
+            per_page: usersState.perPage,
+            sort: usersState.sort,
+            order: usersState.order
+        });
+        if (usersState.q) params.set('q', usersState.q);
+        
+        const response = await fetch(`/api/admin/users?${params}`);
+        const data = await response.json();
+        renderUsersTable(data.users);
+        renderUsersPager(data);
     } catch (error) {
         console.error('Failed to load users:', error);
     }
 }
 
+function sortUsers(column) {
+    if (usersState.sort === column) {
+        usersState.order = usersState.order === 'desc' ? 'asc' : 'desc';
+    } else {
+        usersState.sort = column;
+        usersState.order = 'desc';
+    }
+    usersState.page = 1;
+    loadUsers();
+}
+
+function goToUsersPage(page) {
+    usersState.page = page;
+    loadUsers();
+}
+
+function usersSortHeader(column, label) {
+    const arrow = usersState.sort === column ? (usersState.order === 'desc' ? ' ▼' : ' ▲') : '';
+    return `<th class="px-4 py-2 border text-left cursor-pointer select-none" onclick="sortUsers('${column}')">${label}${arrow}</th>`;
+}
+
 function renderUsersTable(users) {
     const table = document.getElementById('usersTable');
     
@@ -360,11 +402,13 @@ function renderUsersTable(users) {
                 <thead class="bg-gray-100">
                     <tr>
                         <th class="px-4 py-2 border text-left">ID</th>
-                        <th class="px-4 py-2 border text-left">Username</th>
-                        <th class="px-4 py-2 border text-left">Email</th>
+                        ${usersSortHeader('username', 'Username')}
+                        ${usersSortHeader('email', 'Email')}
                         <th class="px-4 py-2 border text-left">Role</th>
-                        <th class="px-4 py-2 border text-left">Orders</th>
-                        <th class="px-4 py-2 border text-left">Joined</th>
+                        ${usersSortHeader('total_orders', 'Orders')}
+                        ${usersSortHeader('total_spent', 'Spent')}
+                        ${usersSortHeader('last_order_at', 'Last Order')}
+                        ${usersSortHeader('created_at', 'Joined')}
                     </tr>
                 </thead>
                 <tbody>
@@ -379,6 +423,8 @@ function renderUsersTable(users) {
                                 </span>
                             </td>
                             <td class="px-4 py-2 border">${user.total_orders}</td>
+                            <td class="px-4 py-2 border">$${user.total_spent.toFixed(2)}</td>
+                            <td class="px-4 py-2 border">${user.last_order_at || '-'}</td>
                             <td class="px-4 py-2 border">${user.created_at}</td>
                         </tr>
                     `).join('')}
@@ -388,6 +434,20 @@ function renderUsersTable(users) {
     `;
 }
 
+function renderUsersPager(data) {
+    const pager = document.getElementById('usersPager');
+    if (!pager) return;
+    
+    const pages = Math.max(data.pages, 1);
+    pager.innerHTML = `
+        <span class="text-sm text-gray-600">${data.total} users · page ${data.page} of ${pages}</span>
+        <div class="space-x-2">
+            <button onclick="goToUsersPage(${data.page - 1})" class="px-3 py-1 bg-gray-200 rounded ${data.page <= 1 ? 'opacity-50 cursor-not-allowed' : ''}" ${data.page <= 1 ? 'disabled' : ''}>Previous</button>
+            <button onclick="goToUsersPage(${data.page + 1})" class="px-3 py-1 bg-gray-200 rounded ${data.page >= pages ? 'opacity-50 cursor-not-allowed' : ''}" ${data.page >= pages ? 'disabled' : ''}>Next</button>
+        </div>
+    `;
+}
+
 // ==================== HELPERS ====================
 
 function showNotification(message, type) {
@@ -2,11 +2,23 @@
 let currentUser = null;
 let products = [];
 let cart = [];
+let productsCursor = null;
+let productsHasMore = true;
+let productsLoading = false;
+let productsCategory = 'all';
+let productsObserver = null;
+const PRODUCTS_PAGE_SIZE = 24;
 let wishlist = [];
 
+// Stripe.js card payments; only set up when the page was rendered with a publishable key
+let stripeClient = null;
+let cardElement = null;
+
 // Initialize app
 document.addEventListener('DOMContentLoaded', function() {
     checkAuth();
+    setupStripe();
+    setupInfiniteScroll();
     loadProducts();
     loadCart();
 });
@@ -73,6 +85,7 @@ async function login() {
             hideLoginModal();
             showNotification('Login successful!', 'success');
             loadWishlist();
+            loadCart();  // Guest cart was merged into the account cart
         } else {
             showNotification(data.message, 'error');
         }
@@ -106,6 +119,7 @@ async function register() {
             hideLoginModal();
             showNotification('Registration successful! Welcome!', 'success');
             loadWishlist();
+            loadCart();
         } else {
             showNotification(data.message, 'error');
         }
@@ -121,6 +135,7 @@ async function logout() {
         wishlist = [];
         updateUserUI();
         updateWishlistUI();
+        loadCart();  // The account cart stays on the server
         showNotification('Logged out successfully', 'success');
     } catch (error) {
         showNotification('Logout failed', 'error');
@@ -129,20 +144,72 @@ async function logout() {
 
 // ==================== PRODUCTS ====================
 
-async function loadProducts() {
+async function loadProducts(reset = true) {
+    if (productsLoading) return;
+    if (!reset && !productsHasMore) return;
+    
+    if (reset) {
+        products = [];
+        productsCursor = null;
+        productsHasMore = true;
+    }
+    
+    productsLoading = true;
     try {
-        const response = await fetch('/api/products');
-        products = await response.json();
-        renderProducts(products);
+        const params = new URLSearchParams({limit: PRODUCTS_PAGE_SIZE});
+        if (productsCursor) params.set('cursor', productsCursor);
+        if (productsCategory !== 'all') params.set('category', productsCategory);
+        
+        const response = await fetch(`/api/products?${params}`);
+        const data = await response.json();
+        
+        products = products.concat(data.products);
+        productsCursor = data.next_cursor;
+        productsHasMore = data.has_more;
+        renderProducts(data.products, !reset);
     } catch (error) {
         console.error('Failed to load products:', error);
+        return;
+    } finally {
+        productsLoading = false;
     }
+    recheckInfiniteScroll();
+}
+
+function setupInfiniteScroll() {
+    const grid = document.getElementById('productsGrid');
+    if (!grid || !('IntersectionObserver' in window)) return;
+    
+    // Sentinel below the grid: when it scrolls into view, fetch the next page
+    const sentinel = document.createElement('div');
+    sentinel.id = 'productsSentinel';
+    sentinel.className = 'h-8';
+    grid.after(sentinel);
+    
+    productsObserver = new IntersectionObserver(entries => {
+        const searchInput = document.getElementById('searchInput');
+        const searching = searchInput && searchInput.value.trim() !== '';
+        if (entries[0].isIntersecting && !searching) {
+            loadProducts(false);
+        }
+    }, {rootMargin: '400px'});
+    productsObserver.observe(sentinel);
+}
+
+function recheckInfiniteScroll() {
+    // The observer only fires when visibility changes: if a page did not push the
+    // sentinel out of view (short page, tall screen), observing again reports it
+    // as intersecting and loads the next page
+    const sentinel = document.getElementById('productsSentinel');
+    if (!productsObserver || !sentinel || !productsHasMore) return;
+    productsObserver.unobserve(sentinel);
+    productsObserver.observe(sentinel);
 }
 
-function renderProducts(productsToRender) {
+function renderProducts(productsToRender, append = false) {
     const grid = document.getElementById('productsGrid');
     
-    grid.innerHTML = productsToRender.map(product => `
+    const html = productsToRender.map(product => `
         <div class="bg-white rounded-lg shadow-md product-card border border-gray-200 relative" data-category="${product.category}">
             ${!product.inStock ? '<div class="absolute top-2 left-2 bg-gray-500 text-white px-2 py-1 rounded text-xs">Out of Stock</div>' : ''}
             
@@ -179,6 +246,12 @@ function renderProducts(productsToRender) {
         </div>
     `).join('');
     
+    if (append) {
+        grid.insertAdjacentHTML('beforeend', html);
+    } else {
+        grid.innerHTML = html;
+    }
+    
     updateWishlistIcons();
 }
 
@@ -198,12 +271,9 @@ function filterProducts(category) {
     // Scroll to products section
     document.getElementById('products')?.scrollIntoView({behavior: 'smooth'});
     
-    if (category === 'all') {
-        renderProducts(products);
-    } else {
-        const filtered = products.filter(p => p.category === category);
-        renderProducts(filtered);
-    }
+    // Category filtering happens server-side so pages stay small
+    productsCategory = category;
+    loadProducts(true);
     
     // Update active filter button
     document.querySelectorAll('.filter-btn').forEach(btn => {
@@ -212,41 +282,56 @@ function filterProducts(category) {
     });
 }
 
-// Search functionality
+// Search functionality (server-side index, debounced)
+let searchTimer = null;
+let searchController = null;
+
 document.getElementById('searchInput')?.addEventListener('input', function(e) {
-    const searchTerm = e.target.value.toLowerCase().trim();
+    const searchTerm = e.target.value.trim();
+    
+    clearTimeout(searchTimer);
+    if (searchController) searchController.abort();
     
     if (searchTerm === '') {
-        // Show all products if search is empty
+        // Show the products loaded so far if search is empty
         renderProducts(products);
         return;
     }
     
-    const filtered = products.filter(p => 
-        p.name.toLowerCase().includes(searchTerm) || 
-        p.description.toLowerCase().includes(searchTerm) ||
-        p.category.toLowerCase().includes(searchTerm) ||
-        (p.features && p.features.some(f => f.toLowerCase().includes(searchTerm)))
-    );
-    
-    renderProducts(filtered);
-    
-    // Show message if no results
-    if (filtered.length === 0) {
-        document.getElementById('productsGrid').innerHTML = `
-            <div class="col-span-full text-center py-12">
-                <i class="fas fa-search text-6xl text-gray-300 mb-4"></i>
-                <h3 class="text-xl font-semibold text-gray-700 mb-2">No products found</h3>
-                <p class="text-gray-500">Try searching with different keywords</p>
-                <button onclick="document.getElementById('searchInput').value=''; renderProducts(products)" 
-                        class="mt-4 bg-blue-600 text-white px-6 py-2 rounded-lg hover:bg-blue-700">
-                    Clear Search
-                </button>
-            </div>
-        `;
-    }
+    searchTimer = setTimeout(() => searchProducts(searchTerm), 200);
 });
 
+async function searchProducts(searchTerm) {
+    searchController = new AbortController();
+    
+    try {
+        const params = new URLSearchParams({q: searchTerm, limit: 48});
+        const response = await fetch(`/api/search?${params}`, {signal: searchController.signal});
+        const data = await response.json();
+        
+        renderProducts(data.products);
+        
+        // Show message if no results
+        if (data.products.length === 0) {
+            document.getElementById('productsGrid').innerHTML = `
+                <div class="col-span-full text-center py-12">
+                    <i class="fas fa-search text-6xl text-gray-300 mb-4"></i>
+                    <h3 class="text-xl font-semibold text-gray-700 mb-2">No products found</h3>
+                    <p class="text-gray-500">Try searching with different keywords</p>
+                    <button onclick="document.getElementById('searchInput').value=''; renderProducts(products)" 
+                            class="mt-4 bg-blue-600 text-white px-6 py-2 rounded-lg hover:bg-blue-700">
+                        Clear Search
+                    </button>
+                </div>
+            `;
+        }
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Search failed:', error);
+        }
+    }
+}
+
 // ==================== CART ====================
 
 async function loadCart() {
@@ -259,68 +344,107 @@ async function loadCart() {
     }
 }
 
-async function addToCart(productId) {
-    try {
-        const response = await fetch('/api/cart/add', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({product_id: productId})
-        });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            cart = data.cart;
-            updateCartUI();
-            showNotification('Added to cart!', 'success');
-        } else {
-            showNotification(data.message, 'error');
+// Cart changes are queued per product, coalesced and sent to /api/cart/batch
+// after a short pause, so rapid +/- clicks become a single request.
+const CART_FLUSH_DELAY_MS = 300;
+let pendingCartOps = new Map();  // productId -> {op, quantity}
+let cartFlushTimer = null;
+let cartFlushPromise = null;
+
+function queueCartOp(productId, op, quantity) {
+    const pending = pendingCartOps.get(productId);
+    if (op === 'add' && pending && pending.op !== 'remove') {
+        // add after add/update: fold into one op
+        pending.quantity += quantity;
+    } else if (op === 'add' && pending) {
+        // add after remove: the line restarts at this quantity
+        pendingCartOps.set(productId, {op: 'update', quantity});
+    } else {
+        // update/remove replace whatever was queued
+        pendingCartOps.set(productId, {op, quantity});
+    }
+    clearTimeout(cartFlushTimer);
+    cartFlushTimer = setTimeout(flushCartOps, CART_FLUSH_DELAY_MS);
+}
+
+async function flushCartOps() {
+    clearTimeout(cartFlushTimer);
+    if (cartFlushPromise) await cartFlushPromise;  // one batch in flight at a time
+    if (pendingCartOps.size === 0) return;
+    
+    const ops = Array.from(pendingCartOps, ([product_id, {op, quantity}]) =>
+        op === 'remove' ? {op, product_id} : {op, product_id, quantity});
+    pendingCartOps = new Map();
+    
+    cartFlushPromise = (async () => {
+        try {
+            const response = await fetch('/api/cart/batch', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ops})
+            });
+            const data = await response.json();
+            
+            if (data.cart) {
+                cart = data.cart;
+                // Keep optimistic changes queued while this batch was in flight
+                pendingCartOps.forEach((change, productId) => applyCartChange(productId, change));
+                updateCartUI();
+            }
+            (data.results || []).filter(r => !r.success).forEach(r => showNotification(r.message, 'error'));
+            if (!data.results && !data.success) {
+                showNotification(data.message, 'error');
+            }
+        } catch (error) {
+            console.error('Failed to update cart:', error);
+            loadCart();
+        } finally {
+            cartFlushPromise = null;
+        }
+    })();
+    return cartFlushPromise;
+}
+
+function applyCartChange(productId, {op, quantity}) {
+    const item = cart.find(i => i.id === productId);
+    if (op === 'remove' || (op === 'update' && quantity < 1)) {
+        cart = cart.filter(i => i.id !== productId);
+    } else if (item) {
+        item.quantity = op === 'add' ? item.quantity + quantity : quantity;
+    } else {
+        const product = products.find(p => p.id === productId);
+        if (product) {
+            cart.push({id: product.id, name: product.name, price: product.price, image: product.image, quantity});
         }
-    } catch (error) {
-        showNotification('Failed to add to cart', 'error');
     }
 }
 
-async function removeFromCart(productId) {
-    try {
-        const response = await fetch('/api/cart/remove', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({product_id: productId})
-        });
-        
-        const data = await response.json();
-        cart = data.cart;
-        updateCartUI();
-    } catch (error) {
-        console.error('Failed to remove from cart:', error);
+function addToCart(productId) {
+    const product = products.find(p => p.id === productId);
+    if (product && !product.inStock) {
+        showNotification('Product out of stock', 'error');
+        return;
     }
+    queueCartOp(productId, 'add', 1);
+    applyCartChange(productId, {op: 'add', quantity: 1});
+    updateCartUI();
+    showNotification('Added to cart!', 'success');
 }
 
-async function updateQuantity(productId, quantity) {
+function removeFromCart(productId) {
+    queueCartOp(productId, 'remove');
+    applyCartChange(productId, {op: 'remove'});
+    updateCartUI();
+}
+
+function updateQuantity(productId, quantity) {
     if (quantity < 1) {
         removeFromCart(productId);
         return;
     }
-    
-    try {
-        const response = await fetch('/api/cart/update', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({product_id: productId, quantity})
-        });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            cart = data.cart;
-            updateCartUI();
-        } else {
-            showNotification(data.message, 'error');
-        }
-    } catch (error) {
-        console.error('Failed to update quantity:', error);
-    }
+    queueCartOp(productId, 'update', quantity);
+    applyCartChange(productId, {op: 'update', quantity});
+    updateCartUI();
 }
 
 function updateCartUI() {
@@ -461,13 +585,22 @@ function toggleWishlist() {
 
 // ==================== CHECKOUT ====================
 
-function proceedToCheckout() {
+async function proceedToCheckout() {
+    await flushCartOps();  // The server cart must match what the user sees
+    
     if (!currentUser) {
         showNotification('Please login to checkout', 'error');
         showLoginModal();
         return;
     }
     
+    if (unpaidOrder) {
+        // Card declined earlier: reopen the form to pay for that order
+        toggleCart();
+        showCheckoutModal();
+        return;
+    }
+    
     if (cart.length === 0) {
         showNotification('Your cart is empty', 'error');
         return;
@@ -492,8 +625,35 @@ function hideCheckoutModal() {
     document.getElementById('overlay').classList.add('hidden');
 }
 
+// One key per checkout attempt: a double-click or network retry re-sends the
+// same key, and the server answers with the order it already created.
+let checkoutKey = null;
+
+// Order placed but its card not yet confirmed: submitting again retries the payment
+let unpaidOrder = null;
+
+function setupStripe() {
+    if (!window.STRIPE_PUBLIC_KEY || !window.Stripe) return;
+    stripeClient = Stripe(window.STRIPE_PUBLIC_KEY);
+    cardElement = stripeClient.elements().create('card');
+    cardElement.mount('#cardElement');
+    cardElement.on('change', event => {
+        document.getElementById('cardErrors').textContent = event.error ? event.error.message : '';
+    });
+}
+
+function newCheckoutKey() {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
 document.getElementById('checkoutForm')?.addEventListener('submit', async function(e) {
     e.preventDefault();
+    if (unpaidOrder) {
+        await payOrder(unpaidOrder);
+        return;
+    }
+    checkoutKey = checkoutKey || newCheckoutKey();
     
     const shippingData = {
         shipping_name: document.getElementById('shippingName').value,
@@ -509,20 +669,32 @@ document.getElementById('checkoutForm')?.addEventListener('submit', async functi
     try {
         const response = await fetch('/api/checkout', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers: {'Content-Type': 'application/json', 'Idempotency-Key': checkoutKey},
             body: JSON.stringify(shippingData)
         });
         
         const data = await response.json();
         
         if (data.success) {
-            hideCheckoutModal();
-            showNotification(`Order placed successfully! Order #${data.order_number}`, 'success');
+            checkoutKey = null;
             cart = [];
             updateCartUI();
             
-            // Reset form
+            if (data.payment_status === 'pending' && stripeClient) {
+                // The modal stays open with the card field until Stripe confirms the payment
+                await payOrder({statusUrl: data.status_url, orderNumber: data.order_number});
+                return;
+            }
+            
+            hideCheckoutModal();
             document.getElementById('checkoutForm').reset();
+            
+            if (data.payment_status === 'pending') {
+                showNotification(`Order #${data.order_number} received, confirming payment...`, 'success');
+                watchOrderStatus(data.status_url, data.order_number);
+            } else {
+                showOrderOutcome(data.order_number, data.payment_status);
+            }
         } else {
             showNotification(data.message, 'error');
         }
@@ -531,6 +703,101 @@ document.getElementById('checkoutForm')?.addEventListener('submit', async functi
     }
 });
 
+// The settle_payment job creates the payment intent shortly after checkout:
+// poll the status endpoint for its client_secret, then confirm the card.
+async function fetchClientSecret(statusUrl) {
+    for (const delay of [0, ...ORDER_POLL_DELAYS_MS]) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        try {
+            const response = await fetch(`${statusUrl}?client_secret=1`, {cache: 'no-store'});
+            if (!response.ok) continue;
+            const data = await response.json();
+            if (data.settled || data.payment_client_secret) return data;
+        } catch (error) {
+            // Network blip: try again on the next tick
+        }
+    }
+    return null;
+}
+
+async function payOrder(order) {
+    const submit = document.getElementById('checkoutSubmit');
+    const errors = document.getElementById('cardErrors');
+    unpaidOrder = order;
+    submit.disabled = true;
+    errors.textContent = '';
+    try {
+        const status = await fetchClientSecret(order.statusUrl);
+        if (status && status.settled) {
+            unpaidOrder = null;
+            hideCheckoutModal();
+            showOrderOutcome(order.orderNumber, status.payment_status);
+            return;
+        }
+        if (!status) {
+            errors.textContent = 'Payment is not ready yet, please try again in a moment';
+            return;
+        }
+        
+        const result = await stripeClient.confirmCardPayment(status.payment_client_secret, {
+            payment_method: {
+                card: cardElement,
+                billing_details: {
+                    name: document.getElementById('shippingName').value,
+                    email: document.getElementById('shippingEmail').value
+                }
+            }
+        });
+        if (result.error) {
+            // A declined card keeps the order open: the customer can try another one
+            errors.textContent = result.error.message;
+            submit.innerHTML = '<i class="fas fa-lock mr-2"></i>Retry Payment';
+            return;
+        }
+        
+        unpaidOrder = null;
+        hideCheckoutModal();
+        document.getElementById('checkoutForm').reset();
+        cardElement.clear();
+        submit.innerHTML = '<i class="fas fa-lock mr-2"></i>Place Order';
+        showNotification(`Order #${order.orderNumber} paid, confirming...`, 'success');
+        watchOrderStatus(order.statusUrl, order.orderNumber);
+    } finally {
+        submit.disabled = false;
+    }
+}
+
+// Payment is settled in the background after checkout: poll the order's
+// status with a growing interval until it is paid or failed.
+const ORDER_POLL_DELAYS_MS = [1000, 1000, 2000, 2000, 3000, 5000, 5000, 10000, 10000, 20000];
+
+async function watchOrderStatus(statusUrl, orderNumber) {
+    for (const delay of ORDER_POLL_DELAYS_MS) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        try {
+            const response = await fetch(statusUrl, {cache: 'no-store'});
+            if (!response.ok) continue;
+            const data = await response.json();
+            if (data.settled) {
+                showOrderOutcome(orderNumber, data.payment_status);
+                return;
+            }
+        } catch (error) {
+            // Network blip: try again on the next tick
+        }
+    }
+    showNotification(`Order #${orderNumber} is still awaiting payment; check My Orders for updates`, 'success');
+}
+
+function showOrderOutcome(orderNumber, paymentStatus) {
+    if (paymentStatus === 'completed') {
+        showNotification(`Order placed successfully! Order #${orderNumber}`, 'success');
+    } else {
+        showNotification(`Payment for order #${orderNumber} failed; the order was cancelled`, 'error');
+        loadProducts();  // Its stock is available again
+    }
+}
+
 // ==================== UI HELPERS ====================
 
 function toggleUserMenu() {
@@ -0,0 +1,229 @@
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime
+
+import stripe
+from flask import current_app
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from job_queue import job_queue
+from models import db, Order, StripeEvent
+from order_settlement import complete_orders, fail_orders, schedule_refund
+
+# Event types applied to orders; anything else Stripe sends is acknowledged and dropped.
+# payment_intent.payment_failed is not terminal: the customer can retry with another card,
+# and intents still unpaid at PAYMENT_SETTLE_TIMEOUT are cancelled by the settle job.
+SUCCEEDED = 'payment_intent.succeeded'
+CANCELED = 'payment_intent.canceled'
+REFUNDED = 'charge.refunded'
+HANDLED_EVENTS = (SUCCEEDED, CANCELED, REFUNDED)
+
+
+class WebhookError(Exception):
+    """The request is not a genuine, well-formed Stripe event"""
+
+
+def verify_event(payload, signature):
+    """
+    Check the Stripe-Signature header and parse the event
+
+    Args:
+        payload: Raw request body (str); must not be re-serialized first
+        signature: Stripe-Signature header value
+
+    Returns:
+        Event dict
+
+    Raises:
+        WebhookError: bad or stale signature, or not an event
+    """
+    config = current_app.config
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload, signature, config['STRIPE_WEBHOOK_SECRET'], config.get('STRIPE_WEBHOOK_TOLERANCE', 300)
+        )
+        event = json.loads(payload)
+    except (stripe.error.SignatureVerificationError, ValueError) as e:
+        raise WebhookError(str(e)) from e
+    if not isinstance(event, dict) or not event.get('id') or not event.get('type'):
+        raise WebhookError('Payload is not a Stripe event')
+    return event
+
+
+def record_event(event):
+    """
+    Store a verified event once and queue it for processing
+
+    Stripe delivers at least once: a redelivered event id hits the primary
+    key and is acknowledged without being applied again.
+
+    Returns:
+        True if the event is new, False for a duplicate or unhandled type
+    """
+    if event['type'] not in HANDLED_EVENTS:
+        return False
+    if db.session.get(StripeEvent, event['id']) is not None:
+        return False
+
+    db.session.add(StripeEvent(id=event['id'], type=event['type'], payload=event))
+    job_queue.enqueue('apply_stripe_events', {'event_id': event['id']}, commit=False)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same event was delivered twice concurrently and the other request stored it
+        db.session.rollback()
+        return False
+    job_queue.wake()
+    return True
+
+
+@job_queue.handler('apply_stripe_events', batch=True)
+def apply_stripe_events(payloads):
+    """
+    Job handler: apply a batch of stored events to orders in bulk
+
+    Events are replayed in the order Stripe created them. One query maps
+    every payment intent in the batch to its order, and each outcome is
+    one conditional UPDATE (see order_settlement), so a redelivered or
+    replayed event never settles an order twice.
+    """
+    ids = [payload['event_id'] for payload in payloads]
+    events = StripeEvent.query.filter(StripeEvent.id.in_(ids)).all()
+    events.sort(key=lambda e: (e.payload.get('created', 0), e.received_at))
+
+    succeeded, canceled, refunds = {}, {}, {}
+    for event in events:
+        obj = event.payload['data']['object']
+        if event.type == SUCCEEDED:
+            succeeded[obj['id']] = obj
+        elif event.type == CANCELED:
+            canceled[obj['id']] = obj
+        elif event.type == REFUNDED and obj.get('payment_intent'):
+            refunds[obj['payment_intent']] = obj
+
+    orders = _orders_for_intents({**succeeded, **canceled, **refunds})
+
+    if succeeded:
+        payments = {orders[pi].id: pi for pi in succeeded if pi in orders}
+        settled = complete_orders(payments)
+        for pi in succeeded:
+            order = orders.get(pi)
+            if order is not None and order.id not in settled and order.status == 'cancelled':
+                # Paid after the order was cancelled (settle deadline or admin): release any
+                # stock it still holds and give the money back
+                fail_orders([order.id])
+                schedule_refund(order, pi, commit=True)
+
+    if canceled:
+        fail_orders([orders[pi].id for pi in canceled if pi in orders])
+
+    if refunds:
+        _apply_refunds({pi: obj for pi, obj in refunds.items() if pi in orders})
+
+    unknown = [pi for pi in {**succeeded, **canceled, **refunds} if pi not in orders]
+    if unknown:
+        print(f"Stripe events for unknown payment intents: {', '.join(sorted(unknown))}")
+
+    db.session.execute(
+        update(StripeEvent).where(StripeEvent.id.in_(ids))
+        .values(status='processed', processed_at=datetime.utcnow())
+    )
+    db.session.commit()
+    job_queue.wake()
+    return [None] * len(payloads)
+
+
+def _orders_for_intents(intents):
+    """{payment_intent_id: Order} in one query, matched by payment id or metadata order number"""
+    if not intents:
+        return {}
+    numbers = {obj.get('metadata', {}).get('order_number'): pi for pi, obj in intents.items()}
+    numbers.pop(None, None)
+    query = Order.query.filter(or_(Order.payment_id.in_(list(intents)), Order.order_number.in_(list(numbers))))
+    orders = {}
+    for order in query.all():
+        if order.payment_id in intents:
+            orders[order.payment_id] = order
+        if order.order_number in numbers:
+            orders[numbers[order.order_number]] = order
+    return orders
+
+
+def _apply_refunds(refunds):
+    """Mark paid orders refunded or partially refunded: one UPDATE per outcome"""
+    full = [pi for pi, charge in refunds.items() if charge.get('refunded')]
+    partial = [pi for pi in refunds if pi not in full]
+    for payment_ids, status in ((full, 'refunded'), (partial, 'partially_refunded')):
+        if payment_ids:
+            db.session.execute(
+                update(Order)
+                .where(Order.payment_id.in_(payment_ids),
+                       Order.payment_status.in_(['completed', 'partially_refunded']))
+                .values(payment_status=status),
+                execution_options={'synchronize_session': False}
+            )
+    db.session.commit()
+
+
+def requeue_events(event_type=None, since=None, event_id=None):
+    """Queue stored events to be applied again (orders only change if still applicable)"""
+    query = StripeEvent.query
+    if event_id:
+        query = query.filter(StripeEvent.id == event_id)
+    if event_type:
+        query = query.filter(StripeEvent.type == event_type)
+    if since:
+        query = query.filter(StripeEvent.received_at >= since)
+    ids = [event.id for event in query.order_by(StripeEvent.received_at)]
+    for event_id in ids:
+        job_queue.enqueue('apply_stripe_events', {'event_id': event_id}, commit=False)
+    db.session.execute(update(StripeEvent).where(StripeEvent.id.in_(ids)).values(status='received'))
+    db.session.commit()
+    job_queue.wake()
+    return len(ids)
+
+
+# ==================== FIXTURES ====================
+
+def build_event(event_type, order, amount_refunded=None):
+    """A Stripe-shaped event for an order (local testing and `flask stripe-event-fixture`)"""
+    amount = int(round(order.total_amount * 100))
+    intent = {
+        'id': order.payment_id or f'pi_{uuid.uuid4().hex[:24]}',
+        'object': 'payment_intent',
+        'amount': amount,
+        'currency': 'usd',
+        'status': {SUCCEEDED: 'succeeded', CANCELED: 'canceled'}.get(event_type, 'requires_payment_method'),
+        'metadata': {'order_number': order.order_number},
+    }
+    if event_type == REFUNDED:
+        refunded = amount if amount_refunded is None else int(round(amount_refunded * 100))
+        obj = {
+            'id': f'ch_{uuid.uuid4().hex[:24]}',
+            'object': 'charge',
+            'amount': amount,
+            'amount_refunded': refunded,
+            'refunded': refunded >= amount,
+            'payment_intent': intent['id'],
+        }
+    else:
+        obj = intent
+    return {
+        'id': f'evt_{uuid.uuid4().hex[:24]}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'livemode': False,
+        'data': {'object': obj},
+    }
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Stripe-Signature header for a raw payload, as Stripe computes it"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode('utf-8'), f'{timestamp}.{payload}'.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
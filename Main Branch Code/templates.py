@@ -251,7 +251,12 @@ MAIN_TEMPLATE = """
                             <input type="text" id="shippingCountry" required class="w-full px-3 py-2 border rounded-lg">
                         </div>
                     </div>
-                    <button type="submit" class="w-full bg-green-600 text-white py-3 rounded-lg font-semibold hover:bg-green-700">
+                    {% if stripe_public_key %}
+                    <h4 class="font-semibold mb-4">Payment</h4>
+                    <div id="cardElement" class="w-full px-3 py-3 border rounded-lg mb-2"></div>
+                    <p id="cardErrors" class="text-red-600 text-sm mb-4"></p>
+                    {% endif %}
+                    <button type="submit" id="checkoutSubmit" class="w-full bg-green-600 text-white py-3 rounded-lg font-semibold hover:bg-green-700">
                         <i class="fas fa-lock mr-2"></i>Place Order
                     </button>
                 </form>
@@ -261,6 +266,10 @@ MAIN_TEMPLATE = """
 
     <div id="overlay" class="fixed inset-0 bg-black bg-opacity-50 hidden z-40"></div>
 
+    {% if stripe_public_key %}
+    <script src="https://js.stripe.com/v3/"></script>
+    <script>window.STRIPE_PUBLIC_KEY = {{ stripe_public_key|tojson }};</script>
+    {% endif %}
     <script src="/static/app.js"></script>
 </body>
 </html>
@@ -374,8 +383,13 @@ ADMIN_DASHBOARD_TEMPLATE = """
                     </div>
 
                     <div id="usersTab" class="hidden">
-                        <h3 class="text-xl font-bold mb-4">Users</h3>
+                        <div class="flex justify-between items-center mb-4">
+                            <h3 class="text-xl font-bold">Users</h3>
+                            <input type="text" id="usersSearch" placeholder="Search username or email..."
+                                   class="px-4 py-2 border rounded-lg focus:outline-none focus:ring-2 focus:ring-blue-500">
+                        </div>
                         <div id="usersTable"></div>
+                        <div id="usersPager" class="flex justify-between items-center mt-4"></div>
                     </div>
                 </div>
             </div>
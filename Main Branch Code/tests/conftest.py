@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from commands import init_db  # noqa: E402
+from config import config, TestingConfig  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    """
+    Factory for TestingConfig apps with some settings overridden
+
+    Overrides are class attributes of a TestingConfig subclass, so they are in
+    place before the extensions' init_app (e.g. RATE_LIMIT_ENABLED=True, or a
+    file database for tests that need several connections).
+    """
+    apps = []
+
+    def factory(**overrides):
+        monkeypatch.setitem(config, 'test', type('TestConfig', (TestingConfig,), overrides))
+        app = create_app('test')
+        with app.app_context():
+            init_db()
+        apps.append(app)
+        return app
+
+    yield factory
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def app(make_app):
+    """TestingConfig app on a fresh in-memory database with the demo catalog and admin user"""
+    return make_app()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    response = client.post('/api/login', json={'email': 'admin@shopeasy.com', 'password': 'admin123'})
+    assert response.status_code == 200, response.get_json()
+    return client
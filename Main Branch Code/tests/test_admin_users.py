@@ -0,0 +1,28 @@
+"""Admin user search matches the term literally"""
+import pytest
+
+from models import db, User
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        for username in ('jane_doe', 'janexdoe', '100%club', 'back\\slash'):
+            user = User(username=username, email=f'{username.replace("%", "").replace(chr(92), "")}@example.com')
+            user.set_password('password1')
+            db.session.add(user)
+        db.session.commit()
+
+
+@pytest.mark.parametrize('term, expected', [
+    ('e_d', ['jane_doe']),
+    ('0%c', ['100%club']),
+    ('k\\s', ['back\\slash']),
+    ('jane', ['jane_doe', 'janexdoe']),
+])
+def test_wildcards_in_the_term_are_literal(admin_client, users, term, expected):
+    response = admin_client.get('/api/admin/users', query_string={'q': term, 'sort': 'username', 'order': 'asc'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [u['username'] for u in data['users']] == expected
+    assert data['total'] == len(expected)
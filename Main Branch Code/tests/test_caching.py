@@ -0,0 +1,39 @@
+"""Catalog responses are cached and revalidated with ETags until a catalog write"""
+from cache_utils import cache, DatabaseCounters
+
+
+def test_unchanged_catalog_answers_304(app):
+    client = app.test_client()
+    first = client.get('/api/products')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'public, no-cache'
+    tag = first.headers['ETag']
+
+    again = client.get('/api/products', headers={'If-None-Match': tag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+
+    other_page = client.get('/api/products?category=Home', headers={'If-None-Match': tag})
+    assert other_page.status_code == 200
+
+
+def test_admin_write_changes_etag_and_body(app, admin_client):
+    first = admin_client.get('/api/products/1')
+    tag = first.headers['ETag']
+    assert admin_client.get('/api/products/1').get_json() == first.get_json()
+
+    assert admin_client.put('/api/admin/products/1', json={'price': 1.5}).status_code == 200
+
+    after = admin_client.get('/api/products/1', headers={'If-None-Match': tag})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != tag
+    assert after.get_json()['price'] == 1.5
+
+
+def test_invalidation_reaches_other_processes(app):
+    with app.app_context():
+        other_process = DatabaseCounters(ttl=0)
+        key = f'{cache.prefix}gen:catalog'
+        before = other_process.counter(key)
+        assert cache.invalidate('catalog') == before + 1
+        assert other_process.counter(key) == before + 1
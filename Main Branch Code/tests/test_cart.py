@@ -0,0 +1,63 @@
+"""Server-side carts: batch updates, expiry and write conflicts"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from cart_store import cart_store, CartConflict, DatabaseCartBackend
+from models import db, CartItem, Product
+
+
+def test_batch_applies_ops_in_order_and_reports_failures(app):
+    client = app.test_client()
+    with app.app_context():
+        first, second = Product.query.order_by(Product.id).limit(2).all()
+        first_id, second_id, second_stock = first.id, second.id, second.stock
+
+    response = client.post('/api/cart/batch', json={'ops': [
+        {'op': 'add', 'product_id': first_id, 'quantity': 2},
+        {'op': 'add', 'product_id': second_id},
+        {'op': 'update', 'product_id': second_id, 'quantity': second_stock + 1},
+        {'op': 'add', 'product_id': 999999},
+        {'op': 'update', 'product_id': first_id, 'quantity': 3},
+    ]})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert not data['success']
+    assert [r['success'] for r in data['results']] == [True, True, False, False, True]
+    assert {i['id']: i['quantity'] for i in data['cart']} == {first_id: 3, second_id: 1}
+
+    client.post('/api/cart/batch', json={'ops': [{'op': 'remove', 'product_id': first_id}]})
+    assert [i['id'] for i in client.get('/api/cart').get_json()] == [second_id]
+
+    assert client.post('/api/cart/batch', json={'ops': []}).status_code == 400
+
+
+def test_purge_drops_only_carts_idle_past_the_ttl(app):
+    with app.app_context():
+        backend = DatabaseCartBackend(ttl=3600)
+        backend.set_many('guest:idle', {1: 1, 2: 1})
+        backend.set_many('guest:active', {1: 1, 2: 1})
+        stale = datetime.utcnow() - timedelta(hours=2)
+        CartItem.query.filter_by(cart_key='guest:idle').update({'updated_at': stale})
+        # One old line in a cart that is still being used keeps the whole cart
+        CartItem.query.filter_by(cart_key='guest:active', product_id=1).update({'updated_at': stale})
+        db.session.commit()
+
+        assert backend.purge_expired() == 2
+        assert backend.get('guest:idle') == {}
+        assert backend.get('guest:active') == {1: 1, 2: 1}
+
+
+def test_cart_conflict_answers_409(app, monkeypatch):
+    def conflict(*args, **kwargs):
+        raise CartConflict('busy')
+
+    monkeypatch.setattr(cart_store.backend, 'set_quantity', conflict)
+    response = app.test_client().post('/api/cart/add', json={'product_id': 1})
+    assert response.status_code == 409
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.parametrize('ops', [[{'op': 'add', 'product_id': 1}] * 51, 'add'])
+def test_batch_rejects_malformed_bodies(app, ops):
+    assert app.test_client().post('/api/cart/batch', json={'ops': ops}).status_code == 400
@@ -0,0 +1,58 @@
+"""Concurrent checkouts never oversell (reserve_stock's conditional UPDATE)"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+from inventory import reserve_stock
+from models import db, Product
+
+STOCK = 10
+BUYERS = 8
+ATTEMPTS = 4
+
+
+def test_concurrent_reservations_never_oversell(make_app, tmp_path):
+    # A file database, so every buyer thread gets its own connection
+    app = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'stock.db'}")
+    with app.app_context():
+        product = Product(name='Last units', price=1.0, stock=STOCK, category='Test')
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    start_line = Barrier(BUYERS)
+
+    def buyer(_):
+        sold = 0
+        with app.app_context():
+            start_line.wait()
+            for _ in range(ATTEMPTS):
+                reservation = reserve_stock({product_id: 1})
+                if reservation.ok:
+                    db.session.commit()
+                    sold += 1
+                else:
+                    db.session.rollback()
+            db.session.remove()
+        return sold
+
+    with ThreadPoolExecutor(BUYERS) as pool:
+        sold = sum(pool.map(buyer, range(BUYERS)))
+
+    with app.app_context():
+        remaining = db.session.get(Product, product_id).stock
+    assert remaining >= 0
+    assert sold <= STOCK
+    assert remaining == STOCK - sold
+    # Demand (32) exceeds supply, so every unit is sold exactly once
+    assert sold == STOCK
+
+
+def test_reservation_fails_whole_order_when_one_line_is_short(app):
+    with app.app_context():
+        first, second = Product.query.order_by(Product.id).limit(2).all()
+        stock = first.stock
+        reservation = reserve_stock({first.id: 1, second.id: second.stock + 1})
+        assert not reservation.ok
+        assert [f['product_id'] for f in reservation.failures] == [second.id]
+        db.session.rollback()
+        assert db.session.get(Product, first.id).stock == stock
@@ -0,0 +1,42 @@
+"""Keyset pagination walks the catalog once and rejects malformed cursors with 400"""
+import base64
+import json
+
+import pytest
+
+from query_utils import PRODUCT_SORTS
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('sort', PRODUCT_SORTS)
+def test_pages_cover_the_catalog_exactly_once(app, sort):
+    client = app.test_client()
+    total = len(client.get('/api/products').get_json())
+    seen, cursor = [], ''
+    while True:
+        page = client.get(f'/api/products?limit=4&sort={sort}&cursor={cursor}').get_json()
+        seen += [p['id'] for p in page['products']]
+        if not page['has_more']:
+            break
+        cursor = page['next_cursor']
+    assert len(seen) == len(set(seen)) == total
+
+
+@pytest.mark.parametrize('sort, cursor', [
+    ('price_asc', raw_cursor([[1], 2])),
+    ('price_asc', raw_cursor(['10', 2])),
+    ('rating', raw_cursor([True, 2])),
+    ('rating', raw_cursor([4.5, [2]])),
+    ('rating', raw_cursor([4.5, 2.5])),
+    ('newest', raw_cursor([{'a': 1}, 2])),
+    ('newest', raw_cursor([5, 2])),
+    ('newest', raw_cursor({'a': 1, 'b': 2})),
+    ('newest', 'not-base64!'),
+])
+def test_malformed_cursor_is_a_400(app, sort, cursor):
+    response = app.test_client().get(f'/api/products?limit=4&sort={sort}&cursor={cursor}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
@@ -0,0 +1,49 @@
+"""Password hashing sheds load with a fast 503 instead of tying up request threads"""
+import threading
+import time
+
+import pytest
+
+from password_hashing import password_hasher, HashingBusy
+
+CREDENTIALS = {'email': 'admin@shopeasy.com', 'password': 'admin123'}
+
+
+@pytest.fixture
+def hashing_app(make_app):
+    return make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_PENDING=1, PASSWORD_HASH_TIMEOUT=0.5)
+
+
+def occupy(seconds):
+    """Run a slow job on the hashing executor from another thread"""
+    thread = threading.Thread(target=password_hasher._submit, args=(time.sleep, seconds))
+    thread.start()
+    time.sleep(0.05)
+    return thread
+
+
+def test_full_queue_answers_503_without_waiting(hashing_app):
+    client = hashing_app.test_client()
+    assert client.post('/api/login', json=CREDENTIALS).status_code == 200
+
+    threads = [occupy(0.3), occupy(0.3)]
+    started = time.perf_counter()
+    response = client.post('/api/login', json=CREDENTIALS)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert time.perf_counter() - started < 0.1
+    for thread in threads:
+        thread.join()
+
+    assert client.post('/api/login', json=CREDENTIALS).status_code == 200
+
+
+def test_hash_that_cannot_finish_in_time_is_rejected_up_front(hashing_app):
+    with hashing_app.app_context():
+        password_hasher._seconds = 0.7  # as measured after a run of slow hashes
+        thread = occupy(0.1)  # an idle queue still takes a hash
+        started = time.perf_counter()
+        with pytest.raises(HashingBusy, match='queue is'):
+            password_hasher.verify('$2b$04$' + 'x' * 53, 'password')
+        assert time.perf_counter() - started < 0.1
+        thread.join()
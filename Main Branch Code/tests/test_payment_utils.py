@@ -0,0 +1,38 @@
+"""Stripe calls go through the circuit breaker, which always recovers after a half-open trial"""
+import pytest
+
+import payment_utils
+from payment_utils import CircuitBreaker, PaymentUnavailable, _call
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    monkeypatch.setattr(payment_utils, 'breaker', breaker)
+    return breaker
+
+
+def fail(*args, **kwargs):
+    raise TypeError('unexpected')
+
+
+def test_unexpected_error_in_trial_counts_as_failure_and_ends_it(app, breaker):
+    breaker.record_failure()
+    assert breaker.state == 'half-open'
+    with app.app_context():
+        with pytest.raises(TypeError):
+            _call(fail)
+        # The trial ended with a failure: the next call is a new trial, not rejected forever
+        assert breaker.state == 'half-open'
+        assert _call(lambda: 'ok') == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_open_circuit_rejects_without_calling(app, breaker):
+    breaker.reset_timeout = 60
+    with app.app_context():
+        with pytest.raises(TypeError):
+            _call(fail)
+        assert breaker.state == 'open'
+        with pytest.raises(PaymentUnavailable):
+            _call(fail)
@@ -0,0 +1,59 @@
+"""Order read paths run a fixed number of queries however many orders and items there are"""
+import uuid
+
+import pytest
+
+from models import db, Order, OrderItem, Product, User
+from query_utils import count_queries
+
+
+def seed_orders(app, count, items_per_order=3):
+    """Add paid orders for the admin user; returns the id of the last one"""
+    with app.app_context():
+        user = User.query.filter_by(email='admin@shopeasy.com').one()
+        products = Product.query.order_by(Product.id).limit(items_per_order).all()
+        for _ in range(count):
+            order = Order(
+                order_number=f'ORD-{uuid.uuid4().hex[:8].upper()}',
+                user_id=user.id,
+                total_amount=sum(p.price for p in products),
+                status='confirmed',
+                payment_status='completed',
+                shipping_name='Test User',
+                shipping_email=user.email
+            )
+            db.session.add(order)
+            db.session.flush()
+            for product in products:
+                db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=product.price))
+        db.session.commit()
+        return order.id
+
+
+def queries_for(app, client, url):
+    """Statements run by one GET, after a warm-up request (session principal, caches)"""
+    with app.app_context():
+        engine = db.engine
+    assert client.get(url).status_code == 200
+    with count_queries(engine) as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    return counter.count
+
+
+@pytest.mark.parametrize('url', ['/api/orders', '/orders', '/api/admin/orders'])
+def test_order_listings_do_not_grow_with_orders(app, admin_client, url):
+    seed_orders(app, 2)
+    few = queries_for(app, admin_client, url)
+    seed_orders(app, 8)
+    many = queries_for(app, admin_client, url)
+    assert many == few
+    assert few <= 4
+
+
+def test_order_detail_does_not_grow_with_items(app, admin_client):
+    small = seed_orders(app, 1, items_per_order=1)
+    large = seed_orders(app, 1, items_per_order=6)
+    assert queries_for(app, admin_client, f'/api/orders/{large}') == \
+        queries_for(app, admin_client, f'/api/orders/{small}')
+    assert queries_for(app, admin_client, f'/api/orders/{large}') <= 3
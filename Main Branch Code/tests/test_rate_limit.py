@@ -0,0 +1,39 @@
+"""Per-route request budgets (429) and queue-wait load shedding (503)"""
+import time
+
+import pytest
+
+
+@pytest.fixture
+def limited_app(make_app):
+    return make_app(RATE_LIMIT_ENABLED=True)
+
+
+def test_login_budget_runs_out(limited_app):
+    client = limited_app.test_client()
+    credentials = {'email': 'nobody@example.com', 'password': 'wrong'}
+    statuses = [client.post('/api/login', json=credentials).status_code for _ in range(11)]
+    assert statuses[:10] == [401] * 10
+    assert statuses[10] == 429
+    assert client.post('/api/login', json=credentials).headers['Retry-After']
+
+    # Other policies have their own buckets
+    assert client.get('/api/products').status_code == 200
+
+
+def test_requests_queued_too_long_are_shed_by_priority(limited_app):
+    client = limited_app.test_client()
+    # Browsing may wait half of RATE_LIMIT_MAX_QUEUE_WAIT, checkout all of it
+    stamp = {'X-Request-Start': f't={time.time() - 0.75:.3f}'}
+    shed = client.get('/api/products', headers=stamp)
+    assert shed.status_code == 503
+    assert int(shed.headers['Retry-After']) >= 1
+    assert client.get('/api/cart', headers=stamp).status_code == 503
+
+    assert client.get('/api/products', headers={'X-Request-Start': f't={time.time():.3f}'}).status_code == 200
+
+
+def test_disabled_limiter_never_limits(app):
+    client = app.test_client()
+    credentials = {'email': 'nobody@example.com', 'password': 'wrong'}
+    assert all(client.post('/api/login', json=credentials).status_code == 401 for _ in range(15))
@@ -0,0 +1,52 @@
+"""init-db upgrades tables created by an earlier release in place"""
+from sqlalchemy import Column, MetaData, Table, inspect
+
+from commands import init_db
+from models import db, Order, Product, Review, User
+
+# Columns, indexes and constraints added to existing tables since the first release
+NEW_COLUMNS = {'products': {'rating_sum', 'rating_count'}, 'orders': {'checkout_key'}}
+
+
+def recreate_as_released(table, dropped):
+    """Replace table with a copy that lacks the dropped columns and every index and constraint"""
+    released = Table(table.name, MetaData(), *[
+        Column(c.name, c.type, primary_key=c.primary_key) for c in table.columns if c.name not in dropped
+    ])
+    rows = [dict(r._mapping) for r in db.session.execute(released.select())]
+    db.session.execute(released.delete())
+    db.session.commit()
+    table.drop(db.engine)
+    released.create(db.engine)
+    if rows:
+        db.session.execute(released.insert(), rows)
+    db.session.commit()
+
+
+def test_init_db_adds_columns_indexes_and_backfills_ratings(make_app, tmp_path):
+    app = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'old.db'}")
+    with app.app_context():
+        product = Product.query.order_by(Product.id).first()
+        user = User.query.filter_by(email='admin@shopeasy.com').one()
+        db.session.add_all([Review(user_id=user.id, product_id=product.id, rating=r) for r in (2, 3)])
+        db.session.commit()
+        product_id = product.id
+        recreate_as_released(Product.__table__, NEW_COLUMNS['products'])
+        recreate_as_released(Order.__table__, NEW_COLUMNS['orders'])
+        db.session.remove()
+        assert not NEW_COLUMNS['products'] & {c['name'] for c in inspect(db.engine).get_columns('products')}
+
+        init_db()
+
+        inspector = inspect(db.engine)
+        for table, columns in NEW_COLUMNS.items():
+            assert columns <= {c['name'] for c in inspector.get_columns(table)}
+        assert 'ix_products_rating_id' in {i['name'] for i in inspector.get_indexes('products')}
+        unique = {i['name']: i['unique'] for i in inspector.get_indexes('orders')}
+        assert unique.get('unique_order_checkout_key')
+
+        product = db.session.get(Product, product_id)
+        assert (product.rating_sum, product.rating_count, product.rating) == (5, 2, 2.5)
+
+        # Second run is a no-op
+        init_db()
@@ -0,0 +1,73 @@
+"""Product search: relevance, prefix matching, category filter and index upkeep"""
+import pytest
+
+from models import db, Product
+from search_utils import product_search, InMemorySearchIndex
+
+
+def names(response):
+    assert response.status_code == 200
+    return [p['name'] for p in response.get_json()['products']]
+
+
+def test_search_endpoint_filters_by_category_before_limiting(app):
+    client = app.test_client()
+    assert set(names(client.get('/api/search?q=wireless'))) == {'Wireless Headphones', 'Wireless Mouse'}
+    assert names(client.get('/api/search?q=wire&category=Electronics&limit=1'))
+    assert names(client.get('/api/search?q=wireless&category=Fashion')) == []
+    assert names(client.get('/api/search?q=')) == []
+
+
+def test_search_sees_admin_product_changes(app, admin_client):
+    product_id = admin_client.post('/api/admin/products', json={
+        'name': 'Trail Hammock', 'price': 49.0, 'category': 'Sports', 'stock': 3
+    }).get_json()['product_id']
+    assert names(admin_client.get('/api/search?q=hammock')) == ['Trail Hammock']
+
+    admin_client.put(f'/api/admin/products/{product_id}', json={'name': 'Camping Hammock'})
+    assert names(admin_client.get('/api/search?q=camping')) == ['Camping Hammock']
+    assert names(admin_client.get('/api/search?q=trail')) == []
+
+    admin_client.delete(f'/api/admin/products/{product_id}')
+    assert names(admin_client.get('/api/search?q=hammock')) == []
+
+
+def test_in_memory_index_ranks_prefix_and_category_matches(app):
+    with app.app_context():
+        index = InMemorySearchIndex()
+        index.rebuild(Product.query.all())
+        by_name = {p.name: p.id for p in Product.query.all()}
+
+        assert index.search('wireless mouse', 10) == [by_name['Wireless Mouse']]
+        assert index.search('bluetooth mouse', 10) == []
+        assert set(index.search('wire', 10)) == {by_name['Wireless Headphones'], by_name['Wireless Mouse']}
+        assert index.search('wire', 10, category='Fashion') == []
+        assert len(index.search('wire', 1, category='Electronics')) == 1
+
+        mouse = db.session.get(Product, by_name['Wireless Mouse'])
+        mouse.name = 'Bluetooth Mouse'
+        index.index_product(mouse)
+        assert index.search('bluetooth mouse', 10) == [mouse.id]
+        index.remove_product(mouse.id)
+        assert index.search('mouse', 10) == []
+        db.session.rollback()
+
+
+def test_in_memory_index_only_sees_committed_writes(app, admin_client, monkeypatch):
+    product_search.backend = InMemorySearchIndex()
+    assert names(admin_client.get('/api/search?q=wireless&category=Electronics'))
+
+    admin_client.put('/api/admin/products/1', json={'name': 'Studio Headphones'})
+    assert names(admin_client.get('/api/search?q=studio')) == ['Studio Headphones']
+
+    def fail():
+        raise RuntimeError('commit failed')
+
+    monkeypatch.setattr(db.session, 'commit', fail)
+    with pytest.raises(RuntimeError):
+        admin_client.put('/api/admin/products/1', json={'name': 'Rolled Back Headphones'})
+    monkeypatch.undo()
+    with app.app_context():
+        db.session.rollback()
+    assert names(admin_client.get('/api/search?q=rolled')) == []
+    assert names(admin_client.get('/api/search?q=studio')) == ['Studio Headphones']
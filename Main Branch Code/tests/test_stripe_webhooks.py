@@ -0,0 +1,56 @@
+"""Stripe webhooks are verified, stored once and applied once"""
+import json
+import uuid
+
+from job_queue import job_queue
+from models import db, Order, User
+from stripe_webhooks import build_event, sign_payload, SUCCEEDED
+
+SECRET = 'whsec_test'
+
+
+def post_event(client, payload, secret=SECRET):
+    return client.post('/api/webhooks/stripe', data=payload, content_type='application/json',
+                       headers={'Stripe-Signature': sign_payload(payload, secret)})
+
+
+def test_redelivered_event_is_applied_once(make_app):
+    app = make_app(STRIPE_WEBHOOK_SECRET=SECRET)
+    with app.app_context():
+        user = User.query.filter_by(email='admin@shopeasy.com').one()
+        order = Order(
+            order_number=f'ORD-{uuid.uuid4().hex[:8].upper()}',
+            user_id=user.id,
+            total_amount=25.0,
+            status='pending',
+            payment_status='pending',
+            payment_id=f'pi_{uuid.uuid4().hex[:24]}',
+            shipping_name='Test User',
+            shipping_email=user.email
+        )
+        db.session.add(order)
+        db.session.commit()
+        order_id = order.id
+        payload = json.dumps(build_event(SUCCEEDED, order))
+
+    client = app.test_client()
+    first = post_event(client, payload)
+    assert first.status_code == 200
+    assert first.get_json() == {'received': True, 'queued': True}
+    assert post_event(client, payload).get_json() == {'received': True, 'queued': False}
+
+    with app.app_context():
+        job_queue.run_pending()
+        order = db.session.get(Order, order_id)
+        assert (order.status, order.payment_status) == ('confirmed', 'completed')
+
+
+def test_bad_signature_is_rejected(make_app):
+    app = make_app(STRIPE_WEBHOOK_SECRET=SECRET)
+    payload = json.dumps({'id': 'evt_forged', 'type': SUCCEEDED, 'data': {'object': {}}})
+    response = post_event(app.test_client(), payload, secret='whsec_wrong')
+    assert response.status_code == 400
+
+
+def test_unconfigured_webhook_answers_503(app):
+    assert post_event(app.test_client(), '{}').status_code == 503